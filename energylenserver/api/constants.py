@@ -10,6 +10,7 @@ ENERGY_WASTAGE_NOTIF_API = "energy/wastage/notification/"
 GROUND_TRUTH_NOTIF_API = "energy/report/notification/"
 
 TRAINING_API = "data/training/"
+TRAINING_STATUS_API = "data/training/status/"
 REAL_TIME_POWER_API = "power/real-time/"
 REAL_TIME_POWER_PAST_API = "power/real-time/past/"
 REASSIGN_INFERENCE_API = "inference/reassign/"
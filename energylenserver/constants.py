@@ -3,9 +3,28 @@
 SERVER_IP = '192.168.1.238'
 # SERVER_IP = 'energy.iiitd.edu.in'
 
+# sMAP archiver
+SMAP_URL = 'http://' + SERVER_IP + ':9306'
+
 # Participating apartments
 apt_no_list = ['1201', '101', '103']  # , '102A']
 
+# Minimum time (in seconds) between checks for changes in the configuration
+# of an apartment (see models/snapshot.py)
+config_check_interval = 2
+
+# Registry of the uploaded phone data files (UploadedFile)
+# Time (in seconds) for which a processed file is remembered
+upload_dedup_ttl = 5 * 24 * 3600
+# Time (in seconds) after which the claim of a worker that did not finish
+# processing a file can be taken over
+upload_claim_timeout = 600
+# Number of rows of an uploaded file processed at a time
+upload_chunk_size = 20000
+
+# Compress the raw audio samples (int16) stored with zlib
+rawaudio_compress = True
+
 # Default users
 unknown_id = 123456789123456
 all_id = 987654321654321
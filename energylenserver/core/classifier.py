@@ -26,6 +26,7 @@ from energylenserver.models.DataModels import WiFiTestData
 from energylenserver.common_imports import *
 from energylenserver.core import functions as func
 from energylenserver.models import functions as mod_func
+from energylenserver.models.snapshot import get_snapshot
 from energylenserver.preprocessing import wifi as pre_p_w
 from energylenserver.preprocessing import audio as pre_p_a
 from constants import lower_mdp_percent_change, upper_mdp_percent_change, no_test_data
@@ -80,9 +81,7 @@ def get_trained_model(sensor, apt_no, phone_model):
             if filename_arr[0] == str(apt_no) and filename_arr[1] == phone_model:
                 n_trained_appl = int(filename_arr[2])
                 # Number of appliances in the metadata
-                data = mod_func.retrieve_metadata(apt_no)
-                metadata_df = read_frame(data, verbose=False)
-                metadata_df['appliance'] = metadata_df.appliance.apply(lambda s: s.split('_')[0])
+                metadata_df = get_snapshot(apt_no).metadata(strip_state=True)
                 # metadata_df = metadata_df[-metadata_df.appliance.isin(['Fridge'])]
                 m_appl_count = len(metadata_df.appliance.unique())
 
@@ -170,16 +169,17 @@ def correct_label(label, pred_label, label_type, edge, act_location):
     old_label = label
 
     # Get Metadata
-    data = mod_func.retrieve_metadata(apt_no)
-    metadata_df = read_frame(data, verbose=False)
+    snapshot = get_snapshot(apt_no)
+    metadata_df = snapshot.metadata()
+    md_index = snapshot.metadata_index()
 
     # Check if it matches with the metadata
     if label_type == "location":
         in_metadata, matched_md_l = func.exists_in_metadata(
-            apt_no, label, "all", magnitude, metadata_df, logger, "dummy_user")
+            apt_no, label, "all", magnitude, metadata_df, logger, "dummy_user", index=md_index)
     else:
         in_metadata, matched_md_l = func.exists_in_metadata(
-            apt_no, "all", label, magnitude, metadata_df, logger, "dummy_user")
+            apt_no, "all", label, magnitude, metadata_df, logger, "dummy_user", index=md_index)
 
     # Indicates the (label, edge_mag) does not exist --> incorrect label
     if not in_metadata:
@@ -187,7 +187,8 @@ def correct_label(label, pred_label, label_type, edge, act_location):
         logger.debug("Label not found in Metadata. Checking all entries..")
 
         in_metadata, matched_md_list = func.exists_in_metadata(
-            apt_no, "not_all", "not_all", magnitude, metadata_df, logger, "dummy_user")
+            apt_no, "not_all", "not_all", magnitude, metadata_df, logger, "dummy_user",
+            index=md_index)
 
         # Correction only if the inferred appliance is not audio
         if in_metadata:
@@ -386,13 +387,13 @@ def classify_appliance(apt_no, start_time, end_time, user, edge, n_users_at_home
         appliance = "Unknown"
 
         # Get Metadata
-        data = mod_func.retrieve_metadata(apt_no)
-        metadata_df = read_frame(data, verbose=False)
+        snapshot = get_snapshot(apt_no)
+        metadata_df = snapshot.metadata()
 
         # Check for existence
         in_metadata, matched_md = func.exists_in_metadata(
             apt_no, "not_all", "not_all", math.fabs(edge.magnitude), metadata_df,
-            logger, user.dev_id)
+            logger, user.dev_id, index=snapshot.metadata_index())
         if in_metadata:
             # --Classify using metadata--
             md_df = pd.concat(matched_md)
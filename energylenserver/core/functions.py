@@ -1,5 +1,4 @@
 import os
-import math
 import pandas as pd
 import numpy as np
 from django.conf import settings
@@ -8,10 +7,11 @@ from django_pandas.io import read_frame
 from common_imports import *
 from constants import WIFI_THRESHOLD, stay_duration
 from energylenserver.models import functions as mod_func
+from energylenserver.models.snapshot import get_snapshot
 from energylenserver.core import location as lc
 from energylenserver.core import movement as acl
+from energylenserver.core import metadata_index as md_index
 from energylenserver.preprocessing import wifi as pre_p_w
-from constants import lower_mdp_percent_change, upper_mdp_percent_change
 
 """
 Contains common functions
@@ -60,68 +60,35 @@ def get_max_class(pred_label_list):
     return pred_label
 
 
-def exists_in_metadata(apt_no, location, appliance, magnitude, metadata_df, l_logger, dev_id):
+def exists_in_metadata(apt_no, location, appliance, magnitude, metadata_df, l_logger, dev_id,
+                       index=None):
     """
     Checks if edge of specified magnitude exists in the metadata
+    Returns the matched entries as a single frame in the list
+
+    :param index: index of the metadata (ApartmentSnapshot.metadata_index()
+    of the snapshot metadata_df comes from), built from metadata_df if not given
     """
+    if len(metadata_df) == 0:
+        return False, []
+
+    # Callers use the appliance names without the state suffix afterwards
+    if metadata_df.appliance.str.contains('_').any():
+        metadata_df['appliance'] = md_index.appliance_names(metadata_df)
+
+    if index is None:
+        index = md_index.MetadataIndex(metadata_df)
+    rows = index.lookup(magnitude, location, appliance)
+    if len(rows) == 0:
+        return False, []
+
+    for i in rows:
+        l_logger.debug("Location: %s Appliance: %s Power: %s", index.location[i],
+                       index.appliance[i], index.power[i])
+        l_logger.debug("For edge with magnitude %s :: [min_power=%s, max_power=%s]", magnitude,
+                       index.min_power[i], index.max_power[i])
 
-    metadata_df['appliance'] = metadata_df.appliance.apply(lambda s: s.split('_')[0])
-
-    if (appliance == "all" and location == "all") or (appliance == "not_all"
-                                                      and location == "not_all"):
-        mdf = metadata_df.copy()
-    elif appliance != "all" and location != "all":
-        # Extract metadata for the current location and appliance of the user
-        mdf = metadata_df[(metadata_df.location == location) &
-                          (metadata_df.appliance == appliance)]
-        # l_logger.debug("Metadata: \n%s", mdf)
-    elif appliance == "all" and location != "all":
-        # Extract metadata for the current location of the user
-        mdf = metadata_df[(metadata_df.location == location)]
-        # l_logger.debug("Metadata: \n%s", mdf)
-    elif appliance != "all" and location == "all":
-            # Extract metadata for the current appliance of the user
-        mdf = metadata_df[(metadata_df.appliance == appliance)]
-        # l_logger.debug("Metadata: \n%s", mdf)
-
-    df_list = []
-    status = []
-    for md_i in mdf.index:
-        md_power = mdf.ix[md_i]['power']
-        md_appl = mdf.ix[md_i]['appliance']
-        md_loc = mdf.ix[md_i]['location']
-        md_audio = mdf.ix[md_i]['audio_based']
-        md_presence = mdf.ix[md_i]['presence_based']
-
-        min_md_power = math.floor(md_power - lower_mdp_percent_change * md_power)
-        max_md_power = math.ceil(md_power + upper_mdp_percent_change * md_power)
-
-        # Matching metadata with inferred
-        if magnitude >= min_md_power and magnitude <= max_md_power:
-
-            # Compare magnitude and metadata power draw
-            l_logger.debug("Location: %s Appliance: %s Power: %s", md_loc, md_appl, md_power)
-            l_logger.debug("For edge with magnitude %s :: [min_power=%s, max_power=%s]", magnitude,
-                           min_md_power, max_md_power)
-
-            md_power_diff = math.fabs(md_power - magnitude)
-            # if location != "all" or appliance != "all":
-            df_list.append(
-                pd.DataFrame({'dev_id': dev_id, 'md_loc': md_loc,
-                              'md_appl': md_appl,
-                              'md_power_diff': md_power_diff,
-                              'md_audio': md_audio,
-                              'md_presence': md_presence}, index=[magnitude]))
-            # else:
-            #     df_list.append(mdf.ix[md_i])
-            status.append(True)
-        else:
-            status.append(False)
-
-    if True in status:
-        return True, df_list
-    else:
-        return False, df_list
+    return True, [index.matches(rows, magnitude, dev_id)]
 
 
 def determine_multi_state(metadata_df, location, appliance):
@@ -152,13 +119,13 @@ def determine_user_home_status(start_time, end_time, apt_no):
     user_list = []
 
     try:
-        occupants = mod_func.retrieve_users(apt_no)
-        occupants_df = read_frame(occupants, verbose=False)
+        snapshot = get_snapshot(apt_no)
+        occupants_df = snapshot.occupants()
 
         dev_id_list = occupants_df.dev_id.tolist()
 
         # Get Home AP
-        home_ap = mod_func.get_home_ap(apt_no)
+        home_ap = snapshot.home_ap
 
         # Setting the start time to be 5 minutes before the event time
         start_time = start_time - 4 * 60
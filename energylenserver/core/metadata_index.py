@@ -0,0 +1,113 @@
+"""
+Power interval index over the Metadata of an apartment
+
+Each Metadata entry matches the edge magnitudes in
+[floor(power - lower_mdp_percent_change * power),
+ ceil(power + upper_mdp_percent_change * power)]
+Both bounds grow with the power, so with the entries sorted by power the
+entries matching a magnitude are a contiguous run, found with two binary
+searches. The entries are also grouped by location, appliance and
+(location, appliance), each group sorted the same way
+"""
+
+import numpy as np
+import pandas as pd
+
+from common_imports import *
+from constants import lower_mdp_percent_change, upper_mdp_percent_change
+
+
+def appliance_names(metadata_df):
+    """
+    Returns the appliance names without the state suffix (e.g. AC_1 -> AC)
+    """
+    return metadata_df.appliance.str.split('_').str[0]
+
+
+class PowerIntervals:
+
+    """
+    Sorted [min_power, max_power] bounds of a group of metadata entries
+    """
+
+    def __init__(self, rows, min_power, max_power):
+        # rows: positions of the entries in the metadata frame
+        self.rows = rows
+        self.min_power = min_power
+        self.max_power = max_power
+        # Upper bounds may only be out of order for negative power values
+        self.sorted_max = bool(np.all(np.diff(max_power) >= 0))
+
+    def stab(self, magnitude):
+        """
+        Returns the positions of the entries whose interval contains the magnitude
+        """
+        end = np.searchsorted(self.min_power, magnitude, side='right')
+        if self.sorted_max:
+            start = np.searchsorted(self.max_power[:end], magnitude, side='left')
+            return self.rows[start:end]
+        return self.rows[:end][self.max_power[:end] >= magnitude]
+
+
+class MetadataIndex:
+
+    """
+    Interval index of the metadata entries of an apartment
+    """
+
+    def __init__(self, metadata_df):
+        power = metadata_df.power.values.astype('float64')
+        self.power = power
+        self.location = metadata_df.location.values.astype('object')
+        self.appliance = appliance_names(metadata_df).values.astype('object')
+        self.audio_based = metadata_df.audio_based.values
+        self.presence_based = metadata_df.presence_based.values
+
+        min_power = np.floor(power - lower_mdp_percent_change * power)
+        max_power = np.ceil(power + upper_mdp_percent_change * power)
+
+        order = np.lexsort((max_power, min_power))
+        groups = {('all', 'all'): order}
+        for key, rows in self.group_rows(order).iteritems():
+            groups[key] = rows
+
+        self.min_power = min_power
+        self.max_power = max_power
+        self.intervals = dict((key, PowerIntervals(rows, min_power[rows], max_power[rows]))
+                              for key, rows in groups.iteritems())
+
+    def group_rows(self, order):
+        """
+        Splits the sorted positions by location, appliance and both
+        """
+        groups = {}
+        for i in order:
+            for key in [(self.location[i], 'all'), ('all', self.appliance[i]),
+                        (self.location[i], self.appliance[i])]:
+                groups.setdefault(key, []).append(i)
+        return dict((key, np.array(rows, dtype='int64')) for key, rows in groups.iteritems())
+
+    def lookup(self, magnitude, location="all", appliance="all"):
+        """
+        Returns the positions (in metadata order) of the entries of the
+        location and appliance matching the magnitude
+        """
+        if location == "not_all" and appliance == "not_all":
+            location, appliance = "all", "all"
+        intervals = self.intervals.get((location, appliance))
+        if intervals is None:
+            return np.zeros(0, dtype='int64')
+        return np.sort(intervals.stab(magnitude))
+
+    def matches(self, rows, magnitude, dev_id):
+        """
+        Returns the matched entries as a frame, one row per entry indexed by the magnitude
+        """
+        return pd.DataFrame({'dev_id': dev_id,
+                             'md_loc': self.location[rows],
+                             'md_appl': self.appliance[rows],
+                             'md_power_diff': np.fabs(self.power[rows] - magnitude),
+                             'md_audio': self.audio_based[rows],
+                             'md_presence': self.presence_based[rows]},
+                            index=[magnitude] * len(rows))
+
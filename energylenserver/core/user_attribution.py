@@ -6,6 +6,7 @@ from django_pandas.io import read_frame
 
 from common_imports import *
 from energylenserver.models import functions as mod_func
+from energylenserver.models.snapshot import get_snapshot
 from classifier import classify_activity, correct_label
 from functions import exists_in_metadata
 from energylenserver.common_offline import *
@@ -27,8 +28,9 @@ def identify_user(apt_no, magnitude, location, appliance, user_list, edge):
     edge_time = edge.timestamp
 
     # Get Metadata
-    data = mod_func.retrieve_metadata(apt_no)
-    metadata_df = read_frame(data, verbose=False)
+    snapshot = get_snapshot(apt_no)
+    metadata_df = snapshot.metadata()
+    md_index = snapshot.metadata_index()
 
     md_df = metadata_df.copy()
 
@@ -58,7 +60,7 @@ def identify_user(apt_no, magnitude, location, appliance, user_list, edge):
 
         # Check if edge exists in the metadata for the current location
         in_metadata, tmp_list = exists_in_metadata(
-            apt_no, loc_user, "all", m_magnitude, metadata_df, logger, dev_id)
+            apt_no, loc_user, "all", m_magnitude, metadata_df, logger, dev_id, index=md_index)
 
         df_list = df_list + tmp_list
 
@@ -0,0 +1,212 @@
+"""
+Rebuilds the edges of the apartments over a past time range
+
+The range is split into chunks of backfill_chunk_size seconds per apartment.
+The chunks are fetched (from sMAP or the local meter archive) and run through
+edge detection in parallel worker processes. Each chunk is extended by
+backfill_overlap seconds on both sides, so that the edges near its boundaries
+are detected as over the whole stream, and only the edges within the chunk
+are kept. The edges are stored in time order without classification.
+
+By default the backfill is additive: edges already stored are skipped, so a
+range can be backfilled again, but edges stored before (e.g. detected with
+other thresholds) are kept. In replace mode, the edges of each meter within
+a chunk are deleted before the edges detected are stored, except the edges
+with events inferred from them
+
+Usage: python manage.py backfill_edges <start> <end> [smap|archive] [add|replace] [<apt_no> ...]
+Time format: YYYY-MM-DDTHH:MM:SS or YYYY-MM-DD
+"""
+
+import os
+import sys
+import time
+import multiprocessing
+
+# Django imports
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connection
+
+# EnergyLens+ imports
+from energylenserver.common_imports import *
+from energylenserver.constants import apt_no_list
+from energylenserver.functions import timestamp_to_str
+from energylenserver.meter import archive
+from energylenserver.meter import smap
+from energylenserver.meter.edge_detection import detect_edges, filter_detected_edges
+from energylenserver.models.models import MeterInfo, Edges
+from energylenserver.tasks import store_edges
+
+# Enable Logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+# Global variables
+time_formats = ["%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+smap_date_format = "%Y-%m-%dT%H:%M:%S"
+archive_folder = os.path.join(settings.BASE_DIR, 'energylenserver/data/meter/')
+
+
+def parse_time(time_str):
+    for time_format in time_formats:
+        try:
+            return int(time.mktime(time.strptime(time_str, time_format)))
+        except ValueError:
+            continue
+    raise ValueError("Invalid time: %s" % time_str)
+
+
+def fetch_chunk(source, apt_no, uuids, start_time, end_time):
+    """
+    Retrieves the meter data of the apartment between start and end time
+
+    Returns: dict of uuid -> dataframe with <time, power>
+    """
+    if source == 'archive':
+        return dict((uuid, archive.read_meter_data(archive_folder, uuid, start_time, end_time))
+                    for uuid in uuids)
+
+    streams = smap.client.get_data([apt_no], timestamp_to_str(start_time, smap_date_format),
+                                   timestamp_to_str(end_time, smap_date_format))
+    frames = {}
+    for uuid, m_type, readings in streams[apt_no]:
+        if len(readings) > 0:
+            frames[uuid] = smap.streams_to_frames([(uuid, m_type, readings)])[0]
+    return frames
+
+
+def backfill_chunk(chunk):
+    """
+    Detects the edges of the meters of an apartment in a chunk
+    Runs in a worker process
+
+    Returns: chunk, list of (uuid, edges) of the meters with data in the chunk,
+    number of samples, time taken and error (if any)
+    """
+    source, apt_no, uuids, start_time, end_time = chunk
+    start = time.time()
+    meter_edges = []
+    n_samples = 0
+    try:
+        frames = fetch_chunk(source, apt_no, uuids, start_time - backfill_overlap,
+                             end_time + backfill_overlap)
+        for uuid in uuids:
+            df = frames.get(uuid)
+            if df is None or len(df) == 0:
+                continue
+            n_samples += len(df)
+
+            df = df.sort(['time']).drop_duplicates(cols='time', take_last=True)
+            df.reset_index(drop=True, inplace=True)
+            edges_df = filter_detected_edges(detect_edges(df))
+            if edges_df is None:
+                continue
+
+            # Edges in the overlap belong to the neighbouring chunks
+            edges_df = edges_df[(edges_df.time >= start_time) & (edges_df.time < end_time)]
+            meter_edges.append((uuid, edges_df))
+    except Exception, e:
+        logger.exception("[BackfillChunkException]:: %s", e)
+        return chunk, [], n_samples, time.time() - start, str(e)
+
+    return chunk, meter_edges, n_samples, time.time() - start, None
+
+
+def make_chunks(source, apt_meters, start_time, end_time, chunk_size=backfill_chunk_size):
+    """
+    Splits the time range of each apartment into chunks, ordered by time
+    """
+    chunks = []
+    for c_start in range(start_time, end_time, chunk_size):
+        c_end = min(c_start + chunk_size, end_time)
+        for apt_no, uuids in sorted(apt_meters.iteritems()):
+            chunks.append((source, apt_no, uuids, c_start, c_end))
+    return chunks
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the edges of the apartments over a past time range"
+
+    def handle(self, *args, **options):
+
+        try:
+            start_time = parse_time(args[0])
+            end_time = parse_time(args[1])
+            source = args[2] if len(args) > 2 else 'smap'
+            mode = 'add'
+            apt_args = args[3:]
+            if len(apt_args) > 0 and apt_args[0] in ['add', 'replace']:
+                mode = apt_args[0]
+                apt_args = apt_args[1:]
+            apt_list = [int(apt_no) for apt_no in apt_args]
+            if source not in ['smap', 'archive'] or end_time <= start_time:
+                raise ValueError(source)
+        except (IndexError, ValueError):
+            self.stdout.write("Usage: python manage.py backfill_edges "
+                              "<start> <end> [smap|archive] [add|replace] [<apt_no> ...]")
+            return
+
+        try:
+            if len(apt_list) == 0:
+                apt_list = [int(smap.db_apt_no(apt_no)) for apt_no in apt_no_list]
+
+            meters = dict((meter.meter_uuid, meter)
+                          for meter in MeterInfo.objects.filter(apt_no__in=apt_list))
+            apt_meters = {}
+            for uuid, meter in meters.iteritems():
+                apt_meters.setdefault(meter.apt_no, []).append(uuid)
+            if len(apt_meters) == 0:
+                self.stdout.write("No meters found for %s" % apt_list)
+                return
+
+            chunks = make_chunks(source, apt_meters, start_time, end_time)
+            self.stdout.write("Backfilling %d meter(s) of %d apartment(s) from %s (%s): "
+                              "%d chunk(s)" % (len(meters), len(apt_meters), source, mode,
+                                               len(chunks)))
+
+            # The workers open their own database connections
+            connection.close()
+            pool = multiprocessing.Pool(backfill_workers)
+
+            start = time.time()
+            n_samples = n_detected = n_stored = n_deleted = n_failed = 0
+            # Results arrive in chunk order, so the edges are stored in time order
+            results = pool.imap(backfill_chunk, chunks)
+            for i, (chunk, meter_edges, c_samples, c_elapsed, error) in enumerate(results):
+                source, apt_no, uuids, c_start, c_end = chunk
+                if error is not None:
+                    n_failed += 1
+                    self.stdout.write("Chunk %s [%s - %s] failed: %s" %
+                                      (apt_no, time.ctime(c_start), time.ctime(c_end), error))
+
+                n_samples += c_samples
+                for uuid, edges_df in meter_edges:
+                    if mode == 'replace':
+                        # Edges of the events inferred are kept
+                        stale = Edges.objects.filter(meter=meters[uuid], timestamp__gte=c_start,
+                                                     timestamp__lt=c_end,
+                                                     eventlog__isnull=True)
+                        n_deleted += stale.count()
+                        stale.delete()
+                    n_detected += len(edges_df)
+                    n_stored += store_edges(meters[uuid], edges_df, classify=False)
+
+                elapsed = max(time.time() - start, 1e-9)
+                self.stdout.write("[%d/%d] %s %s: %d samples/s, %d edges detected, "
+                                  "%d stored, %.0fs left" %
+                                  (i + 1, len(chunks), apt_no, time.ctime(c_start),
+                                   n_samples / elapsed, n_detected, n_stored,
+                                   elapsed / (i + 1) * (len(chunks) - i - 1)))
+
+            pool.close()
+            pool.join()
+            self.stdout.write("Done in %.1fs: %d samples, %d edges detected, %d stored, "
+                              "%d deleted, %d chunk(s) failed" %
+                              (time.time() - start, n_samples, n_detected, n_stored,
+                               n_deleted, n_failed))
+
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted by user, shutting down..")
+            sys.exit(0)
+        except Exception, e:
+            logger.exception("[BackfillEdgesException] %s" % str(e))
@@ -0,0 +1,119 @@
+"""
+Benchmarks the edge detection implementations over synthetic meter traces
+
+Each implementation is run in a separate process over the same traces and
+compared against the edges injected in the traces (see meter/synthetic.py)
+
+Usage: python manage.py benchmark_edges [<hours>] [<no_of_meters>] [<seed>]
+"""
+
+import sys
+import time
+import resource
+import multiprocessing
+
+import pandas as pd
+
+# Django imports
+from django.core.management.base import BaseCommand
+
+# EnergyLens+ imports
+from energylenserver.common_imports import *
+from energylenserver.meter import synthetic
+from energylenserver.meter.edge_detection import (detect_edges, detect_and_filter_edges,
+                                                  StreamingEdgeDetector)
+
+# Enable Logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+
+def streaming_detect_edges(df):
+    detector = StreamingEdgeDetector('benchmark')
+    edges_df = detector.add_readings(zip(df['time'].values, df['power'].values))
+    return pd.concat([edges_df, detector.flush()])
+
+
+# Detector implementations
+implementations = [
+    ("iterative", lambda df: detect_edges(df, iterative=True)),
+    ("array", detect_edges),
+    ("streaming", streaming_detect_edges),
+    ("array+filters", detect_and_filter_edges),
+]
+
+
+def run_implementation(func, meters, result_queue):
+    """
+    Runs the detector over all the meter traces
+    Peak memory is measured as the increase of the max resident set size
+    of the process
+    """
+    try:
+        base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        edges_list = []
+        start = time.time()
+        for uuid, trace_df, truth_df in meters:
+            edges_list.append(func(trace_df.copy()))
+        elapsed = time.time() - start
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss
+        result_queue.put((elapsed, peak_rss, edges_list))
+    except Exception, e:
+        logger.exception("[BenchmarkEdgesException] %s" % str(e))
+        result_queue.put(None)
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the edge detection over synthetic meter traces"
+
+    def handle(self, *args, **options):
+
+        try:
+            hours = float(args[0]) if len(args) > 0 else 1
+            n_meters = int(args[1]) if len(args) > 1 else 2
+            seed = int(args[2]) if len(args) > 2 else 0
+        except ValueError:
+            self.stdout.write("Usage: python manage.py benchmark_edges "
+                              "[<hours>] [<no_of_meters>] [<seed>]")
+            return
+
+        try:
+            start_time = int(time.time()) - int(hours * 3600)
+            meters = synthetic.generate_meters(n_meters, start_time, int(hours * 3600), seed)
+            n_samples = sum(len(trace_df) for uuid, trace_df, truth_df in meters)
+            n_truth = sum(len(truth_df) for uuid, trace_df, truth_df in meters)
+            self.stdout.write("%d meter(s), %d samples, %d injected edges" %
+                              (n_meters, n_samples, n_truth))
+
+            self.stdout.write("%-15s %12s %10s %8s %10s %10s %7s" %
+                              ("detector", "samples/s", "edges/s", "edges",
+                               "peak mem", "precision", "recall"))
+            for name, func in implementations:
+                result_queue = multiprocessing.Queue()
+                worker = multiprocessing.Process(target=run_implementation,
+                                                 args=(func, meters, result_queue))
+                worker.start()
+                result = result_queue.get()
+                worker.join()
+                if result is None:
+                    self.stdout.write("%-15s failed" % name)
+                    continue
+
+                elapsed, peak_rss, edges_list = result
+                matched = n_edges = 0
+                for (uuid, trace_df, truth_df), edges_df in zip(meters, edges_list):
+                    n_edges += len(edges_df)
+                    matched += synthetic.match_edges(edges_df, truth_df)[0]
+                precision = float(matched) / n_edges if n_edges > 0 else 0.
+                recall = float(matched) / n_truth if n_truth > 0 else 0.
+
+                elapsed = max(elapsed, 1e-9)
+                # ru_maxrss is in kilobytes
+                self.stdout.write("%-15s %12.0f %10.1f %8d %8.1fMB %10.3f %7.3f" %
+                                  (name, n_samples / elapsed, n_edges / elapsed, n_edges,
+                                   peak_rss / 1024., precision, recall))
+
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted by user, shutting down..")
+            sys.exit(0)
+        except Exception, e:
+            logger.exception("[BenchmarkEdgesException] %s" % str(e))
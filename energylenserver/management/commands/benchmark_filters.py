@@ -0,0 +1,103 @@
+"""
+Benchmarks the edge filters over the stored edges of an apartment
+
+Compares the array implementations of the filters with the iterative ones
+on the edges of the last <no_of_days> days of each meter
+
+Usage: python manage.py benchmark_filters <apt_no> [<no_of_days>]
+"""
+
+import sys
+import time
+
+from django_pandas.io import read_frame
+
+# Django imports
+from django.core.management.base import BaseCommand
+
+# EnergyLens+ imports
+from energylenserver.common_imports import *
+from energylenserver.meter import filters
+from energylenserver.models import functions as mod_func
+from energylenserver.models.models import Edges
+
+# Enable Logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+
+def run_filter(func, df):
+    """
+    Runs the filter on a copy of the edges
+
+    Returns: filtered edges and time taken (in seconds)
+    """
+    df = df.copy()
+    start = time.time()
+    result = func(df)
+    return result, time.time() - start
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the edge filters over the stored edges"
+
+    def write_result(self, name, n_edges, result_iter, result_arr):
+        """
+        Prints the timings and checks that both filters select the same edges
+        """
+        (df_iter, t_iter), (df_arr, t_arr) = result_iter, result_arr
+        identical = sorted(df_iter.index.tolist()) == sorted(df_arr.index.tolist())
+        speedup = t_iter / t_arr if t_arr > 0 else float('inf')
+        self.stdout.write("%s:: %d edges -> %d | iterative %.3fs array %.3fs (x%.1f) "
+                          "identical: %s" % (name, n_edges, len(df_arr), t_iter, t_arr,
+                                             speedup, identical))
+
+    def handle(self, *args, **options):
+
+        try:
+            apt_no = int(args[0])
+            n_days = int(args[1]) if len(args) > 1 else 7
+
+            for meter in mod_func.retrieve_meter_info(apt_no):
+                uuid = meter['uuid']
+
+                edges = Edges.objects.filter(meter_id=uuid)
+                if edges.count() == 0:
+                    self.stdout.write("No edges for meter %s" % uuid)
+                    continue
+
+                end_time = float(edges.latest('timestamp').timestamp)
+                start_time = end_time - n_days * 24 * 3600
+                edges = edges.filter(timestamp__gte=start_time).order_by('timestamp')
+                edges_df = read_frame(edges, fieldnames=['timestamp', 'magnitude', 'type',
+                                                         'curr_power'],
+                                      coerce_float=True, verbose=False)
+                edges_df.rename(columns={'timestamp': 'time'}, inplace=True)
+
+                self.stdout.write("Meter %s [%s] :: %d edges between %s and %s" %
+                                  (uuid, meter['type'], len(edges_df),
+                                   time.ctime(start_time), time.ctime(end_time)))
+
+                # Per edge type filter, as applied in detect_edges
+                for edge_type in ["rising", "falling"]:
+                    type_df = edges_df[edges_df.type == edge_type].reset_index(drop=True)
+                    type_df.insert(0, 'index', type_df.index)
+                    if len(type_df) == 0:
+                        continue
+                    self.write_result(
+                        "filter_select_maxtime_edge [%s]" % edge_type, len(type_df),
+                        run_filter(filters.filter_select_maxtime_edge_iterative, type_df),
+                        run_filter(filters.filter_select_maxtime_edge, type_df))
+
+                # Filter over both edge types, as applied in detect_and_filter_edges
+                self.write_result(
+                    "filter_unmon_appl_edges", len(edges_df),
+                    run_filter(filters.filter_unmon_appl_edges_iterative, edges_df),
+                    run_filter(filters.filter_unmon_appl_edges, edges_df))
+
+        except IndexError:
+            self.stdout.write("Usage: python manage.py benchmark_filters <apt_no> [<no_of_days>]")
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted by user, shutting down..")
+            sys.exit(0)
+        except Exception, e:
+            logger.exception("[BenchmarkFiltersException] %s" % str(e))
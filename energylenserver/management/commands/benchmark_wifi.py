@@ -0,0 +1,103 @@
+"""
+Benchmarks the formatting of the uploaded WiFi scans
+
+Compares the grouped implementation of wifi.format_data with the iterative
+one on a WiFi data file, or on synthetic scans of <n_aps> access points
+over <minutes> minutes (one scan every 2 seconds)
+
+Usage: python manage.py benchmark_wifi <csv file>
+       python manage.py benchmark_wifi [<n_aps> [<minutes>]]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Django imports
+from django.core.management.base import BaseCommand
+
+# EnergyLens+ imports
+from energylenserver.common_imports import *
+from energylenserver.preprocessing import wifi
+
+# Enable Logging
+logger = logging.getLogger('energylensplus_django')
+
+
+def synthetic_scans(n_aps, minutes, start_time=1400000000000, seed=0):
+    """
+    Generates WiFi scans: every 2 seconds a random subset of the access
+    points is seen, each once or twice, with the labels of a phone moving
+    between two locations
+
+    Returns: dataframe with <time, mac, ssid, rssi, label>
+    """
+    rng = np.random.RandomState(seed)
+    n_scans = minutes * 30
+
+    seen = rng.rand(n_scans, n_aps) < 0.6
+    repeats = rng.randint(1, 3, size=seen.shape) * seen
+    scan_idx, ap_idx = np.nonzero(repeats)
+    counts = repeats[scan_idx, ap_idx]
+    scan_idx = np.repeat(scan_idx, counts)
+    ap_idx = np.repeat(ap_idx, counts)
+
+    n = len(scan_idx)
+    times = start_time + scan_idx * 2000 + rng.randint(0, 1000, n)
+    labels = np.where(scan_idx < n_scans / 2, 'Bedroom', 'Kitchen')
+
+    return pd.DataFrame({'time': times,
+                         'mac': ['00:1a:%02x:%02x' % (i / 256, i % 256) for i in ap_idx],
+                         'ssid': ['AP-%d' % (i % 50) for i in ap_idx],
+                         'rssi': rng.randint(-95, -30, n),
+                         'label': labels},
+                        columns=['time', 'mac', 'ssid', 'rssi', 'label'])
+
+
+def run_format(func, df):
+    """
+    Formats a copy of the scans
+
+    Returns: formatted scans and time taken (in seconds)
+    """
+    df = df.copy()
+    start = time.time()
+    result = func(df)
+    return result, time.time() - start
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the formatting of the uploaded WiFi scans"
+
+    def handle(self, *args, **options):
+
+        try:
+            if len(args) > 0 and os.path.isfile(args[0]):
+                scans_df = pd.read_csv(args[0], error_bad_lines=False)
+                source = args[0]
+            else:
+                n_aps = int(args[0]) if len(args) > 0 else 300
+                minutes = int(args[1]) if len(args) > 1 else 10
+                scans_df = synthetic_scans(n_aps, minutes)
+                source = "%d APs x %d minutes" % (n_aps, minutes)
+
+            df_iter, t_iter = run_format(wifi.format_data_iterative, scans_df)
+            df_grp, t_grp = run_format(wifi.format_data, scans_df)
+
+            identical = df_iter.equals(df_grp) and df_iter.index.equals(df_grp.index)
+            speedup = t_iter / t_grp if t_grp > 0 else float('inf')
+            self.stdout.write("%s:: %d scans -> %d | iterative %.3fs grouped %.3fs (x%.1f) "
+                              "identical: %s" % (source, len(scans_df), len(df_grp), t_iter,
+                                                 t_grp, speedup, identical))
+
+        except ValueError:
+            self.stdout.write("Usage: python manage.py benchmark_wifi <csv file> | "
+                              "[<n_aps> [<minutes>]]")
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted by user, shutting down..")
+            sys.exit(0)
+        except Exception, e:
+            logger.exception("[BenchmarkWifiException] %s" % str(e))
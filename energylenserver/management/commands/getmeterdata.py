@@ -7,12 +7,13 @@ and pass them to the edge_detection API on the EnergyLens+ Server
 Things done:
     1. Retrieve meter data from smap db using republish API
     2. Store data on the disk
-    3. Detect edges and store them
+    3. Detect edges over the stream of each meter and store them
+    4. Maintain the power rollups of the apartments (see meter/rollups.py)
 
 
 Input: apt number list
-Output: csv file with timestamped power values
-Format: <timestamp, power>
+Output: daily time and power columns of each meter (see meter/archive.py)
+Format: <timestamp (ms, int64)>, <power (float32)>
 
 Author: Manaswi Saha
 Date: 27th Aug 2014
@@ -21,9 +22,6 @@ import os
 import sys
 import subprocess
 
-import csv
-import json
-import pycurl
 import datetime as dt
 
 import numpy as np
@@ -36,11 +34,15 @@ from django.conf import settings
 
 # EnergyLens+ imports
 from energylenserver.common_imports import *
-from energylenserver.constants import apt_no_list, SERVER_IP
+from energylenserver.constants import apt_no_list
 from energylenserver.functions import *
 from energylenserver.meter import smap
-from energylenserver.tasks import meterDataHandler
-from energylenserver.models.models import MeterInfo
+from energylenserver.meter.edge_engine import EdgeEngine
+from energylenserver.meter.latest_power import LatestPowerStore, serve_store
+from energylenserver.meter.ingestor import Ingestor
+from energylenserver.meter.archive import ArchiveWriter
+from energylenserver.meter.rollups import RollupWriter
+from energylenserver.tasks import meterEdgesHandler
 
 
 # Enable Logging
@@ -48,218 +50,108 @@ logger = logging.getLogger('energylensplus_meterdata')
 
 TIMEZONE = 'Asia/Kolkata'
 
-# Global variables
-STREAM_URL = "http://" + SERVER_IP + ":9306/republish"
-
-
 # Participating apartments
 # apt_no_list = ['1201']  # , '101', '1003', '1002']
 uuid_list = []
-payload = ""
+# uuid -> sMAP apartment number
+meter_apt = {}
+
+# Latest reading of each meter, shared with the server processes
+power_store = LatestPowerStore()
 
 # Destination Folder for the output files
 dst_folder = 'data/meter/'
+rollup_folder = 'data/rollups/'
 
 
 class Client:
 
-    def __init__(self):
+    def __init__(self, apt_list):
 
         logger.debug("[Initializing Client...]")
 
-        global uuid_list, payload
+        global uuid_list
 
-        self.conn = None
         self.msg_count = {}
-        self.current_file = {}
-
-        self.backoff_network_error = 0.25
-        self.backoff_http_error = 5
-        self.backoff_rate_limit = 60
+        self.writer = ArchiveWriter(dst_folder)
+        self.rollups = RollupWriter(rollup_folder)
+        # One republish stream per apartment group
+        self.ingestor = Ingestor(apt_list)
+        # Edge detection is sharded by meter across worker processes
+        self.engine = EdgeEngine()
+        self.engine.start()
+        self.last_stats_time = time.time()
 
         for i in uuid_list:
             self.msg_count[i] = 0
-            self.current_file[i] = ""
-
-        # self.setup_connection()
+            self.writer.add_meter(i)
+            self.rollups.add_meter(meter_apt[i], i)
 
-    def setup_connection(self):
+    def start(self):
         """
-        Establishes a persistent connection with the sMap server
+        Starts the streams and processes the readings received on them
         """
-        logger.debug("Setting up connection...")
 
-        if self.conn:
-            self.conn.close()
-            logger.error("Connection Closed")
+        logger.debug("Opening data streams")
+        self.ingestor.start()
+        while True:
+            item = self.ingestor.get(timeout=1)
+            if item is not None:
+                stream_name, readings = item
+                self.on_receive(readings)
 
-        self.backoff_network_error = 0.25
-        self.backoff_http_error = 5
-        self.backoff_rate_limit = 60
+            # Edges are emitted by the workers as soon as their window closes
+            self.dispatch_edges(self.engine.collect())
 
-        self.conn = pycurl.Curl()
-        self.conn.setopt(pycurl.URL, STREAM_URL)
-        self.conn.setopt(pycurl.POST, 1)
-        self.conn.setopt(pycurl.POSTFIELDS, payload)
-        self.conn.setopt(pycurl.WRITEFUNCTION, self.on_receive)
+            if time.time() - self.last_stats_time >= edge_engine_stats_interval:
+                self.engine.log_stats()
+                self.ingestor.log_health()
+                self.last_stats_time = time.time()
 
-    def start(self):
+    def dispatch_edges(self, edges):
         """
-        Starts listening to the open stream
+        Passes on the detected edges to the edge handlers
         """
+        for uuid, edges_df in edges:
+            logger.debug("[%s] Edges detected: %d", uuid, len(edges_df))
+            # Create an event and pass it on to the listeners
+            meterEdgesHandler.delay(edges_df, uuid)
 
-        logger.debug("Opening data stream")
-        while True:
-            self.setup_connection()
-            try:
-                logger.debug("Waiting for data..")
-                self.conn.perform()
-            except:
-                # Network error, use linear back off up to 16 seconds
-                logger.error('[ERROR] Network error: %s' % self.conn.errstr())
-                logger.error('[ERROR] Waiting %s seconds before trying again' %
-                             self.backoff_network_error)
-                time.sleep(self.backoff_network_error)
-                self.backoff_network_error = min(self.backoff_network_error + 1, 16)
-                continue
-            # HTTP Error
-            sc = self.conn.getinfo(pycurl.HTTP_CODE)
-            logger.error('[ERROR] CODE', sc)
-            if sc == 420:
-                # Rate limit, use exponential back off starting with 1 minute and double
-                # each attempt
-                logger.error('[ERROR] Rate limit, waiting %s seconds' % self.backoff_rate_limit)
-                time.sleep(self.backoff_rate_limit)
-                self.backoff_rate_limit *= 2
-            else:
-                # HTTP error, use exponential back off up to 320 seconds
-                logger.error('[ERROR] HTTP error %s, %s' % (sc, self.conn.errstr()))
-                logger.error('[ERROR] Waiting %s seconds' % self.backoff_http_error)
-                time.sleep(self.backoff_http_error)
-                self.backoff_http_error = min(self.backoff_http_error * 2, 320)
-
-    def create_file(self, filename):
-
-        if not os.path.isfile(filename):
-            with open(filename, "w+") as myfile:
-                writer = csv.writer(myfile)
-                writer.writerow(["time", "power"])
-
-    def write_to_file(self, filename, data):
-
-        with open(filename, "a+") as myfile:
-            writer = csv.writer(myfile)
-            writer.writerow(data)
-
-    def on_receive(self, data):
-        global dst_folder
-
-        try:
-            if data.strip():
-                try:
-                    readings = json.loads(data)
-                    # logger.debug("Readings: \n%s", readings)
-                except ValueError:
-                    # Log error
-                    logger.debug("Invalid JSON string passed. Ignoring data: %s", data)
-                    string_to_log = ["[" + time.ctime(time.time()) + "]", str(data)]
-                    logger.debug("%s", string_to_log)
-                    return
-
-                # Parse json body
-                for key in readings:
-                    record = readings[key]
-                    uuid = record['uuid']
-                    reading = np.array(record['Readings'])
-                    timestamp = reading[0, 0] / 1000
-                    value = reading[0, 1]
-                    record = [timestamp, value]
-
-                    self.msg_count[uuid] += 1
-                    msg_count = self.msg_count[uuid]
-
-                    # If first record of a new batch for the uuid, create new file
-                    if msg_count == 1:
-                        filename = (timestamp_to_str(time.time(),
-                                                     "%d-%m-%Y_%H:%M:%S") + ".csv")
-                        file_path = os.path.join(dst_folder + uuid + "/", filename)
-                        # logger.debug("File Path:\n\t%s", file_path)
-                        self.create_file(file_path)
-                        self.current_file[uuid] = file_path
-                        self.write_to_file(file_path, record)
-
-                    # 2*winmax + 1 is the minimum number of values needed for edge detection
-                    elif msg_count in range(2, 2 * winmax + 2):
-                        file_path = self.current_file[uuid]
-                        self.write_to_file(file_path, record)
-
-                        if msg_count == 2 * winmax + 1:
-                            logger.debug("[Detecting edges]...")
-                            # Reset current file and msg count for the uuid
-                            self.msg_count[uuid] = 0
-                            self.current_file[uuid] = ""
-
-                            # logger.debug("File Path:\n\t", file_path)
-
-                            prev_file = ""
-                            curr_file = os.path.basename(file_path)
-                            df = pd.read_csv(file_path)
-
-                            # Determine current uuid
-                            meter_uuid_folder = os.path.dirname(file_path)
-                            # uuid = meter_uuid_folder.split('/')[-1]
-
-                            # -- Retrieve values from previous file --
-                            folder_listing = sorted(os.listdir(meter_uuid_folder))
-                            # logger.debug("Files: %s", folder_listing)
-                            for the_file in folder_listing:
-                                if the_file.startswith("prev_"):
-                                    prev_file = the_file
-                                    prev_file = os.path.join(meter_uuid_folder, prev_file)
-                                    break
-
-                            if prev_file != "":
-                                df_prev = pd.read_csv(prev_file)
-                                # Use the last few values for edge detection
-                                df_prev = df_prev.ix[df_prev.index[1:]]
-
-                                # df_len = len(df)
-                                # Combine prev file with the current one
-                                df = pd.concat([df_prev, df]).sort("time")
-                                df = df.reset_index(drop=True)
-                                df['act_time'] = [dt.datetime.fromtimestamp(val) for val in df.time]
-
-                                # logger.debug("Length:%d %d %d", len(df_prev), df_len, len(df))
-                                del df['act_time']
-
-                                # Delete previous file
-                                try:
-                                    os.unlink(prev_file)
-                                except Exception, e:
-                                    logger.error("%s", e)
-
-                            # -- Buffer current file --
-                            # For use in the next task, rename it with prev_<filename>
-                            new_file = os.path.join(meter_uuid_folder, "prev_" + curr_file)
-                            os.renames(file_path, new_file)
-
-                            # Start the process only if participants are registered
-                            try:
-                                meter = MeterInfo.objects.get(meter_uuid=uuid)
-                            except MeterInfo.DoesNotExist, e:
-                                logger.debug("No registered users for this apt meter")
-                                return
-
-                            # Create an event and pass it on to the listeners
-                            # for consuming this file
-                            meterDataHandler.delay(df, file_path)
+    def flush(self):
+        """
+        Passes on the edges pending in the detectors of all meters
+        and stops the edge detection workers
+        """
+        self.dispatch_edges(self.engine.stop())
+        self.engine.log_stats()
 
-        except KeyboardInterrupt:
-            logger.error("\n\nInterrupted by user, shutting down..")
-            self.conn.close()
-            logger.error("Connection Closed")
+    def on_receive(self, readings):
+        """
+        Stores the readings of a stream and passes them on to edge detection
 
-            sys.exit(0)
+        :param readings: dict of uuid -> (times in ms, power) arrays
+        """
+        batch = {}
+        for uuid, (times, power) in readings.iteritems():
+            self.msg_count[uuid] = self.msg_count.get(uuid, 0) + len(times)
+            timestamps = (times / 1000).tolist()
+            values = power.tolist()
+            for timestamp, value in zip(timestamps, values):
+                self.writer.write(uuid, timestamp, value)
+            power_store.update(uuid, float(times[-1]), values[-1])
+            batch[uuid] = zip(timestamps, values)
+
+        self.rollups.update(readings)
+        self.engine.submit(batch)
+
+    def close(self):
+        """
+        Closes the streams and writes the buffered readings
+        """
+        self.ingestor.stop()
+        self.writer.close()
+        self.rollups.close_all()
+        logger.error("Connection Closed")
 
 
 class Command(BaseCommand):
@@ -271,7 +163,7 @@ class Command(BaseCommand):
         component
         """
 
-        global dst_folder, payload, uuid_list
+        global dst_folder, rollup_folder, uuid_list
 
         base_dir = settings.BASE_DIR
 
@@ -280,14 +172,7 @@ class Command(BaseCommand):
 
         try:
             dst_folder = os.path.join(base_dir, 'energylenserver/' + dst_folder)
-
-            # Delete existing directories inside data/meter folder
-            import shutil
-            logger.debug("Deleting files from the old run..")
-            folder_listing = os.listdir(dst_folder)
-            for d in folder_listing:
-                d = os.path.join(dst_folder, d)
-                shutil.rmtree(d)
+            rollup_folder = os.path.join(base_dir, 'energylenserver/' + rollup_folder)
 
             logger.debug("Getting UUIDs for all apartment meters..")
 
@@ -300,6 +185,8 @@ class Command(BaseCommand):
                 for meter in meter_list:
                     meter_uuid = meter['uuid']
                     uuid_list.append(meter_uuid)
+                    meter_apt[meter_uuid] = smap.smap_apt_no(apt_no)
+                    power_store.add_meter(smap.smap_apt_no(apt_no), meter_uuid)
 
                     try:
                         # Create directory for the uuid
@@ -311,32 +198,20 @@ class Command(BaseCommand):
                         logger.error("[DirectoryCreationError]::%s", e)
                         sys.exit(1)
 
-            # Create Payload
-            payload = ("Metadata/Extra/PhysicalParameter='Power' and "
-                       "(Metadata/LoadLocation/FlatNumber = ")
-
-            list_len = len(apt_no_list)
-            for i, apt_no in enumerate(apt_no_list):
-                payload += "'" + apt_no + "'"
-
-                if i != (list_len - 1):
-                    payload += " or Metadata/LoadLocation/FlatNumber = "
-                else:
-                    payload += ")"
-            logger.debug("Payload:\n [%s]", payload)
+            # Open persistent HTTP connections to sMAP
+            c = Client(apt_no_list)
 
-            # Open persistent HTTP connection to sMAP
-            c = Client()
-            # c.setup_connection()
+            # Share the latest readings for real-time data requests
+            # (after the edge detection workers are forked)
+            serve_store(power_store)
             c.start()
         except KeyboardInterrupt:
             logger.error("\n\nInterrupted by user, shutting down..")
-            c.conn.close()
-            logger.error("Connection Closed")
+            c.close()
+            c.flush()
 
         except Exception, e:
             logger.error("[GetMeterDataException] %s\n" % str(e))
-            c.conn.close()
-            logger.error("Connection Closed")
+            c.close()
 
             sys.exit(1)
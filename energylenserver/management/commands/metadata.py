@@ -13,6 +13,7 @@ from django.core.management.base import BaseCommand
 from energylenserver.common_imports import *
 from django.conf import settings
 from energylenserver.models.models import Metadata
+from energylenserver.models.snapshot import bump_version
 
 
 class Command(BaseCommand):
@@ -61,6 +62,8 @@ class Command(BaseCommand):
                             records.update(how_many=how_many)
                         else:
                             records.update(power=power)
+                        # QuerySet updates don't send post_save
+                        bump_version(apt_no)
                         self.stdout.write(
                             "Metadata with entry: %d %s %s exists" % (apt_no, appliance, location))
                         self.stdout.write("Metadata record updated")
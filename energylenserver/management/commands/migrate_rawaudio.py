@@ -0,0 +1,116 @@
+"""
+Migrates the stored raw audio records to binary samples
+
+Adds the samples and encoding columns to the raw audio tables (if missing)
+and encodes the comma separated samples of the records stored before as
+int16 (see preprocessing/audio.py), <batch_size> records at a time.
+Records already encoded are skipped, so the migration can be resumed
+
+Usage: python manage.py migrate_rawaudio [<batch_size>]
+"""
+
+import sys
+import time
+
+# Django imports
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+# EnergyLens+ imports
+from energylenserver.common_imports import *
+from energylenserver.models.DataModels import RawAudioTrainData, RawAudioTestData
+from energylenserver.preprocessing import audio
+
+# Enable Logging
+logger = logging.getLogger('energylensplus_django')
+
+
+def add_columns(model):
+    """
+    Adds the columns of the binary samples to the table of the model
+
+    Returns: names of the columns added
+    """
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    existing = [column[0] for column in
+                connection.introspection.get_table_description(cursor, table)]
+
+    added = []
+    qn = connection.ops.quote_name
+    for name in ['samples', 'encoding']:
+        if name in existing:
+            continue
+        field = model._meta.get_field(name)
+        column_def = field.db_type(connection) + (" NULL" if field.null else
+                                                  " NOT NULL DEFAULT %d" % field.default)
+        cursor.execute("ALTER TABLE %s ADD COLUMN %s %s" % (qn(table), qn(field.column),
+                                                            column_def))
+        added.append(name)
+    return added
+
+
+def encode_records(model, batch_size):
+    """
+    Encodes the samples of the records stored as text
+
+    Returns: number of records encoded and the size of their samples
+    before and after
+    """
+    n_records = text_size = binary_size = 0
+    last_id = 0
+    while True:
+        records = list(model.objects.filter(encoding=audio.text_encoding, id__gt=last_id)
+                       .order_by('id').values_list('id', 'value')[:batch_size])
+        if len(records) == 0:
+            break
+
+        with transaction.atomic():
+            for record_id, value in records:
+                try:
+                    encoding, samples = audio.encode_samples(value)
+                except ValueError:
+                    # Not integer samples, kept as text
+                    continue
+                if encoding == audio.text_encoding:
+                    continue
+                model.objects.filter(id=record_id).update(samples=samples, encoding=encoding,
+                                                          value='')
+                n_records += 1
+                text_size += len(value)
+                binary_size += len(samples)
+        last_id = records[-1][0]
+
+    return n_records, text_size, binary_size
+
+
+class Command(BaseCommand):
+    help = "Migrates the stored raw audio records to binary samples"
+
+    def handle(self, *args, **options):
+
+        try:
+            batch_size = int(args[0]) if len(args) > 0 else 1000
+        except ValueError:
+            self.stdout.write("Usage: python manage.py migrate_rawaudio [<batch_size>]")
+            return
+
+        try:
+            for model in [RawAudioTrainData, RawAudioTestData]:
+                table = model._meta.db_table
+                added = add_columns(model)
+                if len(added) > 0:
+                    self.stdout.write("%s: added columns %s" % (table, ", ".join(added)))
+
+                start = time.time()
+                n_records, text_size, binary_size = encode_records(model, batch_size)
+                ratio = float(text_size) / binary_size if binary_size > 0 else 0
+                self.stdout.write("%s: %d records encoded in %.1fs, samples %d -> %d bytes "
+                                  "(x%.1f)" % (table, n_records, time.time() - start,
+                                               text_size, binary_size, ratio))
+
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted by user, shutting down..")
+            sys.exit(0)
+        except Exception, e:
+            logger.exception("[MigrateRawAudioException] %s" % str(e))
@@ -0,0 +1,65 @@
+"""
+Runs a local stand-in of the sMAP archiver with synthetic meter data
+
+Serves the meters registered in MeterInfo (or a Power and a Light meter
+for each participating apartment if none are registered).
+Point SMAP_URL to the stand-in to run the server offline
+
+Usage: python manage.py smapserver [<port>]
+"""
+
+import sys
+import time
+
+# Django imports
+from django.core.management.base import BaseCommand
+
+# EnergyLens+ imports
+from energylenserver.common_imports import *
+from energylenserver.constants import apt_no_list
+from energylenserver.meter.smap import smap_apt_no
+from energylenserver.meter import smap_standin
+from energylenserver.models.models import MeterInfo
+
+# Enable Logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+
+def standin_meters():
+    """
+    Returns the meters served by the stand-in
+    """
+    meters = [{'apt_no': smap_apt_no(meter.apt_no), 'uuid': meter.meter_uuid,
+               'type': meter.meter_type} for meter in MeterInfo.objects.all()]
+    if len(meters) == 0:
+        for apt_no in apt_no_list:
+            for meter_type in ['Power', 'Light']:
+                meters.append({'apt_no': smap_apt_no(apt_no),
+                               'uuid': "standin-%s-%s" % (apt_no, meter_type.lower()),
+                               'type': meter_type})
+    return meters
+
+
+class Command(BaseCommand):
+    help = "Runs a local stand-in of the sMAP archiver"
+
+    def handle(self, *args, **options):
+
+        try:
+            port = int(args[0]) if len(args) > 0 else 9306
+            meters = standin_meters()
+            server = smap_standin.start_server(meters, host='0.0.0.0', port=port)
+            self.stdout.write("sMAP stand-in serving %d meters on port %d" %
+                              (len(meters), port))
+
+            while True:
+                time.sleep(60)
+                logger.debug("sMAP stand-in:: Requests: %d Readings published: %d",
+                             server.stats['requests'], server.stats['published'])
+
+        except KeyboardInterrupt:
+            self.stdout.write("Interrupted by user, shutting down..")
+            server.stop()
+            sys.exit(0)
+        except Exception, e:
+            logger.exception("[SmapServerException] %s" % str(e))
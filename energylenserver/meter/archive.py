@@ -0,0 +1,265 @@
+"""
+Columnar archive of the raw meter data
+
+Each meter (uuid) has its own folder with two column files per (UTC) day:
+    <YYYYMMDD>.time  - int64 timestamps in ms
+    <YYYYMMDD>.power - float32 power values
+Readings are appended in time order, so a time range of a day is a
+contiguous slice of both columns. The columns are opened with memory
+mapping and range slices are returned as views, without copying
+"""
+
+import os
+import time
+import calendar
+
+import numpy as np
+import pandas as pd
+
+from energylenserver.common_imports import *
+
+# Enable Logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+time_dtype = np.dtype('<i8')
+power_dtype = np.dtype('<f4')
+day_seconds = 24 * 3600
+
+
+def day_of(timestamp):
+    """
+    Returns the start time (in seconds) of the day containing the timestamp
+    """
+    return int(timestamp) - int(timestamp) % day_seconds
+
+
+def day_name(day):
+    return time.strftime("%Y%m%d", time.gmtime(day))
+
+
+def column_path(folder, uuid, day, column):
+    return os.path.join(folder, uuid, day_name(day) + '.' + column)
+
+
+class ArchiveWriter:
+
+    """
+    Buffers the readings of each meter and appends them to the day columns
+    when the buffer fills up or gets older than archive_flush_interval seconds
+    """
+
+    def __init__(self, folder, flush_size=archive_flush_size,
+                 flush_interval=archive_flush_interval):
+
+        self.folder = folder
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        self.times = {}
+        self.power = {}
+        self.count = {}
+        self.day = {}
+        self.last_time = {}
+        self.last_flush = {}
+
+    def add_meter(self, uuid):
+        """
+        Creates the buffers and the folder for the meter
+        """
+        meter_folder = os.path.join(self.folder, uuid)
+        if not os.path.exists(meter_folder):
+            os.makedirs(meter_folder)
+            logger.debug("Folder created: %s", meter_folder)
+
+        # Columns left uneven by an interrupted write would be misaligned
+        # by the readings appended after
+        for day in archived_days(self.folder, uuid):
+            align_day(self.folder, uuid, day)
+
+        self.times[uuid] = np.empty(self.flush_size, dtype=time_dtype)
+        self.power[uuid] = np.empty(self.flush_size, dtype=power_dtype)
+        self.count[uuid] = 0
+        self.day[uuid] = None
+        self.last_time[uuid] = last_archived_time(self.folder, uuid)
+        self.last_flush[uuid] = time.time()
+
+    def write(self, uuid, timestamp, power):
+        """
+        Buffers a reading (timestamp in seconds) of the meter
+        Readings older than the last one written are ignored
+        """
+        if uuid not in self.times:
+            self.add_meter(uuid)
+
+        time_ms = int(round(timestamp * 1000))
+        if self.last_time[uuid] is not None and time_ms <= self.last_time[uuid]:
+            return
+        self.last_time[uuid] = time_ms
+
+        # Readings of a new day go into new columns
+        day = day_of(timestamp)
+        if day != self.day[uuid]:
+            self.flush(uuid)
+            self.day[uuid] = day
+
+        n = self.count[uuid]
+        self.times[uuid][n] = time_ms
+        self.power[uuid][n] = power
+        self.count[uuid] = n + 1
+
+        if (self.count[uuid] == self.flush_size or
+                time.time() - self.last_flush[uuid] >= self.flush_interval):
+            self.flush(uuid)
+
+    def flush(self, uuid=None):
+        """
+        Appends the buffered readings to the day columns
+        If no uuid is specified, buffers of all meters are written
+        """
+        if uuid is None:
+            for uuid in self.times:
+                self.flush(uuid)
+            return
+
+        self.last_flush[uuid] = time.time()
+        n = self.count[uuid]
+        if n == 0:
+            return
+
+        day = self.day[uuid]
+        power_path = column_path(self.folder, uuid, day, 'power')
+        time_path = column_path(self.folder, uuid, day, 'time')
+        power_size = os.path.getsize(power_path) if os.path.exists(power_path) else 0
+        try:
+            # Power is written first: a reader only uses the readings
+            # present in both columns
+            with open(power_path, "ab") as power_file:
+                self.power[uuid][:n].tofile(power_file)
+            with open(time_path, "ab") as time_file:
+                self.times[uuid][:n].tofile(time_file)
+        except IOError, e:
+            logger.error("[ArchiveWriteException]:: %s", e)
+            # Roll back the readings written to only one of the columns
+            try:
+                with open(power_path, "r+b") as power_file:
+                    power_file.truncate(power_size)
+                align_day(self.folder, uuid, day)
+            except (IOError, OSError), e:
+                logger.error("[ArchiveRollbackException]:: %s", e)
+        self.count[uuid] = 0
+
+    def close(self):
+        self.flush()
+
+
+def archived_days(folder, uuid):
+    """
+    Returns the sorted start times of the archived days of the meter
+    """
+    meter_folder = os.path.join(folder, uuid)
+    if not os.path.isdir(meter_folder):
+        return []
+    days = []
+    for the_file in os.listdir(meter_folder):
+        name, ext = os.path.splitext(the_file)
+        if ext == '.time' and name.isdigit():
+            days.append(calendar.timegm(time.strptime(name, "%Y%m%d")))
+    return sorted(days)
+
+
+def align_day(folder, uuid, day):
+    """
+    Truncates the columns of a day of the meter to the readings
+    present in both
+    """
+    paths = [column_path(folder, uuid, day, 'time'), column_path(folder, uuid, day, 'power')]
+    dtypes = [time_dtype, power_dtype]
+    sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path in paths]
+    n = min(size // dtype.itemsize for size, dtype in zip(sizes, dtypes))
+
+    for path, dtype, size in zip(paths, dtypes, sizes):
+        if size > n * dtype.itemsize:
+            logger.debug("Truncating %s to %d readings", path, n)
+            with open(path, "r+b") as column_file:
+                column_file.truncate(n * dtype.itemsize)
+
+
+def open_day(folder, uuid, day):
+    """
+    Opens the columns of a day of the meter with memory mapping
+
+    Returns: time (ms) and power arrays
+    """
+    paths = [column_path(folder, uuid, day, 'time'), column_path(folder, uuid, day, 'power')]
+    try:
+        n = min(os.path.getsize(paths[0]) // time_dtype.itemsize,
+                os.path.getsize(paths[1]) // power_dtype.itemsize)
+    except OSError:
+        n = 0
+    if n == 0:
+        return np.empty(0, dtype=time_dtype), np.empty(0, dtype=power_dtype)
+
+    times = np.memmap(paths[0], dtype=time_dtype, mode='r', shape=(n,))
+    power = np.memmap(paths[1], dtype=power_dtype, mode='r', shape=(n,))
+    return times, power
+
+
+def last_archived_time(folder, uuid):
+    """
+    Returns the time (ms) of the last archived reading of the meter
+    """
+    days = archived_days(folder, uuid)
+    for day in reversed(days):
+        times, power = open_day(folder, uuid, day)
+        if len(times) > 0:
+            return int(times[-1])
+    return None
+
+
+def slice_range(folder, uuid, start_time, end_time):
+    """
+    Returns the archived readings of the meter between start and end time
+    (in seconds, both inclusive) as views of the day columns
+
+    Returns: list of (time, power) array views, one per day
+    """
+    start_ms = int(round(start_time * 1000))
+    end_ms = int(round(end_time * 1000))
+
+    slices = []
+    for day in archived_days(folder, uuid):
+        if day + day_seconds <= start_time or day > end_time:
+            continue
+        times, power = open_day(folder, uuid, day)
+        start = np.searchsorted(times, start_ms, side='left')
+        end = np.searchsorted(times, end_ms, side='right')
+        if end > start:
+            slices.append((times[start:end], power[start:end]))
+    return slices
+
+
+def read_range(folder, uuid, start_time, end_time):
+    """
+    Returns the archived readings of the meter between start and end time
+    A view is returned when the range lies within one day, a copy otherwise
+
+    Returns: time (ms) and power arrays
+    """
+    slices = slice_range(folder, uuid, start_time, end_time)
+    if len(slices) == 0:
+        return np.empty(0, dtype=time_dtype), np.empty(0, dtype=power_dtype)
+    if len(slices) == 1:
+        return slices[0]
+    return (np.concatenate([times for times, power in slices]),
+            np.concatenate([power for times, power in slices]))
+
+
+def read_meter_data(folder, uuid, start_time, end_time):
+    """
+    Reads the archived readings of the meter between start and end time
+
+    Returns: Dataframe with <time, power> in the format used by edge detection
+    """
+    times, power = read_range(folder, uuid, start_time, end_time)
+    return pd.DataFrame({'time': times / 1000., 'power': power.astype('float64')},
+                        columns=['time', 'power'])
@@ -0,0 +1,242 @@
+"""
+Local read-through cache of meter readings
+
+The readings fetched from sMAP are stored per meter as spans: arrays of
+<time, power> records saved as <folder>/<uuid>/<start>_<end>.npy, where
+[start, end) is the time range (in seconds) the span covers. Empty
+results are not cached, as sMAP returns no readings when it is unavailable.
+
+A request is served from the spans covering it; only the gaps are fetched
+from sMAP. Overlapping and adjacent spans are merged into one file.
+Spans are evicted when older than meter_cache_max_age or, least recently
+used first, when the cache grows beyond meter_cache_max_size bytes.
+"""
+
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+from energylenserver.functions import timestamp_to_str
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_django')
+
+# Global variables
+date_format = "%Y-%m-%dT%H:%M:%S"
+record_dtype = np.dtype([('time', '<f8'), ('power', '<f8')])
+span_ext = '.npy'
+
+
+def span_file(folder, uuid, start, end):
+    return os.path.join(folder, uuid, "%d_%d%s" % (start, end, span_ext))
+
+
+def find_gaps(spans, start, end):
+    """
+    Returns the [start, end) ranges not covered by the sorted spans
+    """
+    gaps = []
+    for s_start, s_end in spans:
+        if s_end <= start:
+            continue
+        if s_start >= end:
+            break
+        if s_start > start:
+            gaps.append((start, s_start))
+        start = max(start, s_end)
+    if start < end:
+        gaps.append((start, end))
+    return gaps
+
+
+def unique_records(records):
+    """
+    Sorts the records by time and keeps one (the last) record per timestamp
+    """
+    records = records[np.argsort(records['time'], kind='mergesort')]
+    if len(records) > 1:
+        keep = np.concatenate([records['time'][1:] != records['time'][:-1], [True]])
+        records = records[keep]
+    return records
+
+
+class MeterCache:
+
+    """
+    Read-through cache of the power streams of the apartments
+    """
+
+    def __init__(self, folder, client):
+        self.folder = folder
+        self.client = client
+        self.last_eviction = 0
+
+    def spans(self, uuid):
+        """
+        Returns the sorted [start, end) spans of the meter
+        """
+        spans = []
+        try:
+            for name in os.listdir(os.path.join(self.folder, uuid)):
+                if name.endswith(span_ext):
+                    start, end = name[:-len(span_ext)].split('_')
+                    spans.append((int(start), int(end)))
+        except OSError:
+            return []
+        return sorted(spans)
+
+    def read_span(self, uuid, start, end):
+        path = span_file(self.folder, uuid, start, end)
+        records = np.load(path)
+        # Mark as recently used
+        os.utime(path, None)
+        return records
+
+    def write_span(self, uuid, start, end, records):
+        folder = os.path.join(self.folder, uuid)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        path = span_file(self.folder, uuid, start, end)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.save(f, records)
+        os.rename(tmp_path, path)
+
+    def store(self, uuid, start, end, records):
+        """
+        Stores the records fetched for [start, end) and merges the span with
+        the overlapping and adjacent spans of the meter
+        """
+        merged = [records]
+        for s_start, s_end in self.spans(uuid):
+            if s_end < start or s_start > end:
+                continue
+            try:
+                merged.append(self.read_span(uuid, s_start, s_end))
+            except (IOError, OSError, ValueError):
+                # Removed by another process
+                continue
+            os.remove(span_file(self.folder, uuid, s_start, s_end))
+            start, end = min(start, s_start), max(end, s_end)
+
+        records = unique_records(np.concatenate(merged))
+        self.write_span(uuid, start, end, records)
+
+    def read(self, uuid, start, end):
+        """
+        Returns the cached records of the meter in [start, end)
+        """
+        records = []
+        for s_start, s_end in self.spans(uuid):
+            if s_end <= start or s_start >= end:
+                continue
+            span = self.read_span(uuid, s_start, s_end)
+            records.append(span[(span['time'] >= start) & (span['time'] < end)])
+        if len(records) == 0:
+            return np.zeros(0, dtype=record_dtype)
+        # Spans stored concurrently by other processes may overlap
+        return unique_records(np.concatenate(records))
+
+    def fetch(self, apt_no, meters, start, end):
+        """
+        Fetches the readings of the apartment meters missing in [start, end)
+
+        Returns: dict of uuid -> records fetched but not cached
+        """
+        # Readings of the last few seconds may still arrive, so they are not cached
+        settled = int(time.time()) - meter_cache_settle_time
+
+        gaps = set()
+        for meter in meters:
+            gaps.update(find_gaps(self.spans(meter['uuid']), start, end))
+
+        recent = {}
+        for g_start, g_end in sorted(gaps):
+            logger.debug("Cache: Fetching %s between %s and %s", apt_no, g_start, g_end)
+            streams = self.client.get_data([apt_no], timestamp_to_str(g_start, date_format),
+                                           timestamp_to_str(g_end, date_format))
+            fetched = dict((uuid, readings) for uuid, m_type, readings in streams[apt_no])
+
+            for meter in meters:
+                readings = np.array(fetched.get(meter['uuid'], []),
+                                    dtype='float64').reshape(-1, 2)
+                records = np.zeros(len(readings), dtype=record_dtype)
+                records['time'] = readings[:, 0] / 1000
+                records['power'] = readings[:, 1]
+
+                if g_start < settled:
+                    span_end = min(g_end, settled)
+                    settled_records = records[records['time'] < span_end]
+                    # No readings may mean sMAP was unavailable, so they are fetched again
+                    if len(settled_records) > 0:
+                        self.store(meter['uuid'], g_start, span_end, settled_records)
+                if g_end > settled:
+                    recent.setdefault(meter['uuid'], []).append(
+                        records[records['time'] >= settled])
+        return recent
+
+    def get(self, apt_no, start_time, end_time):
+        """
+        Retrieves meter data in the specified time interval through the cache
+
+        Returns: list of dataframes, as get_meter_data_for_time_slice
+        """
+        # The end second is included
+        start = int(time.mktime(time.strptime(start_time, date_format)))
+        end = int(time.mktime(time.strptime(end_time, date_format))) + 1
+
+        meters = self.client.get_meters(apt_no)
+        recent = self.fetch(apt_no, meters, start, end)
+
+        df = []
+        for meter in meters:
+            records = np.concatenate([self.read(meter['uuid'], start, end)] +
+                                     recent.get(meter['uuid'], []))
+            records = records[(records['time'] >= start) & (records['time'] < end)]
+            records = records[np.argsort(records['time'], kind='mergesort')]
+            df.append(pd.DataFrame({'time': records['time'], 'power': records['power'],
+                                    'type': [meter['type']] * len(records)},
+                                   columns=['time', 'power', 'type']))
+
+        self.evict()
+
+        if len(df) == 0 or len(df[0]) == 0:
+            return []
+        return df
+
+    def evict(self, force=False):
+        """
+        Removes the spans older than meter_cache_max_age and the least recently
+        used ones beyond meter_cache_max_size
+        """
+        now = time.time()
+        if not force and now - self.last_eviction < meter_cache_evict_interval:
+            return
+        self.last_eviction = now
+
+        files = []
+        for root, dirs, names in os.walk(self.folder):
+            for name in names:
+                if not name.endswith(span_ext):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if now - mtime <= meter_cache_max_age and total_size <= meter_cache_max_size:
+                break
+            try:
+                os.remove(path)
+                total_size -= size
+                logger.debug("Cache: Evicted %s", path)
+            except OSError:
+                continue
@@ -26,3 +26,79 @@ percent_change = 0.31
 
 # Time difference the phone with the meter data
 time_diff = 5
+
+# Columnar meter archive (one time and one power column per meter per day)
+# Number of readings buffered per meter before appending to the columns
+archive_flush_size = 300
+# Maximum time (in seconds) a reading stays in the buffer
+archive_flush_interval = 60
+
+# Republish stream parser
+# Readings per meter preallocated between two takes (grown when exceeded)
+stream_parser_capacity = 64
+# Maximum size (in bytes) of an incomplete document kept in the buffer
+stream_max_buffer = 1024 * 1024
+
+# Republish stream ingestor
+# Apartments streamed over one connection
+stream_group_size = 1
+# Connect timeout (in seconds) of a stream
+stream_connect_timeout = 10
+# A stream without data for this long (in seconds) is reconnected
+stream_stall_timeout = 30
+# Maximum number of chunks of readings waiting for the client
+stream_queue_size = 10000
+
+# Edge detection engine
+# Number of worker processes (None: one per core)
+edge_engine_workers = None
+edge_engine_stats_interval = 60
+
+# sMAP client
+# Connect and read timeouts (in seconds) of a query
+smap_connect_timeout = 5
+smap_read_timeout = 60
+# Retries of a failed query with an exponential back off starting at smap_backoff seconds
+smap_max_retries = 3
+smap_backoff = 0.5
+# Connections kept open with the archiver
+smap_pool_size = 10
+# Time (in seconds) for which the meters of an apartment are cached
+meter_info_ttl = 300
+
+# Meter readings cache
+# Spans unused for this long (in seconds) are evicted
+meter_cache_max_age = 7 * 24 * 3600
+# Maximum size (in bytes) of the cache
+meter_cache_max_size = 512 * 1024 * 1024
+# Readings of the last few seconds are not cached as they may still arrive
+meter_cache_settle_time = 30
+# Minimum time (in seconds) between two eviction runs of a process
+meter_cache_evict_interval = 60
+
+# Latest power store (shared by the meter data client)
+latest_power_address = ('localhost', 65001)
+latest_power_authkey = 'abracadabra'
+# Readings older than this (in seconds) are not served from the store
+latest_power_max_age = 60
+
+# Training jobs
+# Time (in seconds) after which the power is computed even if the meter data
+# of the training interval has not been seen
+training_job_max_wait = 120
+
+# Edge backfill (backfill_edges command)
+# Time span (in seconds) of the chunks fetched and processed by a worker
+backfill_chunk_size = 6 * 3600
+# Meter data (in seconds) added on both sides of a chunk for the edges near its boundaries
+backfill_overlap = 300
+# Number of worker processes (None: one per core)
+backfill_workers = None
+
+# Power rollups of the apartments (see meter/rollups.py)
+# Bucket sizes (in seconds), from the finest to the coarsest
+rollup_resolutions = [1, 60, 900, 3600]
+# Time (in seconds) between two writes of the closed buckets
+rollup_flush_interval = 10
+# Maximum number of points returned for a plot
+rollup_max_points = 600
@@ -8,6 +8,8 @@ Date: 21th August 2014
 import math
 import json
 import time as t
+from collections import deque
+import numpy as np
 import pandas as pd
 # import datetime as dt
 
@@ -51,7 +53,16 @@ def detect_and_filter_edges(df):
     :return edges:
     """
     edges_df = detect_edges(df)
-    if len(edges_df) == 0:
+    return filter_detected_edges(edges_df)
+
+
+def filter_detected_edges(edges_df):
+    """
+    Preprocessing Step 1a over the detected edges (batch or streaming):
+    filters the edges of the appliances that are not of interest and
+    the transitional edges
+    """
+    if edges_df is None or len(edges_df) == 0:
         return edges_df
 
     logger.debug("Before Edges: \n%s", edges_df)
@@ -62,48 +73,29 @@ def detect_and_filter_edges(df):
     return edges_df
 
 
-def detect_edges(df):
+def detect_edges(df, iterative=False):
     """
     Detect edges from both meters
+    The array detection is used unless <iterative> is set or the index has gaps
     """
 
-    rise_edges = []
-    fall_edges = []
-
     try:
 
-        ix_list_l = df.index
-        first_idx = ix_list_l[0]
-        for idx in range(first_idx + 1, ix_list_l[-1] - winmax + 1):
-            edge_type, edge = check_if_edge(df, idx, "power")
-            if edge_type == "rising":
-                rise_edges.append(edge)
-            elif edge_type == "falling":
-                fall_edges.append(edge)
-            # logger.debug("Edge: " + str(edge)
+        if is_contiguous(df.index) and not iterative:
+            rise_df, fall_df = find_edges(df)
+        else:
+            rise_df, fall_df = find_edges_iterative(df)
 
         # --Storing edges in a df--
-        rise_df = pd.DataFrame(columns=['index', 'time',
-                                        'magnitude', 'type', 'curr_power'])
-        fall_df = pd.DataFrame(columns=['index', 'time',
-                                        'magnitude', 'type', 'curr_power'])
         edges_df = pd.DataFrame(columns=['index', 'time',
                                          'magnitude', 'type', 'curr_power'])
-        if len(rise_edges) >= 1 or len(fall_edges) >= 1:
-
-            if len(rise_edges) >= 1:
-                # --Rising Edges--
-                rise_df = pd.DataFrame(
-                    rise_edges, columns=['index', 'time', 'magnitude', 'type', 'curr_power'])
+        if len(rise_df) >= 1 or len(fall_df) >= 1:
 
+            if len(rise_df) >= 1:
                 # Filter rising edges
                 rise_df = filter_select_maxtime_edge(rise_df)
 
-            if len(fall_edges) >= 1:
-                # --Falling Edges--
-                fall_df = pd.DataFrame(
-                    fall_edges, columns=['index', 'time', 'magnitude', 'type', 'curr_power'])
-
+            if len(fall_df) >= 1:
                 # Filter falling edges
                 fall_df = filter_select_maxtime_edge(fall_df)
 
@@ -119,6 +111,298 @@ def detect_edges(df):
         logger.exception("[DetectEdgesException]:: %s", e)
 
 
+def is_contiguous(index):
+    """
+    Checks if the index is a run of consecutive integer labels
+    """
+    if len(index) == 0:
+        return False
+    try:
+        return int(index[-1]) - int(index[0]) + 1 == len(index)
+    except (TypeError, ValueError):
+        return False
+
+
+def round_half_away(values):
+    """
+    Rounds the values the way the builtin round() does
+    i.e. halves away from zero, unlike np.round
+
+    Returns: int64 array
+    """
+    values = np.asarray(values, dtype='float64')
+    truncated = np.trunc(values)
+    rounded = np.round(values)
+    ties = np.abs(values - truncated) == 0.5
+    rounded[ties] = truncated[ties] + np.sign(values[ties])
+    return rounded.astype('int64')
+
+
+def find_edges(df):
+    """
+    Determines all the edges in the stream in one pass over the power
+    and time columns. Applies the same rules as check_if_edge at each index
+
+    Assumes a contiguous index (as received from the meter data client)
+
+    Returns: Rising and falling edges frames
+    """
+    columns = ['index', 'time', 'magnitude', 'type', 'curr_power']
+
+    # Same index range as checked by the iterative detection
+    pos = np.arange(1, len(df.index) - winmax)
+    if len(pos) == 0:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=columns)
+
+    power = round_half_away(df['power'].values)
+    time = df['time'].values
+
+    magnitude, rising, falling = evaluate_edges(power, time, pos)
+    curr = power[pos]
+
+    edges = []
+    for edge_type, mask in [("rising", rising), ("falling", falling)]:
+        e_pos = pos[mask]
+        edge_df = pd.DataFrame({'index': df.index.values[e_pos], 'time': time[e_pos],
+                                'magnitude': magnitude[mask], 'type': edge_type,
+                                'curr_power': curr[mask]}, columns=columns)
+        for e_time, e_mag in zip(time[e_pos], magnitude[mask]):
+            logger.debug("[EDGE FOUND::%s] [%s] %s", edge_type, t.ctime(e_time), e_mag)
+        edges.append(edge_df)
+
+    return edges[0], edges[1]
+
+
+def evaluate_edges(power, time, pos):
+    """
+    Applies the edge rules of check_if_edge at the given positions
+    of the rounded power and time arrays
+
+    Every position needs one sample before it and winmax samples after it.
+    prevwin is taken as 0 when fewer than winmin samples precede a position
+
+    Returns: magnitude, rising edge mask and falling edge mask
+    """
+    prev = power[pos - 1]
+    curr = power[pos]
+    next = power[pos + 1]
+    currnextnext = power[pos + 2]
+    currwin = power[pos + winmin]
+    currwinmax = power[pos + winmax]
+    prevwin = np.where(pos >= winmin, power[np.maximum(pos - winmin, 0)], 0)
+
+    per_thresmin = int(0.5 * thresmin)
+
+    # Indicates next time sample is missing
+    next_diff = time[pos + 1] - time[pos]
+    next_missing_sample = (next_diff > sampling_rate) & (next_diff < 2 * sampling_rate)
+
+    prev_curr_diff = np.abs(curr - prev)
+    curr_next_diff = next - curr
+    curr_nextwin_diff = currwin - curr
+    curr_prevwin_diff = prevwin - curr
+    curr_nextnext_diff = currnextnext - curr
+
+    # For rising edge: use the winmax window for determining the edge
+    magnitude = np.where(curr_nextwin_diff > 0, currwinmax - curr, curr_nextwin_diff)
+
+    # For falling edge: for comparison with curr_next_diff
+    mag_abs = np.abs(magnitude)
+    per_current_val = np.where(mag_abs <= 100, np.floor(0.25 * mag_abs), 50)
+
+    # Removes spikes
+    not_spike = np.abs(curr_nextnext_diff) >= thresmin
+
+    # Rising Edge
+    rising = (not_spike & (curr_nextwin_diff > 0) &
+              (magnitude >= thresmin) & (prev_curr_diff < thresmin) &
+              (curr_next_diff > prev_curr_diff) &
+              ((next_missing_sample & (curr_next_diff >= thresmin)) |
+               (curr_next_diff >= per_thresmin)))
+
+    # Falling Edge
+    # Magnitude must come from the winmin window, as per_current_val is
+    # only defined for it in check_if_edge
+    falling = (not_spike & (curr_nextwin_diff < 0) &
+               (magnitude <= -thresmin) & (prev_curr_diff < thresmin) &
+               ((curr_next_diff != 0) | (np.abs(curr_next_diff) > prev_curr_diff)) &
+               (np.abs(curr_prevwin_diff) < thresmin) &
+               (np.abs(curr_next_diff) >= per_current_val))
+
+    return magnitude, rising, falling
+
+
+def find_edges_iterative(df):
+    """
+    Determines the edges in the stream by checking each index
+    with check_if_edge
+
+    Returns: Rising and falling edges frames
+    """
+    columns = ['index', 'time', 'magnitude', 'type', 'curr_power']
+
+    rise_edges = []
+    fall_edges = []
+
+    ix_list_l = df.index
+    first_idx = ix_list_l[0]
+    for idx in range(first_idx + 1, ix_list_l[-1] - winmax + 1):
+        edge_type, edge = check_if_edge(df, idx, "power")
+        if edge_type == "rising":
+            rise_edges.append(edge)
+        elif edge_type == "falling":
+            fall_edges.append(edge)
+        # logger.debug("Edge: " + str(edge)
+
+    rise_df = pd.DataFrame(columns=columns)
+    fall_df = pd.DataFrame(columns=columns)
+    if len(rise_edges) >= 1:
+        rise_df = pd.DataFrame(rise_edges, columns=columns)
+    if len(fall_edges) >= 1:
+        fall_df = pd.DataFrame(fall_edges, columns=columns)
+
+    return rise_df, fall_df
+
+
+class StreamingEdgeDetector:
+
+    """
+    Detects edges incrementally over the stream of a single meter
+
+    Keeps a ring buffer of the last winmin + winmax + 1 samples. An index is
+    checked for an edge as soon as winmax samples after it are received.
+    An edge is filtered (filter_select_maxtime_edge) and released when the next
+    edge of its type arrives, or when no edge of that type followed within the
+    (one minute) window of the filter
+    """
+
+    columns = ['index', 'time', 'magnitude', 'type', 'curr_power']
+    # Time frame (in seconds) within which filter_select_maxtime_edge groups edges
+    filter_window = 60
+
+    def __init__(self, uuid):
+
+        self.uuid = uuid
+        self.power = deque(maxlen=winmin + winmax + 1)
+        self.time = deque(maxlen=winmin + winmax + 1)
+        self.n_samples = 0
+        self.last_time = None
+
+        # Edges waiting for the filter window to close
+        self.pending = {"rising": [], "falling": []}
+
+    def add_reading(self, timestamp, power):
+        """
+        Adds a single reading to the stream
+
+        Returns: Edges frame of the edges whose window closed
+        """
+        return self.edges_frame(self.push(timestamp, power))
+
+    def push(self, timestamp, power):
+        """
+        Adds a reading to the buffer and checks the index whose window closed
+
+        Returns: list of the released edge frames
+        """
+        # Ignore duplicate or out of order readings
+        if self.last_time is not None and timestamp <= self.last_time:
+            logger.debug("[%s] Ignoring reading at [%s]", self.uuid, t.ctime(timestamp))
+            return []
+
+        self.last_time = timestamp
+        self.power.append(power)
+        self.time.append(timestamp)
+        self.n_samples += 1
+
+        # Position (in the buffer) of the index whose window just closed
+        pos = len(self.power) - 1 - winmax
+        if pos < 1:
+            return []
+
+        power_arr = round_half_away(list(self.power))
+        time_arr = np.array(self.time)
+        magnitude, rising, falling = evaluate_edges(power_arr, time_arr, np.array([pos]))
+
+        edge_time = time_arr[pos]
+        for edge_type, mask in [("rising", rising), ("falling", falling)]:
+            if mask[0]:
+                self.pending[edge_type].append({"index": self.n_samples - 1 - winmax,
+                                                "time": edge_time,
+                                                "magnitude": magnitude[0],
+                                                "type": edge_type,
+                                                "curr_power": power_arr[pos]})
+                logger.debug("[%s][EDGE FOUND::%s] [%s] %s", self.uuid, edge_type,
+                             t.ctime(edge_time), magnitude[0])
+
+        return self.release_frames(edge_time)
+
+    def add_readings(self, readings):
+        """
+        Adds a batch of <timestamp, power> readings to the stream
+
+        Returns: Edges frame
+        """
+        edges = []
+        for timestamp, power in readings:
+            edges.extend(self.push(timestamp, power))
+        return self.edges_frame(edges)
+
+    def release(self, curr_time):
+        """
+        Emits the pending edges for which no edge followed within the filter window
+        """
+        return self.edges_frame(self.release_frames(curr_time))
+
+    def release_frames(self, curr_time, end_of_stream=False):
+        edges = []
+        for edge_type in ["rising", "falling"]:
+            pending = self.pending[edge_type]
+            if len(pending) == 0:
+                continue
+
+            # filter_select_maxtime_edge decides on an edge from the edge of the
+            # same type following it, so all but the last pending edge can be
+            # released. The last one is held until the window after it closes
+            last_closed = curr_time - pending[-1]['time'] > self.filter_window
+            n_release = len(pending) if end_of_stream or last_closed else len(pending) - 1
+            if n_release == 0:
+                continue
+
+            pending_df = pd.DataFrame(pending, columns=self.columns)
+            if not end_of_stream and last_closed:
+                # The filter treats the last edge of a frame differently;
+                # a following edge outside the window keeps the result
+                # the same as filtering the whole stream
+                sentinel = dict(pending[-1])
+                sentinel['time'] += self.filter_window + 1
+                pending_df = pd.concat([pending_df, pd.DataFrame([sentinel],
+                                                                 columns=self.columns)],
+                                       ignore_index=True)
+            pending_df = filter_select_maxtime_edge(pending_df)
+            edges.append(pending_df[pending_df.index < n_release])
+            self.pending[edge_type] = pending[n_release:]
+        return edges
+
+    def flush(self):
+        """
+        Emits all the pending edges
+        """
+        return self.edges_frame(self.release_frames(float('inf'), end_of_stream=True))
+
+    def edges_frame(self, edges):
+        """
+        Combines edge frames in the format returned by detect_edges
+        """
+        if len(edges) == 0:
+            return pd.DataFrame(columns=self.columns[1:])
+        edges_df = pd.concat(edges)
+        del edges_df['index']
+        edges_df.sort(['time'], inplace=True)
+        edges_df.reset_index(drop=True, inplace=True)
+        return edges_df
+
+
 def check_if_edge(df, index, power_stream):
     """
     Determines an edge at the specified index in the stream received
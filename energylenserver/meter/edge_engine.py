@@ -0,0 +1,218 @@
+"""
+Parallel edge detection engine
+
+Meters are sharded across a pool of worker processes by their uuid. All the
+readings of a meter are sent to the same worker, which keeps the streaming
+edge detector of the meter, so the detection state is retained across batches.
+
+Usage:
+    engine = EdgeEngine()
+    engine.start()
+    engine.submit({uuid: [(timestamp, power), ...], ...})
+    for uuid, edges_df in engine.collect():
+        ...
+    engine.stop()
+"""
+
+import time
+import zlib
+import Queue
+import multiprocessing
+
+from edge_detection import StreamingEdgeDetector
+from constants import *
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+
+def shard_for(uuid, n_shards):
+    """
+    Returns the shard of the meter
+    The hash is stable across processes and restarts
+    """
+    return (zlib.crc32(uuid) & 0xffffffff) % n_shards
+
+
+def shard_worker(shard_id, in_queue, out_queue, stats_interval):
+    """
+    Worker process of a shard
+
+    Receives (command, payload) messages on its input queue and puts
+    ('edges', (uuid, edges_df)) and ('stats', stats) messages on the output queue
+    """
+    detectors = {}
+    stats = {'shard': shard_id, 'meters': 0, 'batches': 0, 'samples': 0,
+             'edges': 0, 'busy_time': 0., 'start_time': time.time()}
+    last_report = time.time()
+
+    def report():
+        stats['meters'] = len(detectors)
+        stats['time'] = time.time()
+        out_queue.put(('stats', dict(stats)))
+
+    while True:
+        try:
+            command, payload = in_queue.get()
+        except KeyboardInterrupt:
+            # Shutdown is handled by the parent process
+            continue
+
+        if command == 'stop':
+            report()
+            break
+
+        start = time.time()
+        if command == 'batch':
+            for uuid, readings in payload.iteritems():
+                if uuid not in detectors:
+                    detectors[uuid] = StreamingEdgeDetector(uuid)
+                edges_df = detectors[uuid].add_readings(readings)
+                stats['samples'] += len(readings)
+                if len(edges_df) > 0:
+                    stats['edges'] += len(edges_df)
+                    out_queue.put(('edges', (uuid, edges_df)))
+            stats['batches'] += 1
+
+        elif command == 'flush':
+            for uuid, detector in detectors.iteritems():
+                edges_df = detector.flush()
+                if len(edges_df) > 0:
+                    stats['edges'] += len(edges_df)
+                    out_queue.put(('edges', (uuid, edges_df)))
+        stats['busy_time'] += time.time() - start
+
+        if command == 'stats' or time.time() - last_report >= stats_interval:
+            report()
+            last_report = time.time()
+
+
+class EdgeEngine:
+
+    """
+    Pool of edge detection workers, one input queue per shard and a
+    shared output queue
+    """
+
+    def __init__(self, n_workers=None, stats_interval=edge_engine_stats_interval):
+
+        if n_workers is None:
+            n_workers = edge_engine_workers or multiprocessing.cpu_count()
+        self.n_workers = n_workers
+        self.stats_interval = stats_interval
+
+        self.in_queues = []
+        self.out_queue = None
+        self.workers = []
+        self.shard_stats = {}
+
+    def start(self):
+        """
+        Starts the worker processes
+        """
+        self.out_queue = multiprocessing.Queue()
+        for shard_id in range(self.n_workers):
+            in_queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=shard_worker,
+                                             name="edge-shard-%d" % shard_id,
+                                             args=(shard_id, in_queue, self.out_queue,
+                                                   self.stats_interval))
+            worker.daemon = True
+            worker.start()
+            self.in_queues.append(in_queue)
+            self.workers.append(worker)
+        logger.debug("Edge engine started with %d workers", self.n_workers)
+
+    def shard(self, uuid):
+        return shard_for(uuid, self.n_workers)
+
+    def submit(self, batch):
+        """
+        Sends the readings to the workers of the meters
+
+        :param batch: dict of uuid -> list of <timestamp, power> readings;
+        may hold meters of many apartments
+        """
+        shard_batches = {}
+        for uuid, readings in batch.iteritems():
+            if len(readings) == 0:
+                continue
+            shard_batches.setdefault(self.shard(uuid), {})[uuid] = readings
+
+        for shard_id, shard_batch in shard_batches.iteritems():
+            self.in_queues[shard_id].put(('batch', shard_batch))
+
+    def flush(self):
+        """
+        Asks the workers to emit the edges pending in their detectors
+        """
+        for in_queue in self.in_queues:
+            in_queue.put(('flush', None))
+
+    def request_stats(self):
+        for in_queue in self.in_queues:
+            in_queue.put(('stats', None))
+
+    def collect(self, timeout=0):
+        """
+        Returns the edges detected since the last call as (uuid, edges_df) pairs
+        Waits up to <timeout> seconds for the first message
+        """
+        edges = []
+        block = timeout > 0
+        while True:
+            try:
+                kind, payload = self.out_queue.get(block, timeout)
+            except Queue.Empty:
+                break
+            block = False
+            if kind == 'edges':
+                edges.append(payload)
+            elif kind == 'stats':
+                self.shard_stats[payload['shard']] = payload
+        return edges
+
+    def stats(self):
+        """
+        Returns the last reported statistics of each shard with the throughput
+        in samples per second of busy time and of wall clock time
+        """
+        shard_stats = []
+        for shard_id in sorted(self.shard_stats):
+            stats = dict(self.shard_stats[shard_id])
+            elapsed = stats['time'] - stats['start_time']
+            stats['samples_per_sec'] = (stats['samples'] / stats['busy_time']
+                                        if stats['busy_time'] > 0 else 0.)
+            stats['wall_samples_per_sec'] = stats['samples'] / elapsed if elapsed > 0 else 0.
+            shard_stats.append(stats)
+        return shard_stats
+
+    def log_stats(self):
+        for stats in self.stats():
+            logger.debug("[Shard %d] Meters: %d Samples: %d Edges: %d "
+                         "Throughput: %.1f samples/s (busy) %.1f samples/s (wall)",
+                         stats['shard'], stats['meters'], stats['samples'], stats['edges'],
+                         stats['samples_per_sec'], stats['wall_samples_per_sec'])
+
+    def stop(self, timeout=10):
+        """
+        Flushes the detectors, stops the workers and returns the remaining edges
+        """
+        self.flush()
+        for in_queue in self.in_queues:
+            in_queue.put(('stop', None))
+
+        edges = []
+        deadline = time.time() + timeout
+        while any(worker.is_alive() for worker in self.workers) and time.time() < deadline:
+            edges.extend(self.collect(timeout=0.1))
+        edges.extend(self.collect())
+
+        for worker in self.workers:
+            worker.join(0.1)
+            if worker.is_alive():
+                worker.terminate()
+        self.in_queues = []
+        self.workers = []
+        return edges
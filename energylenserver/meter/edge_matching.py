@@ -9,6 +9,7 @@ from django_pandas.io import read_frame
 
 from energylenserver.common_imports import *
 from energylenserver.models import functions as mod_func
+from energylenserver.models.snapshot import get_snapshot
 from energylenserver.core import functions as func
 
 from energylenserver import common_offline as off_func
@@ -61,8 +62,7 @@ def match_events_offline(off_event):
     # logger.debug("On Events DF: \n%s", df)
 
     # Get Metadata
-    data = mod_func.retrieve_metadata(apt_no)
-    metadata_df = read_frame(data, verbose=False)
+    metadata_df = get_snapshot(apt_no).metadata()
 
     # Range of OFF event
     power = off_mag * percent_change
@@ -262,8 +262,7 @@ def match_events(apt_no, off_event):
     # logger.debug("On Events DF: \n%s", df)
 
     # Get Metadata
-    data = mod_func.retrieve_metadata(apt_no)
-    metadata_df = read_frame(data, verbose=False)
+    metadata_df = get_snapshot(apt_no).metadata()
 
     # Range of OFF event
     power = off_mag * percent_change
@@ -5,6 +5,9 @@ Contains all the filters required for the meter data
 import math
 import datetime as dt
 
+import numpy as np
+import pandas as pd
+
 from energylenserver.common_imports import *
 logger = logging.getLogger('energylensplus_meterdata')
 
@@ -18,11 +21,52 @@ def remove_duplicate_edges(df):
 
 
 def filter_select_maxtime_edge(df):
+    """
+    Select the edge amongst a group of edges within a small time frame (a minute)
+    and which are close to each other in terms of magnitude
+    with maximum timestamp
+
+    Array version of filter_select_maxtime_edge_iterative. Each consecutive
+    pair of edges decides whether the earlier edge is kept or is replaced
+    by the next one
+    """
+    n = len(df.index)
+    if n == 0:
+        return df
+
+    time = df['time'].values.astype('float64')
+    mag = np.abs(df['magnitude'].values.astype('float64'))
+    curr_power = np.abs(df['curr_power'].values.astype('float64'))
+
+    # Pairs of consecutive edges (i, i + 1)
+    within_min = (time[1:] - time[:-1]) <= 60
+    t_mag = mag[:-1]
+    curr_diff = np.abs(curr_power[1:] - curr_power[:-1])
+
+    threshold = np.where(t_mag <= 60, 0.2, np.where(t_mag >= 1000, 0.25, 0.1))
+    similar_mag = np.abs(t_mag - mag[1:]) <= threshold * t_mag
+
+    same_power = within_min & (curr_diff == 0)
+    small_diff = within_min & ~same_power & (curr_diff < 0.5 * thresmin) & (t_mag <= 60)
+    # Next edge replaces the current one
+    forward = same_power | (within_min & ~same_power & ~small_diff & similar_mag)
+
+    keep = np.ones(n, dtype=bool)
+    keep[:-1] = ~forward
+    # The last edge is dropped when it was marked for removal by the
+    # previous edge and the previous edge did not come from a forward
+    if n > 1:
+        prev_forward = forward[-2] if n > 2 else False
+        keep[-1] = not (small_diff[-1] and not prev_forward)
+
+    return df[keep].sort(['time'])
+
+
+def filter_select_maxtime_edge_iterative(df):
 
     # Select the edge amongst a group of edges within a small time frame (a minute)
     # and which are close to each other in terms of magnitude
     # with maximum timestamp
-
     tmp_df = df.copy()
     tmp_df['tmin'] = [str(dt.datetime.fromtimestamp(i).hour) + '-' +
                       str(dt.datetime.fromtimestamp(i).minute) for i in tmp_df.time]
@@ -100,6 +144,49 @@ def filter_unmon_appl_edges(df):
     """
     Filters out appliances that are not of interest
     e.g. washing machine, fridge and geyser
+
+    Array version of filter_unmon_appl_edges_iterative
+    """
+    # --Filter out washing machine--
+
+    # Removing a sequence of rise and fall edges which
+    # have magnitude within 1% of each other
+    if len(df.index) < 2:
+        return df.sort(['time'])
+
+    magnitude = df.magnitude.abs().astype('int').values
+    time = df['time'].values
+    order = np.argsort(time, kind='mergesort')
+
+    # Each edge is compared with the edge preceding it in time,
+    # the first one with the edge at index 0
+    first = df.index.get_loc(0) if 0 in df.index else order[0]
+    prev_pos = np.concatenate([[first], order[1:-1]])
+    curr_pos = order[1:]
+
+    # Magnitude ratios of integer magnitudes (integer division)
+    diff = (magnitude[prev_pos] // magnitude[curr_pos]).astype('float64')
+    # The edge at index 0 is compared with its magnitude as stored
+    first_mag = df['magnitude'].values[first]
+    if df['magnitude'].dtype.kind in 'iu':
+        diff[0] = first_mag // magnitude[curr_pos[0]]
+    else:
+        diff[0] = float(first_mag) / magnitude[curr_pos[0]]
+
+    matched = ((diff > 0.8) & (diff <= 1) & (time[curr_pos] - time[prev_pos] < 60) &
+               (magnitude[curr_pos] < 600))
+
+    remove = np.zeros(len(df.index), dtype=bool)
+    remove[prev_pos[matched]] = True
+    remove[curr_pos[matched]] = True
+
+    return df[~remove].sort(['time'])
+
+
+def filter_unmon_appl_edges_iterative(df):
+    """
+    Filters out appliances that are not of interest
+    e.g. washing machine, fridge and geyser
     """
     # --Filter out washing machine--
 
@@ -125,7 +212,6 @@ def filter_unmon_appl_edges(df):
         prev = df.ix[idx]
         prev_idx = idx
 
-    print df_index
     df_index = df_index - idx_list
     df_orig = df_orig.ix[df_index].sort(['time'])
     return df_orig
@@ -139,6 +225,22 @@ def filter_transitional_edges(df):
     return df
 
 
+def in_int_range(values, low, high):
+    """
+    Equivalent of `value in range(low, high)` for an array of values
+    """
+    return (values == np.floor(values)) & (values >= low) & (values < high)
+
+
+def power_lookup(df_p):
+    """
+    Time indexed lookup of the power series
+    Returns the first power value seen at each timestamp
+    """
+    df_p = df_p.drop_duplicates('time')
+    return dict(zip(df_p.time, df_p.power))
+
+
 def filter_apt_edges(rise_df, fall_df, apt_no, etype, df_p):
 
     # Removing duplicate indexes
@@ -155,122 +257,78 @@ def filter_apt_edges(rise_df, fall_df, apt_no, etype, df_p):
 
         # Filter 1
         # Filtering out edges with magnitude between 130 to 150
-        # Rising Edges
-        idx_list = []
-        for i in rise_df.index:
-            magnitude = rise_df.ix[i]['magnitude']
-            time = rise_df.ix[i]['time']
-            if apt_no == '603':
-                # Likely power consumption of fridge is 110-150
-                if magnitude >= 110 and magnitude <= 150:
-                    print "idx", i, "magnitude", magnitude
-                    idx_list.append(i)
-            elif apt_no == '703':
-                if magnitude >= 130 and magnitude <= 190:
-                    idx_list.append(i)
-                # 26-27Nov
-                # if time in range(1385470967, 1385471880):
-                #     idx_list.append(i)
-        rise_df = rise_df.ix[rise_df.index - idx_list]
-
-        # Falling Edges
-        idx_list = []
-        for i in fall_df.index:
-            magnitude = math.fabs(fall_df.ix[i]['magnitude'])
-            time = math.fabs(fall_df.ix[i]['time'])
-            if apt_no == '603':
-                # Likely power consumption of fridge is 110-150
-                if magnitude >= 110 and magnitude <= 150:
-                    print "idx", i, "magnitude", magnitude
-                    idx_list.append(i)
-            elif apt_no == '703':
-                if magnitude >= 130 and magnitude <= 170:
-                    idx_list.append(i)
-                # 26-27Nov
-                # if time in range(1385470967, 1385471880):
-                #     idx_list.append(i)
-                # 28-29Nov
-                if time in range(1385646060, 1385648144):
-                    idx_list.append(i)
-        fall_df = fall_df.ix[fall_df.index - idx_list]
+        rise_mag = rise_df.magnitude.values
+        fall_mag = np.abs(fall_df.magnitude.values)
+        fall_time = np.abs(fall_df.time.values)
+        if apt_no == '603':
+            # Likely power consumption of fridge is 110-150
+            rise_df = rise_df[~((rise_mag >= 110) & (rise_mag <= 150))]
+            fall_df = fall_df[~((fall_mag >= 110) & (fall_mag <= 150))]
+        elif apt_no == '703':
+            rise_df = rise_df[~((rise_mag >= 130) & (rise_mag <= 190))]
+            # 28-29Nov
+            fall_df = fall_df[~(((fall_mag >= 130) & (fall_mag <= 170)) |
+                                in_int_range(fall_time, 1385646060, 1385648144))]
+        rise_df = rise_df.sort_index()
+        fall_df = fall_df.sort_index()
 
         # Filter 2 - removing RO edges
-        print "\nFiltering process started.....\n"
+        # Single sweep over the edges in time order
         edge_total_list = pd.concat([rise_df, fall_df])
         edge_total_list = edge_total_list.sort(['time'])
         edge_index = edge_total_list.index
+        times = edge_total_list.time.values
+        mags = edge_total_list.magnitude.values
+        curr_powers = edge_total_list.curr_power.values
+        power_at = power_lookup(df_p)
+
         # List containing indexes to remove
-        rise_idx_list = []
-        fall_idx_list = []
-        for i, idx in enumerate(edge_total_list.index):
-            now_edge = edge_total_list.ix[idx]['time']
-            now_mag = edge_total_list.ix[idx]['magnitude']
-            if i + 1 not in range(0, len(edge_index)):
+        rise_idx_list = set()
+        fall_idx_list = set()
+        n_edges = len(edge_index)
+        for i, idx in enumerate(edge_index):
+            now_edge = times[i]
+            now_mag = mags[i]
+            now_mag_abs = int(math.fabs(now_mag))
+
+            if i + 1 == n_edges:
                 # Reached the end
-                if now_mag < 0 and int(math.fabs(now_mag)) in range(60, 75):
+                if now_mag < 0 and 60 <= now_mag_abs < 75:
                     # If diff power between curr and prev power last 20 seconds
                     # is similar to the fall mag then select edge
-                    curr_power = edge_total_list.ix[idx]['curr_power']
                     for j in range(20, 26):
-                        # Find prev power
-                        prev_time = now_edge - j
-                        row_df = df_p[df_p.time == prev_time]
-                        if len(row_df) > 0:
-                            prev_sec_power = row_df.ix[row_df.index[0]]['power']
-                            diff_power = int(curr_power - prev_sec_power)
-                            if now_mag in range(int(diff_power) - 2, int(diff_power) + 3):
-                                fall_idx_list.append(idx)
+                        prev_sec_power = power_at.get(now_edge - j)
+                        if prev_sec_power is not None:
+                            diff_power = int(curr_powers[i] - prev_sec_power)
+                            if now_mag in range(diff_power - 2, diff_power + 3):
+                                fall_idx_list.add(idx)
                 continue
 
-            next_edge = edge_total_list.ix[edge_index[i + 1]]['time']
-            next_mag = edge_total_list.ix[edge_index[i + 1]]['magnitude']
+            next_edge = times[i + 1]
+            next_mag = mags[i + 1]
             diff = int(math.fabs(next_edge)) - int(now_edge)
 
-            if ((now_edge < 0 and int(math.fabs(now_mag)) in range(60, 75))
-                    or now_edge == 1385383788 or next_mag == 1385383788):
-                print "\nNow time", dt.datetime.fromtimestamp(now_edge)
-                print "Next time", dt.datetime.fromtimestamp(next_edge)
-                print "Now mag", now_mag, "next mag", next_mag
-                print "Diff", diff
-
             # Its a falling edge and magnitude is b/w 60 - 70 and previous edge was a rising edge
-            if (next_mag < 0 and int(math.fabs(next_mag)) in range(60, 75)
-                    and now_edge > 0 and diff in range(20, 30)
+            if (next_mag < 0 and 60 <= int(math.fabs(next_mag)) < 75
+                    and now_edge > 0 and 20 <= diff < 30
                     and int(now_mag * 0.1) == int(math.fabs(next_mag) * 0.1)):
                 # Removing both edges
-                rise_idx_list.append(idx)
-                fall_idx_list.append(edge_index[i + 1])
+                rise_idx_list.add(idx)
+                fall_idx_list.add(edge_index[i + 1])
             # If rising edge was not detected
-            elif now_mag < 0 and int(math.fabs(now_mag)) in range(60, 75):
-                print "\nNow time", dt.datetime.fromtimestamp(now_edge)
-                print "Next time", dt.datetime.fromtimestamp(next_edge)
-                print "Now mag", now_mag, "next mag", next_mag
-                print "Diff", diff
-
+            elif now_mag < 0 and 60 <= now_mag_abs < 75:
                 # If diff power between curr and prev power last 20 seconds
                 # is similar to the fall mag then select edge
-                curr_power = edge_total_list.ix[idx]['curr_power']
                 for j in range(20, 30):
-                    # Find prev power
-                    prev_time = now_edge - j
-                    row_df = df_p[df_p.time == prev_time]
-
-                    if len(row_df) > 0:
-
-                        prev_sec_power = row_df.ix[row_df.index[0]]['power']
-                        diff_power = int(curr_power - prev_sec_power)
-                        if (int(math.fabs(now_mag)) in range(diff_power - 2, diff_power + 3)):
-                            print "j=", j
-                            print "curr_power", curr_power
-                            print "prev_time", prev_time
-                            print "row", row_df
-                            print "prev_sec_power", prev_sec_power, 'diff_power', diff_power
-                            fall_idx_list.append(idx)
-        rise_idx_list = list(set(rise_idx_list))
-        fall_idx_list = list(set(fall_idx_list))
+                    prev_sec_power = power_at.get(now_edge - j)
+                    if prev_sec_power is not None:
+                        diff_power = int(curr_powers[i] - prev_sec_power)
+                        if diff_power - 2 <= now_mag_abs < diff_power + 3:
+                            fall_idx_list.add(idx)
+
         # Removing selected edges
-        rise_df = rise_df.ix[rise_df.index - rise_idx_list]
-        fall_df = fall_df.ix[fall_df.index - fall_idx_list]
+        rise_df = rise_df[~np.in1d(rise_df.index.values, list(rise_idx_list))]
+        fall_df = fall_df[~np.in1d(fall_df.index.values, list(fall_idx_list))]
 
     return rise_df, fall_df
 
@@ -289,54 +347,72 @@ def filter_edges(rise_df, fall_df, winmin):
     # FILTER 1:
     # Handle cases where 2 rising edges corresponding to a single
     # falling edge - combining them to one edge
-
-    for ix_i in rise_df.index:
+    # Rising edges are sorted once by time and each edge looks only at the
+    # edges winmin to winmin + 2 seconds away from it
+    labels = rise_df.index.values
+    times = rise_df.time.values.astype('float64')
+    mags = rise_df.magnitude.values
+    order = np.argsort(times, kind='mergesort')
+    sorted_times = times[order]
+
+    new_mags = mags.copy()
+    removed = np.zeros(len(labels), dtype=bool)
+    for i in range(len(labels)):
+        if removed[i]:
+            continue
         sim_edge_set = []
-        for ix_j in rise_df.index:
-            curr_prev_diff = math.fabs(rise_df.ix[ix_j]['time'] -
-                                       rise_df.ix[ix_i]['time'])
-            if ix_i == ix_j or ix_i > ix_j:
-                continue
-            elif curr_prev_diff in range(winmin, winmin + 2 + 1):
-                logger.debug("Index i: %d", ix_i)
-                logger.debug("Index j: %d", ix_j)
-                sim_edge_set.append(ix_j)
+        for low, high in [(times[i] - winmin - 2, times[i] - winmin),
+                          (times[i] + winmin, times[i] + winmin + 2)]:
+            start = np.searchsorted(sorted_times, low, side='left')
+            end = np.searchsorted(sorted_times, high, side='right')
+            for j in order[start:end]:
+                # Only integral time differences in range(winmin, winmin + 3)
+                diff = math.fabs(times[j] - times[i])
+                if labels[j] > labels[i] and not removed[j] and diff == int(diff):
+                    sim_edge_set.append(j)
+
         # Add the magnitude of the two edges and convert into a single
-        # edge
+        # edge. The second edge (the largest, first in index order) is removed
         if len(sim_edge_set) > 0:
-            tmp = rise_df.ix[sim_edge_set]
-            sel_idx = tmp[tmp.magnitude == tmp.magnitude.max()].index[0]
-            new_mag = (rise_df.ix[ix_i]['magnitude'] +
-                       rise_df.ix[sel_idx]['magnitude'])
-            rise_df.ix[ix_i]['magnitude'] = new_mag
-            logger.debug("Inside Index j: %s New Mag: %s ", sel_idx, new_mag)
-            logger.debug("Rise time:: %s Rise Time (2): %s",
-                         dt.datetime.fromtimestamp(rise_df.ix[ix_i]['time']),
-                         dt.datetime.fromtimestamp(rise_df.ix[sel_idx]['time']))
-            # Remove the second edge
-            rise_df.drop(sel_idx)
+            sel = min(sim_edge_set, key=lambda j: (-new_mags[j], j))
+            new_mags[i] = mags[i] + new_mags[sel]
+            removed[sel] = True
+            logger.debug("Index i: %s Index j: %s New Mag: %s", labels[i], labels[sel],
+                         new_mags[i])
+    if len(labels) > 0:
+        rise_df = rise_df.copy()
+        rise_df['magnitude'] = new_mags
+        rise_df = rise_df[~removed]
 
     # FILTER 2:
     # Filter out spike edges where rising and falling edges
     # are within a small time frame (lwinmin)
     # This is to remove quick successive turn ON and OFFs
+    # An edge pairs with a later indexed edge of the negated magnitude
+    # in the same 100 second slot
 
     tmp = pd.concat([rise_df, fall_df])
-    tmp = tmp.sort('time')
-    tmp['ts'] = (tmp.time / 100).astype('int')
-    # logger.debug("\nConcatenated TMPDF::\n %s", tmp)
-    for i, ix_i in enumerate(tmp.index):
-        for j, ix_j in enumerate(tmp.index):
-            if(ix_i == ix_j) or ix_i > ix_j:
-                continue
-            elif (tmp.ix[ix_i]['ts'] == tmp.ix[ix_j]['ts'] and
-                  tmp.ix[ix_i]['magnitude'] > tmp.ix[ix_j]['magnitude'] and
-                  tmp.ix[ix_j]['magnitude'] == -tmp.ix[ix_i]['magnitude']):
-                logger.debug("Index i:: %s", ix_i)
+    ts = (tmp.time / 100).astype('int').values
+    tmp_mags = tmp.magnitude.values
+
+    slots = {}
+    for ix_j, ts_j, mag_j in zip(tmp.index, ts, tmp_mags):
+        if mag_j < 0:
+            slots.setdefault((ts_j, -mag_j), []).append(ix_j)
+
+    rise_idx_list = set()
+    fall_idx_list = set()
+    for ix_i, ts_i, mag_i in zip(tmp.index, ts, tmp_mags):
+        if mag_i <= 0:
+            continue
+        for ix_j in slots.get((ts_i, mag_i), []):
+            if ix_i < ix_j:
                 logger.debug("Removing %s %s", ix_i, ix_j)
-                if ix_i in rise_df.index:
-                    rise_df = rise_df.drop(ix_i)
-                fall_df = fall_df.drop(ix_j)
+                rise_idx_list.add(ix_i)
+                fall_idx_list.add(ix_j)
+
+    rise_df = rise_df[~np.in1d(rise_df.index.values, list(rise_idx_list))]
+    fall_df = fall_df[~np.in1d(fall_df.index.values, list(fall_idx_list))]
 
     return rise_df, fall_df
 
@@ -349,19 +425,16 @@ def filter_time_slices(time_slices, apt_no, exp_no):
 
     if apt_no == '102A':
         # Likely power consumption of fridge is 110 - 180
-        fridge_ts = time_slices[(time_slices.magnitude >= 110) & (time_slices.magnitude <= 180) &
-                                (time_slices.type == 'power')]
-        print fridge_ts
-        time_slices = time_slices.ix[time_slices.index - fridge_ts.index]
+        fridge = ((time_slices.magnitude >= 110) & (time_slices.magnitude <= 180) &
+                  (time_slices.type == 'power'))
+        time_slices = time_slices[~fridge]
 
         # Old Experiment No. 3 for ELens13 experiments
         if exp_no == 'elens3':
-            discard_ts = time_slices[
-                (time_slices.phase == 'Not Found') & (time_slices.magnitude < 100)]
-            time_slices = time_slices.ix[time_slices.index - discard_ts.index]
+            time_slices = time_slices[
+                ~((time_slices.phase == 'Not Found') & (time_slices.magnitude < 100))]
 
     elif apt_no == '603':
-        print "here"
         # Likely power consumption of fridge is 110-150
         time_slices = time_slices[(time_slices.magnitude < 110) | (time_slices.magnitude > 150) &
                                   (time_slices.type == 'power')]
@@ -373,19 +446,17 @@ def filter_time_slices(time_slices, apt_no, exp_no):
 
     elif apt_no == '703':
         # Likely power consumption of fridge is 130-152
-        fridge_ts = time_slices[(time_slices.magnitude >= 130) & (time_slices.magnitude <= 170) &
-                                (time_slices.type == 'power')]
-        time_slices = time_slices.ix[time_slices.index - fridge_ts.index]
+        fridge = ((time_slices.magnitude >= 130) & (time_slices.magnitude <= 170) &
+                  (time_slices.type == 'power'))
+        time_slices = time_slices[~fridge]
 
         # Likely power consumption of geyser > 2000 but on light phase > 1000
-        geyser_ts = time_slices[(time_slices.magnitude > 1000) & (time_slices.type == 'light')]
-        time_slices = time_slices.ix[time_slices.index - geyser_ts.index]
+        time_slices = time_slices[~((time_slices.magnitude > 1000) & (time_slices.type == 'light'))]
 
         # 26-27Nov
         if exp_no == '26-27Nov':
-            washing_ts = time_slices[
-                (time_slices.start_time >= 1385470967) & (time_slices.end_time <= 1385471880)]
-            time_slices = time_slices.ix[time_slices.index - washing_ts.index]
+            time_slices = time_slices[
+                ~((time_slices.start_time >= 1385470967) & (time_slices.end_time <= 1385471880))]
 
         # 28-29Nov
         if exp_no == '28-29Nov':
@@ -393,18 +464,7 @@ def filter_time_slices(time_slices, apt_no, exp_no):
                 (time_slices.start_time < 1385646060) | (time_slices.end_time > 1385648143)]
 
     # Removing time slices with duration less than 30 seconds
-    idx_list = []
-    for idx in time_slices.index:
-        start_time = time_slices.ix[idx]['start_time']
-        end_time = time_slices.ix[idx]['end_time']
-        magnitude = time_slices.ix[idx]['magnitude']
-
-        time_diff = end_time - start_time
-
-        if time_diff < 30 and magnitude < 80:
-            print "idx", idx, "time_diff", time_diff, "magnitude", magnitude
-            # Qualified for filtering it
-            idx_list.append(idx)
-    time_slices = time_slices.ix[time_slices.index - idx_list]
+    short = ((time_slices.end_time - time_slices.start_time) < 30) & (time_slices.magnitude < 80)
+    time_slices = time_slices[~short]
 
-    return time_slices
+    return time_slices.sort_index()
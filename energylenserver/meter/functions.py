@@ -3,7 +3,8 @@ import pandas as pd
 import numpy as np
 import datetime as dt
 
-from smap import get_meter_data_for_time_slice
+from smap import get_meter_data_for_time_slice, client, smap_apt_no
+from latest_power import get_latest_power
 from edge_detection import *
 from constants import *
 from energylenserver.functions import *
@@ -21,9 +22,56 @@ def compute_power(start_mag, end_mag):
     return int(round((start_mag + end_mag) / 2))
 
 
-def training_compute_power(apt_no, start_time, end_time):
+def phone_time_diff(apt_no):
+    """
+    Difference (in seconds) to add to the phone time to get the meter time
+
+    --- Negligible time difference ---
+    Measure the difference between time of the phone with the meter data
+    Once measured, set the global variable in the constants
+    If phone is ahead, subtract from the time sent
+    If phone is behind, add to the time sent
+    """
+    if apt_no == 1201:
+        return 0
+    elif apt_no == 103:
+        return 3
+    elif apt_no == 102:
+        return -9
+    return time_diff
+
+
+def training_data_end_time(apt_no, end_time):
+    """
+    Time (in seconds) up to which meter data is needed to compute the power
+    of a training interval ending at <end_time> (phone time in ms)
+    """
+    edge_window = winmax * sampling_rate + 5
+    return int(end_time) / 1000 + phone_time_diff(apt_no) + edge_window + 3
+
+
+def latest_meter_data_time(apt_no):
+    """
+    Time (in seconds) of the latest meter reading of the apartment
+    or None if not known
+    """
+    latest = get_latest_power(smap_apt_no(apt_no))
+    if latest is not None:
+        return latest[0] / 1000.
+
+    readings = [stream['Readings'][0] for stream in client.get_latest_readings([apt_no])
+                if len(stream['Readings']) > 0]
+    if len(readings) == 0:
+        return None
+    return max(r_time for r_time, power in readings) / 1000.
+
+
+def training_compute_power(apt_no, start_time, end_time, wait=True):
     """
     Computes the power consumption in the given time interval
+
+    Waits for the meter data of the interval to arrive unless <wait> is False
+    i.e. the caller has checked that the data is available
     """
 
     logger.debug("Computing power for training data...")
@@ -39,22 +87,9 @@ def training_compute_power(apt_no, start_time, end_time):
         start_time, date_format), timestamp_to_str(end_time, date_format))
 
     # '''
-    # --- Negligible time difference ---
-    # Measure the difference between time of the phone with the meter data
-    # Once measured, set the global variable in the constants
-    # If phone is ahead, subtract from the time sent
-    # If phone is behind, add to the time sent
-
-    if apt_no == 1201:
-        time_diff = 0
-    elif apt_no == 103:
-        time_diff = 3
-    elif apt_no == 102:
-        time_diff = -9
-
     # Convert time to seconds and add/subtract the difference time
-    start_time = start_time + time_diff
-    end_time = end_time + time_diff
+    start_time = start_time + phone_time_diff(apt_no)
+    end_time = end_time + phone_time_diff(apt_no)
     logger.debug("New:: ST: %s ET:%s", timestamp_to_str(
         start_time, date_format), timestamp_to_str(end_time, date_format))
     # '''
@@ -72,7 +107,8 @@ def training_compute_power(apt_no, start_time, end_time):
     # Retrieve power data from smap server for both meters
     # between <start_time> and <end_time>
     # if apt_no == 1201:
-    time.sleep(winmax * 2)
+    if wait:
+        time.sleep(winmax * 2)
     if apt_no in [102, '102A']:
         apt_no = '102A'
     streams_df_list = get_meter_data_for_time_slice(apt_no, s_time, e_time)
@@ -242,59 +278,70 @@ def training_compute_power(apt_no, start_time, end_time):
     return power
 
 
-def combine_streams(df):
+def fill_gaps(values):
     """
-    Receives the light and power streams and combines them into one stream
+    Fills the missing (NaN) values of an array with the previous value and
+    the leading missing values with the first available one
     """
+    missing = np.isnan(values)
+    if missing.all():
+        return values
+
+    # Forward fill: position of the last available value at each position
+    last_idx = np.where(missing, 0, np.arange(len(values)))
+    np.maximum.accumulate(last_idx, out=last_idx)
+    values = values[last_idx]
+
+    # Backward fill the values before the first available value
+    first_idx = np.argmax(~missing)
+    values[:first_idx] = values[first_idx]
+    return values
 
-    stream1_df = df[0]
-    stream2_df = df[1]
 
-    stream1_df['time'] = (stream1_df['time']).astype('int')
-    stream2_df['time'] = (stream2_df['time']).astype('int')
+def align_streams(streams_df_list, rate=sampling_rate):
+    """
+    Aligns the meter streams on a common sampling grid spanning all the streams
 
-    start_time = min(stream1_df.ix[0]['time'], stream2_df.ix[0]['time'])
-    end_time = max(stream1_df.ix[stream1_df.index[-1]]['time'],
-                   stream2_df.ix[stream2_df.index[-1]]['time'])
-    # logger.debug ("ST:%s ET:%s", start_time, end_time)
+    Returns: time grid and an array of the power values of each stream
+    (one row per stream), gaps filled forward and then backward
+    """
+    time_list = [df['time'].values.astype('int64') for df in streams_df_list]
+    start_time = min(t.min() for t in time_list)
+    end_time = max(t.max() for t in time_list)
 
-    time_values = range(start_time, end_time + 1, sampling_rate)
-    n_time_values = len(time_values)
-    # logger.debug ("Total values: %d ", n_time_values)
+    time_values = np.arange(start_time, end_time + 1, rate)
+    power_values = np.empty((len(streams_df_list), len(time_values)))
+    power_values.fill(np.nan)
 
-    stream1 = dict(zip(stream1_df.time, stream1_df.power))
-    stream2 = dict(zip(stream2_df.time, stream2_df.power))
+    for i, (df, times) in enumerate(zip(streams_df_list, time_list)):
+        offset = times - start_time
+        # Only readings falling on the sampling grid
+        on_grid = (offset % rate) == 0
+        power = df['power'].values.astype('float64')
+        power_values[i, offset[on_grid] / rate] = power[on_grid]
+        power_values[i] = fill_gaps(power_values[i])
 
-    # logger.debug ("Stream1 %s", stream1)
-    # logger.debug ("Stream2 %s", stream2)
+    return time_values, power_values
 
-    stream1_new = dict(zip(time_values, [np.NaN] * n_time_values))
-    stream2_new = dict(zip(time_values, [np.NaN] * n_time_values))
-    for t in time_values:
-        if t in stream1:
-            stream1_new[t] = stream1[t]
-        if t in stream2:
-            stream2_new[t] = stream2[t]
 
-    # Sorting dictionaries
-    streams = [pd.DataFrame(columns=['time', 'power'])] * 2
-    for i, stream in enumerate([stream1_new, stream2_new]):
-        for key in sorted(stream.iterkeys()):
-            stream[key] = stream[key]
+def combine_streams(df):
+    """
+    Receives the light and power streams and combines them into one stream
+    """
+    streams_df_list = [stream_df for stream_df in df if len(stream_df) > 0]
+    if len(streams_df_list) == 0:
+        return pd.DataFrame(columns=['time', 'power'])
 
-        streams[i] = pd.DataFrame(stream.items(), columns=['time', 'power'])
-        streams[i].fillna(method='pad', inplace=True)
-        streams[i].fillna(method='bfill', inplace=True)
-        # logger.debug ("Stream %d :\n%s", i, streams[i].head(10))
+    # Removing duplicate readings - the last reading is retained
+    streams_df_list = [stream_df.drop_duplicates(cols='time', take_last=True)
+                       for stream_df in streams_df_list]
+
+    time_values, power_values = align_streams(streams_df_list)
 
     # Combining Streams
-    comb_stream_df = pd.DataFrame({'time': time_values, 'power': [0] * n_time_values},
+    comb_stream_df = pd.DataFrame({'time': time_values,
+                                   'power': power_values.sum(axis=0)},
                                   columns=['time', 'power'])
-    # comb_stream_df['time'] = comb_stream_df['time'] * 1000
-    for idx in comb_stream_df.index:
-        comb_stream_df.ix[idx]['power'] = streams[0].ix[idx]['power'] + streams[1].ix[idx]['power']
-
-    comb_stream_df.sort('time', inplace=True)
     # logger.debug ("Combined Stream:\n %s", comb_stream_df.head(20))
 
     return comb_stream_df
@@ -0,0 +1,218 @@
+"""
+Ingests the sMAP republish streams of the apartments
+
+The apartments are split into groups and each group is streamed over its
+own connection by a thread with its own parser, back off and health
+metrics, so that a stalled or failing stream does not hold up the others.
+The readings of all the streams are put on a shared queue consumed by the
+meter data client (getmeterdata)
+"""
+
+import time
+import Queue
+import threading
+
+import pycurl
+
+from energylenserver.constants import SMAP_URL
+from constants import *
+from smap import apt_where_clause
+from stream_parser import StreamParser
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+# Global variables
+stream_url = SMAP_URL + "/republish"
+
+
+def apartment_groups(apt_list, group_size=stream_group_size):
+    """
+    Splits the apartments into groups sharing a stream
+    """
+    return [apt_list[i:i + group_size] for i in range(0, len(apt_list), group_size)]
+
+
+class StreamConnection(threading.Thread):
+
+    """
+    Republish stream of a group of apartments
+    Reconnects with its own back off when the stream fails or stalls
+    """
+
+    def __init__(self, name, apt_list, out_queue, url=stream_url):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+
+        self.apt_list = apt_list
+        self.payload = apt_where_clause(apt_list)
+        self.url = url
+        self.out_queue = out_queue
+        self.parser = StreamParser()
+        self.stopped = threading.Event()
+
+        self.reset_backoff()
+
+        # Health metrics
+        self.state = 'idle'
+        self.connects = 0
+        self.failures = 0
+        self.last_data_time = None
+        self.last_error = None
+
+    def reset_backoff(self):
+        self.backoff_network_error = 0.25
+        self.backoff_http_error = 5
+        self.backoff_rate_limit = 60
+
+    def on_receive(self, data):
+        """
+        Parses the received data and puts the readings on the queue
+        """
+        if self.stopped.is_set():
+            # Aborts the transfer
+            return -1
+
+        if self.state != 'streaming':
+            self.state = 'streaming'
+            self.reset_backoff()
+        self.last_data_time = time.time()
+
+        self.parser.feed(data)
+        readings = self.parser.take()
+        if len(readings) == 0:
+            return
+
+        # Waits for the consumer if the queue is full
+        while not self.stopped.is_set():
+            try:
+                self.out_queue.put((self.name, readings), timeout=1)
+                return
+            except Queue.Full:
+                continue
+
+    def connect(self):
+        conn = pycurl.Curl()
+        conn.setopt(pycurl.URL, self.url)
+        conn.setopt(pycurl.POST, 1)
+        conn.setopt(pycurl.POSTFIELDS, self.payload)
+        conn.setopt(pycurl.WRITEFUNCTION, self.on_receive)
+        conn.setopt(pycurl.CONNECTTIMEOUT, stream_connect_timeout)
+        # Stalled stream: no data for stream_stall_timeout seconds
+        conn.setopt(pycurl.LOW_SPEED_LIMIT, 1)
+        conn.setopt(pycurl.LOW_SPEED_TIME, stream_stall_timeout)
+        return conn
+
+    def wait(self, seconds):
+        self.state = 'backoff'
+        logger.error('[%s] Waiting %s seconds before trying again', self.name, seconds)
+        self.stopped.wait(seconds)
+
+    def run(self):
+        """
+        Streams the readings of the apartments until stopped
+        """
+        logger.debug("[%s] Opening data stream for %s", self.name, self.apt_list)
+        while not self.stopped.is_set():
+            # A partial document of the old connection is not completed by the new one
+            self.parser.buffer = ''
+            self.state = 'connecting'
+            self.connects += 1
+
+            conn = self.connect()
+            try:
+                conn.perform()
+                sc = conn.getinfo(pycurl.HTTP_CODE)
+            except pycurl.error, e:
+                if self.stopped.is_set():
+                    break
+                # Network error or stalled stream, use linear back off up to 16 seconds
+                self.failures += 1
+                self.last_error = str(e)
+                logger.error('[%s] Network error: %s', self.name, e)
+                self.wait(self.backoff_network_error)
+                self.backoff_network_error = min(self.backoff_network_error + 1, 16)
+                continue
+            finally:
+                conn.close()
+
+            self.failures += 1
+            if sc == 200:
+                # Stream closed by the server
+                self.last_error = "Stream closed"
+                logger.error('[%s] Stream closed by the server', self.name)
+                self.wait(self.backoff_network_error)
+                self.backoff_network_error = min(self.backoff_network_error + 1, 16)
+            elif sc == 420:
+                # Rate limit, use exponential back off starting with 1 minute and double
+                # each attempt
+                self.last_error = "Rate limit"
+                logger.error('[%s] Rate limit', self.name)
+                self.wait(self.backoff_rate_limit)
+                self.backoff_rate_limit *= 2
+            else:
+                # HTTP error, use exponential back off up to 320 seconds
+                self.last_error = "HTTP error %s" % sc
+                logger.error('[%s] HTTP error %s', self.name, sc)
+                self.wait(self.backoff_http_error)
+                self.backoff_http_error = min(self.backoff_http_error * 2, 320)
+
+        self.state = 'stopped'
+
+    def health(self):
+        """
+        Returns the health metrics of the stream
+        """
+        health = self.parser.stats()
+        health.update({'apartments': self.apt_list, 'state': self.state,
+                       'connects': self.connects, 'failures': self.failures,
+                       'last_error': self.last_error})
+        if self.last_data_time is None:
+            health['data_age'] = None
+        else:
+            health['data_age'] = time.time() - self.last_data_time
+        return health
+
+    def stop(self):
+        self.stopped.set()
+
+
+class Ingestor:
+
+    """
+    Streams of all the apartment groups feeding a shared queue
+    """
+
+    def __init__(self, apt_list, group_size=stream_group_size, url=stream_url):
+        self.queue = Queue.Queue(maxsize=stream_queue_size)
+        self.streams = [StreamConnection("stream-%d" % i, group, self.queue, url)
+                        for i, group in enumerate(apartment_groups(apt_list, group_size))]
+
+    def start(self):
+        for stream in self.streams:
+            stream.start()
+
+    def get(self, timeout=1):
+        """
+        Returns the next (stream name, readings) from the streams, or None if
+        nothing was received within the timeout
+        readings: dict of uuid -> (times in ms, power) arrays
+        """
+        try:
+            return self.queue.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    def health(self):
+        return dict((stream.name, stream.health()) for stream in self.streams)
+
+    def log_health(self):
+        for name, health in sorted(self.health().iteritems()):
+            logger.debug("[%s] Stream health: %s", name, health)
+
+    def stop(self, timeout=5):
+        for stream in self.streams:
+            stream.stop()
+        for stream in self.streams:
+            stream.join(timeout)
@@ -0,0 +1,134 @@
+"""
+Latest power readings of the apartments
+
+The meter data client (getmeterdata) updates the store with every reading
+it receives and shares it through a manager server, so that real-time
+data requests are answered without querying sMAP
+"""
+
+import time
+import threading
+from multiprocessing.managers import BaseManager
+
+from constants import *
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+
+def combine_latest_readings(readings, now=None):
+    """
+    Combines the latest readings of the meters of an apartment
+
+    Handles power outages where the data of a meter may not be the latest:
+    the power of a meter lagging behind the latest reading by more than
+    2 seconds is taken as 0 if its reading is more than 3 seconds old
+
+    :param readings: list of [<time in ms>, <power>] for each meter
+    Returns: time (in ms) of the latest reading and total power
+    """
+    if now is None:
+        now = time.time()
+
+    timestamp = max(r_time for r_time, power in readings)
+    total_power = 0
+    for r_time, power in readings:
+        if (timestamp - r_time) / 1000. > 2 and now - r_time / 1000. > 3:
+            power = 0
+        total_power += power
+    return timestamp, total_power
+
+
+class LatestPowerStore:
+
+    """
+    Latest reading of each meter, grouped by apartment
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # uuid -> apt_no
+        self.meter_apt = {}
+        # apt_no -> {uuid: [time in ms, power]}
+        self.readings = {}
+
+    def add_meter(self, apt_no, uuid):
+        with self.lock:
+            self.meter_apt[uuid] = str(apt_no)
+            self.readings.setdefault(str(apt_no), {})
+
+    def update(self, uuid, timestamp, power):
+        """
+        Stores the reading (time in ms) of the meter if it is the latest
+        """
+        with self.lock:
+            apt_no = self.meter_apt.get(uuid)
+            if apt_no is None:
+                return
+            latest = self.readings[apt_no].get(uuid)
+            if latest is None or timestamp >= latest[0]:
+                self.readings[apt_no][uuid] = [timestamp, power]
+
+    def get(self, apt_no, now=None):
+        """
+        Returns (time in ms, total power) of the apartment or None if no
+        recent reading is available
+        """
+        if now is None:
+            now = time.time()
+        with self.lock:
+            readings = self.readings.get(str(apt_no), {}).values()
+        if len(readings) == 0:
+            return None
+        timestamp, total_power = combine_latest_readings(readings, now)
+        if now - timestamp / 1000. > latest_power_max_age:
+            return None
+        return timestamp, total_power
+
+
+class StoreManager(BaseManager):
+    pass
+
+
+def serve_store(store):
+    """
+    Shares the store with the other processes through a manager server
+    running in a background thread
+    """
+    StoreManager.register('get_power_store', callable=lambda: store)
+    manager = StoreManager(address=latest_power_address, authkey=latest_power_authkey)
+    server = manager.get_server()
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    logger.debug("Latest power store shared at %s", latest_power_address)
+    return server
+
+
+# Connection to the shared store (one per process)
+store_proxy = None
+proxy_lock = threading.Lock()
+
+
+def get_latest_power(apt_no):
+    """
+    Returns (time in ms, total power) of the apartment from the shared store
+    or None if the store is not available or has no recent reading
+    """
+    global store_proxy
+
+    with proxy_lock:
+        try:
+            if store_proxy is None:
+                StoreManager.register('get_power_store')
+                manager = StoreManager(address=latest_power_address,
+                                       authkey=latest_power_authkey)
+                manager.connect()
+                store_proxy = manager.get_power_store()
+            return store_proxy.get(str(apt_no))
+        except Exception, e:
+            # Meter data client not running
+            logger.debug("Latest power store not available: %s", e)
+            store_proxy = None
+            return None
@@ -0,0 +1,280 @@
+"""
+Multi-resolution rollups of the power of the apartments
+
+The power of an apartment (sum of the latest readings of its meters) is
+summarised into buckets of 1 second, 1 minute, 15 minutes and 1 hour, each
+holding the min, max and mean power and the energy (in Wh) of the bucket.
+The rollups are updated from the meter stream (see getmeterdata): a bucket
+is written when the first reading of the next bucket arrives, and its
+summary is added to the bucket of the next resolution.
+
+Each resolution of an apartment is stored like the meter archive, as one
+file of records per (UTC) day:
+    <folder>/<apt_no>/<resolution>/<YYYYMMDD>.roll
+Buckets left open at shutdown are written too; the parts of a bucket
+written before and after a restart are merged when read
+"""
+
+import os
+import time
+
+import numpy as np
+
+from constants import *
+from archive import day_of, day_name, day_seconds
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+record_dtype = np.dtype([('time', '<i8'), ('min', '<f4'), ('max', '<f4'),
+                         ('mean', '<f4'), ('energy', '<f8'), ('count', '<i4')])
+roll_ext = '.roll'
+
+
+def rollup_path(folder, apt_no, resolution, day):
+    return os.path.join(folder, str(apt_no), str(resolution), day_name(day) + roll_ext)
+
+
+class Bucket:
+
+    """
+    Summary of the power of a bucket being filled
+    """
+
+    def __init__(self, start):
+        self.start = start
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.total = 0.
+        self.energy = 0.
+        self.count = 0
+
+    def add(self, min_power, max_power, mean_power, energy, count):
+        self.min = min(self.min, min_power)
+        self.max = max(self.max, max_power)
+        self.total += mean_power * count
+        self.energy += energy
+        self.count += count
+
+    def record(self):
+        return (self.start, self.min, self.max, self.total / self.count,
+                self.energy, self.count)
+
+
+class RollupWriter:
+
+    """
+    Maintains the rollups of the apartments from the meter readings
+    """
+
+    def __init__(self, folder, resolutions=rollup_resolutions,
+                 flush_interval=rollup_flush_interval):
+        self.folder = folder
+        self.resolutions = resolutions
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+
+        # uuid -> apt_no
+        self.meter_apt = {}
+        # apt_no -> {uuid: latest power}
+        self.latest = {}
+        # apt_no -> open bucket of each resolution
+        self.buckets = {}
+        # (apt_no, resolution) -> records waiting to be written
+        self.pending = {}
+
+    def add_meter(self, apt_no, uuid):
+        apt_no = str(apt_no)
+        self.meter_apt[uuid] = apt_no
+        self.latest.setdefault(apt_no, {})
+        self.buckets.setdefault(apt_no, [None] * len(self.resolutions))
+
+    def update(self, readings):
+        """
+        Adds the readings to the rollups of their apartments
+
+        :param readings: dict of uuid -> (times in ms, power) arrays
+        """
+        merged = []
+        for uuid, (times, power) in readings.iteritems():
+            if uuid not in self.meter_apt:
+                continue
+            merged.extend(zip((times / 1000).tolist(), [uuid] * len(times), power.tolist()))
+
+        # Readings of the meters of an apartment are combined in time order
+        merged.sort()
+        for timestamp, uuid, power in merged:
+            apt_no = self.meter_apt[uuid]
+            self.latest[apt_no][uuid] = power
+            self.add(apt_no, 0, int(timestamp), sum(self.latest[apt_no].values()))
+
+        if time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def add(self, apt_no, level, timestamp, power, summary=None):
+        """
+        Adds a sample (or the summary of a closed bucket) to the bucket of the
+        resolution at the level, closing the bucket if the sample is past it
+        """
+        resolution = self.resolutions[level]
+        start = timestamp - timestamp % resolution
+        bucket = self.buckets[apt_no][level]
+
+        if bucket is not None and start != bucket.start:
+            if start < bucket.start:
+                # Late reading of a closed bucket
+                return
+            self.close(apt_no, level)
+            bucket = None
+
+        if bucket is None:
+            bucket = Bucket(start)
+            self.buckets[apt_no][level] = bucket
+
+        if summary is None:
+            # Energy of a sample bucket is set when it is closed
+            bucket.add(power, power, power, 0., 1)
+        else:
+            bucket.add(*summary)
+
+    def close(self, apt_no, level):
+        """
+        Writes the open bucket of the resolution and adds it to the next one
+        """
+        bucket = self.buckets[apt_no][level]
+        if bucket is None:
+            return
+        self.buckets[apt_no][level] = None
+
+        if level == 0:
+            # Mean power held over the bucket
+            bucket.energy = bucket.total / bucket.count * self.resolutions[0] / 3600.
+        record = bucket.record()
+        self.pending.setdefault((apt_no, self.resolutions[level]), []).append(record)
+        if level + 1 < len(self.resolutions):
+            self.add(apt_no, level + 1, bucket.start, None, record[1:])
+
+    def flush(self):
+        """
+        Appends the closed buckets to the rollup files
+        """
+        self.last_flush = time.time()
+        for (apt_no, resolution), records in self.pending.iteritems():
+            if len(records) == 0:
+                continue
+            records = np.array(records, dtype=record_dtype)
+            days = (records['time'] - records['time'] % day_seconds)
+            for day in np.unique(days):
+                path = rollup_path(self.folder, apt_no, resolution, day)
+                try:
+                    if not os.path.exists(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    with open(path, "ab") as roll_file:
+                        records[days == day].tofile(roll_file)
+                except (IOError, OSError), e:
+                    logger.error("[RollupWriteException]:: %s", e)
+        self.pending = {}
+
+    def close_all(self):
+        """
+        Writes the open buckets of all the apartments
+        """
+        for apt_no in self.buckets:
+            for level in range(len(self.resolutions)):
+                self.close(apt_no, level)
+        self.flush()
+
+
+def merge_records(records):
+    """
+    Merges the records of the same bucket (written before and after a restart)
+    """
+    times, first, inverse = np.unique(records['time'], return_index=True,
+                                      return_inverse=True)
+    if len(times) == len(records):
+        return records
+
+    merged = records[first].copy()
+    count = np.bincount(inverse, weights=records['count'])
+    total = np.bincount(inverse, weights=records['mean'].astype('float64') * records['count'])
+    merged['energy'] = np.bincount(inverse, weights=records['energy'])
+    merged['count'] = count
+    merged['mean'] = total / count
+    merged['min'] = [records['min'][inverse == i].min() for i in range(len(times))]
+    merged['max'] = [records['max'][inverse == i].max() for i in range(len(times))]
+    return merged
+
+
+def summarise_readings(times, power, resolution, resolutions=rollup_resolutions):
+    """
+    Summarises the power readings (times in seconds) into buckets of the
+    resolution, as RollupWriter does
+
+    Returns: records of the buckets
+    """
+    if len(times) == 0:
+        return np.zeros(0, dtype=record_dtype)
+    times = np.asarray(times, dtype='float64').astype('int64')
+    power = np.asarray(power, dtype='float64')
+    order = np.argsort(times, kind='mergesort')
+    times = times[order]
+    power = power[order]
+
+    starts, first, inverse = np.unique(times - times % resolution, return_index=True,
+                                       return_inverse=True)
+    records = np.zeros(len(starts), dtype=record_dtype)
+    records['time'] = starts
+    records['min'] = np.minimum.reduceat(power, first)
+    records['max'] = np.maximum.reduceat(power, first)
+    records['count'] = np.bincount(inverse)
+    records['mean'] = np.bincount(inverse, weights=power) / records['count']
+
+    # Energy of a bucket of the finest resolution is its mean power held
+    # over the bucket
+    base = resolutions[0]
+    b_starts, b_inverse = np.unique(times - times % base, return_inverse=True)
+    b_energy = (np.bincount(b_inverse, weights=power) / np.bincount(b_inverse) *
+                base / 3600.)
+    b_bucket = np.searchsorted(starts, b_starts - b_starts % resolution)
+    records['energy'] = np.bincount(b_bucket, weights=b_energy, minlength=len(starts))
+    return records
+
+
+def read_rollup(folder, apt_no, resolution, start_time, end_time):
+    """
+    Returns the buckets of the resolution starting between start and end time
+    (in seconds, both inclusive)
+    """
+    records = []
+    day = day_of(start_time)
+    while day <= end_time:
+        path = rollup_path(folder, apt_no, resolution, day)
+        day += day_seconds
+        try:
+            n = os.path.getsize(path) // record_dtype.itemsize
+        except OSError:
+            continue
+        if n == 0:
+            continue
+        day_records = np.memmap(path, dtype=record_dtype, mode='r', shape=(n,))
+        day_records = merge_records(np.sort(day_records, order='time'))
+        start = np.searchsorted(day_records['time'], start_time, side='left')
+        end = np.searchsorted(day_records['time'], end_time, side='right')
+        records.append(day_records[start:end])
+
+    if len(records) == 0:
+        return np.zeros(0, dtype=record_dtype)
+    return np.concatenate(records)
+
+
+def choose_resolution(start_time, end_time, max_points=rollup_max_points,
+                      resolutions=rollup_resolutions):
+    """
+    Returns the finest resolution giving at most max_points buckets over the
+    time range (the coarsest one if none does)
+    """
+    for resolution in resolutions:
+        if (end_time - start_time) / float(resolution) <= max_points:
+            return resolution
+    return resolutions[-1]
@@ -14,19 +14,191 @@ and Metadata/Extra/Type='Power'"
 Refer: http://www.cs.berkeley.edu/~stevedh/smap2/archiver.html
 """
 
+import os
 import time
 import requests
 import pandas as pd
 import numpy as np
 
+from django.conf import settings
+
 from energylenserver.models.functions import retrieve_meter_info
-from energylenserver.constants import SERVER_IP
+from energylenserver.constants import SMAP_URL
+from constants import *
+from cache import MeterCache
+from latest_power import combine_latest_readings
 # Enable Logging
 import logging
 logger = logging.getLogger('energylensplus_django')
 
 # Global variables
-url = 'http://' + SERVER_IP + ':9306/api/query'
+url = SMAP_URL + '/api/query'
+
+
+def smap_apt_no(apt_no):
+    """
+    Apartment number as used in the sMAP metadata
+    """
+    if apt_no in ['102A', 102, '102']:
+        return '102A'
+    return str(apt_no)
+
+
+def db_apt_no(apt_no):
+    """
+    Apartment number as stored in MeterInfo
+    """
+    if apt_no in ['102A', 102, '102']:
+        return 102
+    return apt_no
+
+
+def apt_where_clause(apt_list):
+    """
+    Where clause selecting the power streams of the apartments
+    """
+    flats = " or ".join(["Metadata/LoadLocation/FlatNumber ='" + smap_apt_no(apt_no) + "'"
+                         for apt_no in apt_list])
+    return "(" + flats + ") and Metadata/Extra/PhysicalParameter='Power'"
+
+
+class SmapClient:
+
+    """
+    Client for the sMAP archiver query API
+
+    Queries share a pool of persistent connections, have bounded timeouts,
+    are retried with an exponential back off on connection errors and
+    server errors, and accept gzip compressed responses
+    """
+
+    def __init__(self, query_url=url, timeout=(smap_connect_timeout, smap_read_timeout),
+                 max_retries=smap_max_retries, backoff=smap_backoff, pool_size=smap_pool_size):
+
+        self.query_url = query_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+
+        self.session = None
+        self.pid = None
+
+        # apt_no -> (time fetched, meters)
+        self.meter_info = {}
+
+    def get_session(self):
+        """
+        Returns the session of the current process
+        A forked (celery) worker does not reuse the connections of its parent
+        """
+        if self.session is None or self.pid != os.getpid():
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size,
+                                                    pool_maxsize=self.pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate',
+                                    'Connection': 'keep-alive'})
+            self.session = session
+            self.pid = os.getpid()
+        return self.session
+
+    def query(self, query):
+        """
+        Posts the query to the archiver
+
+        Returns: decoded JSON response
+        """
+        attempt = 0
+        while True:
+            try:
+                r = self.get_session().post(self.query_url, data=query, timeout=self.timeout)
+                r.raise_for_status()
+                return r.json()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError), e:
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                # Client errors are not retried
+                if status is not None and status < 500:
+                    raise
+                if attempt >= self.max_retries:
+                    logger.error("[SmapQueryException] Giving up after %d retries: %s",
+                                 attempt, e)
+                    raise
+                wait = self.backoff * (2 ** attempt)
+                logger.debug("sMap: Query failed (%s), retrying in %s seconds", e, wait)
+                time.sleep(wait)
+                attempt += 1
+
+    def get_meters(self, apt_no):
+        """
+        Returns the meters of the apartment, cached for meter_info_ttl seconds
+        """
+        apt_no = db_apt_no(apt_no)
+        now = time.time()
+        if apt_no in self.meter_info:
+            fetch_time, meters = self.meter_info[apt_no]
+            if now - fetch_time < meter_info_ttl:
+                return meters
+        meters = retrieve_meter_info(apt_no)
+        if not meters:
+            return []
+        self.meter_info[apt_no] = (now, meters)
+        return meters
+
+    def get_latest_readings(self, apt_list):
+        """
+        Returns the latest reading of each power stream of the apartments
+        """
+        return self.query("select data before now where " + apt_where_clause(apt_list))
+
+    def get_data(self, apt_list, start_time, end_time):
+        """
+        Retrieves the power streams of the apartments in the specified time
+        interval in a single query
+
+        Returns: dict of apt_no -> list of (uuid, meter type, readings) streams
+        """
+        query = ("select data in ('" + str(start_time) + "','" + str(end_time) + "') "
+                 "limit 200000 where " + apt_where_clause(apt_list))
+        payload = self.query(query)
+
+        uuid_apt = {}
+        uuid_type = {}
+        for apt_no in apt_list:
+            for meter in self.get_meters(apt_no):
+                uuid_apt[meter['uuid']] = apt_no
+                uuid_type[meter['uuid']] = meter['type']
+
+        streams = dict((apt_no, []) for apt_no in apt_list)
+        for stream in payload:
+            uuid = stream['uuid']
+            if uuid not in uuid_apt:
+                logger.debug("sMap: Ignoring unknown stream %s", uuid)
+                continue
+            streams[uuid_apt[uuid]].append((uuid, uuid_type[uuid], stream['Readings']))
+        return streams
+
+    def get_meter_info(self, apt_no):
+        """
+        Get meter info from smap server
+        """
+        payload = ("select uuid, Metadata/Instrument/SupplyType "
+                   "where " + apt_where_clause([apt_no]))
+        payload_body = self.query(payload)
+
+        meters = []
+        for meter in payload_body:
+            meters.append({'uuid': meter['uuid'],
+                           'type': meter['Metadata']['Instrument']['SupplyType']})
+        return meters
+
+
+# Shared client of the process
+client = SmapClient()
+
+# Local cache of the fetched readings
+cache = MeterCache(os.path.join(settings.BASE_DIR, 'energylenserver/data/meter_cache/'), client)
 
 
 def get_meter_data(query):
@@ -37,9 +209,7 @@ def get_meter_data(query):
     """
 
     logger.debug("sMap: Getting meter data...")
-    r = requests.post(url, data=query)
-    logger.debug("%s", r)
-    payload = r.json()
+    payload = client.query(query)
     logger.debug("%s", payload)
 
     return payload
@@ -51,127 +221,67 @@ def get_latest_power_data(apt_no):
 
     Usage: For real-time data access
     """
-    if apt_no in ['102A', 102]:
-        apt_no = '102A'
-    payload = ("select data before now "
-               "where Metadata/LoadLocation/FlatNumber ='" + str(apt_no) + "' and "
-               "Metadata/Extra/PhysicalParameter='Power'")
-
-    r = requests.post(url, data=payload)
-    # logger.debug (r)
-    payload_body = r.json()
+    payload_body = client.get_latest_readings([apt_no])
     logger.debug(payload_body)
 
-    lpower = 0
+    readings = [stream['Readings'][0] for stream in payload_body if len(stream['Readings']) > 0]
+    timestamp, total_power = combine_latest_readings(readings)
+    logger.debug("Power: %f", total_power)
 
-    # For two meters
-    if len(payload_body) > 1:
-        readings = payload_body[0]['Readings']
-        time_1 = readings[0][0]
-        power = readings[0][1]
-
-        readings = payload_body[1]['Readings']
-        time_2 = readings[0][0]
-        lpower = readings[0][1]
-
-        timestamp = max(time_1, time_2)
-
-        # Handling power outages where meter data may not be the latest
-        if abs(time_1 - time_2) > 2:
-            time_low = min(time_1, time_2)
-            now_time = time.time()
-
-            if abs(now_time - time_low) > 3:
-                if time_low == time_1:
-                    power = 0
-                elif time_low == time_2:
-                    lpower = 0
-
-    # For a single meter
-    else:
-        readings = payload_body[0]['Readings']
-        timestamp = readings[0][0]
-        power = readings[0][1]
-
-    logger.debug("Power: %f", power)
-    logger.debug("LPower: %f", lpower)
+    return timestamp, total_power
 
-    total_power = power + lpower
 
-    return timestamp, total_power
+def streams_to_frames(streams):
+    """
+    Converts the (uuid, meter type, readings) streams of an apartment to dataframes
+    """
+    if len(streams) == 0 or len(streams[0][2]) == 0:
+        return []
+
+    df = []
+    for uuid, m_type, readings in streams:
+        readings = np.array(readings, dtype='float64').reshape(-1, 2)
+        df.append(pd.DataFrame({'time': readings[:, 0] / 1000, 'power': readings[:, 1],
+                                'type': [m_type] * len(readings)},
+                               columns=['time', 'power', 'type']))
+    return df
 
 
-def get_meter_data_for_time_slice(apt_no, start_time, end_time):
+def get_meter_data_for_time_slice(apt_no, start_time, end_time, use_cache=True):
     """
     Retrieves meter data in the specified time interval
+    Served from the local cache unless <use_cache> is False
     """
-    if apt_no in ['102A', 102]:
-        apt_no = '102A'
-
     logger.debug("sMap: Getting meter data for %s between %s and %s", apt_no, start_time, end_time)
 
-    query = ("select data in ('" + str(start_time) + "','" + str(end_time) + "') "
-             "limit 200000 "
-             "where Metadata/LoadLocation/FlatNumber ='" + str(apt_no) + "' and "
-             "Metadata/Extra/PhysicalParameter='Power'")
-
-    r = requests.post(url, data=query)
-    # logger.debug ("%s",r)
-    payload = r.json()
-    # logger.debug("Payload:%s", payload)
-
-    if apt_no in ['102A', 102]:
-        apt_no = 102
-    meters = retrieve_meter_info(apt_no)
-    logger.debug("Meters: %s", meters)
-
-    streams = []
-    meter_type = []
-    l_meters = range(0, len(meters))
-    for i in l_meters:
-        uuid = payload[i]['uuid']
-
-        # Get meter type based on uuid
-        for meter in meters:
-            if meter['uuid'] == uuid:
-                m_type = meter['type']
-                # logger.debug (uuid, m_type)
-
-        meter_type.append(m_type)
-        streams.append(np.array(payload[i]['Readings']))
-    # logger.debug("Streams: %s", streams)
-
-    if len(streams[0]) > 0:
-
-        df = [pd.DataFrame({'time': readings[:, 0] / 1000, 'power': readings[:, 1],
-                            'type': [meter_type[i]] * len(readings)},
-                           columns=['time', 'power', 'type']) for i, readings in enumerate(streams)]
-    else:
-        df = []
+    if use_cache:
+        try:
+            return cache.get(apt_no, start_time, end_time)
+        except (IOError, OSError, ValueError), e:
+            # Cache files changed by another process
+            logger.error("[MeterCacheException] %s", e)
 
-    return df
+    streams = client.get_data([apt_no], start_time, end_time)
+    return streams_to_frames(streams[apt_no])
 
 
-def get_meter_info(apt_no):
-    """
-    Get meter info from smap server
+def get_meter_data_for_time_slices(apt_list, start_time, end_time):
     """
-    if apt_no in ['102A', 102]:
-        apt_no = '102A'
-    payload = ("select uuid, Metadata/Instrument/SupplyType "
-               "where Metadata/LoadLocation/FlatNumber ='" + str(apt_no) + "' and "
-               "Metadata/Extra/PhysicalParameter='Power'")
+    Retrieves meter data of multiple apartments in the specified time interval
+    with one query
 
-    r = requests.post(url, data=payload)
-    # logger.debug ("%s",r)
-    payload_body = r.json()
-    # logger.debug ("Payload:\n%s", payload_body)
+    Returns: dict of apt_no -> list of dataframes (as get_meter_data_for_time_slice)
+    """
+    logger.debug("sMap: Getting meter data for %s between %s and %s",
+                 apt_list, start_time, end_time)
 
-    meters = []
-    for i in range(0, len(payload_body)):
-        meter = payload_body[i]
+    streams = client.get_data(apt_list, start_time, end_time)
+    return dict((apt_no, streams_to_frames(apt_streams))
+                for apt_no, apt_streams in streams.iteritems())
 
-        meters.append({'uuid': meter['uuid'], 'type': meter[
-                       'Metadata']['Instrument']['SupplyType']})
 
-    return meters
+def get_meter_info(apt_no):
+    """
+    Get meter info from smap server
+    """
+    return client.get_meter_info(apt_no)
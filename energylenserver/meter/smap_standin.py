@@ -0,0 +1,226 @@
+"""
+Local stand-in for the sMAP archiver
+
+Serves the /api/query and /republish endpoints used by the EnergyLens+ server
+with synthetic meter data (see synthetic.py), so that the meter data path can
+be run and load tested offline
+
+Supported queries:
+    select uuid, Metadata/Instrument/SupplyType where <apartments>
+    select data before now where <apartments>
+    select data in ('<start>','<end>') [limit <n>] where <apartments>
+"""
+
+import re
+import json
+import time
+import zlib
+import datetime as dt
+import threading
+import SocketServer
+import BaseHTTPServer
+
+import numpy as np
+
+import synthetic
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+# Time formats accepted by the archiver
+time_formats = ["%Y-%m-%dT%H:%M:%S", "%m/%d/%Y %H:%M", "%m/%d/%Y"]
+
+flat_pattern = re.compile(r"FlatNumber\s*=\s*'([^']*)'")
+range_pattern = re.compile(r"select\s+data\s+in\s*\(\s*'([^']*)'\s*,\s*'([^']*)'\s*\)"
+                           r"(?:\s+limit\s+(\d+))?", re.IGNORECASE)
+
+
+def parse_time(time_str):
+    for time_format in time_formats:
+        try:
+            return time.mktime(dt.datetime.strptime(time_str, time_format).timetuple())
+        except ValueError:
+            continue
+    raise ValueError("Invalid time: %s" % time_str)
+
+
+class MeterStore:
+
+    """
+    Synthetic power data of the meters, generated one hour at a time
+    The data of an hour is the same on every request
+    """
+
+    def __init__(self, meters, cache_size=64):
+        # meters: list of dicts with apt_no (as in sMAP), uuid and type
+        self.meters = meters
+        self.cache_size = cache_size
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def meters_for(self, apt_list):
+        return [meter for meter in self.meters if meter['apt_no'] in apt_list]
+
+    def hour_data(self, meter, hour_start):
+        key = (meter['uuid'], hour_start)
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+
+        seed = (zlib.crc32(meter['uuid']) + hour_start) & 0x7fffffff
+        trace_df, truth_df = synthetic.generate_trace(hour_start, 3600, seed=seed,
+                                                      fridge=(meter['type'] == 'Power'))
+        data = (trace_df['time'].values, trace_df['power'].values)
+
+        with self.lock:
+            if len(self.cache) >= self.cache_size:
+                self.cache.pop(min(self.cache, key=lambda k: k[1]))
+            self.cache[key] = data
+        return data
+
+    def readings(self, meter, start_time, end_time, limit=None):
+        """
+        Returns the readings [<time in ms>, <power>] in [start_time, end_time]
+        """
+        times = []
+        powers = []
+        hour_start = int(start_time) // 3600 * 3600
+        while hour_start <= end_time:
+            h_time, h_power = self.hour_data(meter, hour_start)
+            mask = (h_time >= start_time) & (h_time <= end_time)
+            times.append(h_time[mask])
+            powers.append(h_power[mask])
+            hour_start += 3600
+        times = np.concatenate(times)
+        powers = np.round(np.concatenate(powers), 2)
+        if limit is not None:
+            times, powers = times[:limit], powers[:limit]
+        return [[int(t) * 1000, p] for t, p in zip(times.tolist(), powers.tolist())]
+
+    def latest_reading(self, meter, now):
+        readings = self.readings(meter, now - 60, now)
+        return readings[-1:]
+
+
+class StandinHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    """
+    Handles the archiver requests of a client
+    """
+
+    def log_message(self, format, *args):
+        logger.debug("sMAP stand-in: " + format, *args)
+
+    def read_body(self):
+        length = int(self.headers.getheader('content-length') or 0)
+        return self.rfile.read(length)
+
+    def send_json(self, body, code=200):
+        data = json.dumps(body)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.server.stats['requests'] += 1
+        try:
+            if self.path.startswith('/api/query'):
+                self.send_json(self.handle_query(self.read_body()))
+            elif self.path.startswith('/republish'):
+                self.handle_republish(self.read_body())
+            else:
+                self.send_json({'error': 'Not found'}, 404)
+        except ValueError, e:
+            self.send_json({'error': str(e)}, 400)
+        except Exception, e:
+            logger.exception("[SmapStandinException] %s", e)
+            self.send_json({'error': str(e)}, 500)
+
+    def handle_query(self, query):
+        store = self.server.store
+        meters = store.meters_for(flat_pattern.findall(query))
+
+        if query.lower().startswith('select uuid'):
+            return [{'uuid': meter['uuid'],
+                     'Metadata': {'Instrument': {'SupplyType': meter['type']}}}
+                    for meter in meters]
+
+        if query.lower().startswith('select data before now'):
+            now = time.time()
+            return [{'uuid': meter['uuid'], 'Readings': store.latest_reading(meter, now)}
+                    for meter in meters]
+
+        match = range_pattern.match(query)
+        if match is None:
+            raise ValueError("Unsupported query: %s" % query)
+        start_time, end_time = parse_time(match.group(1)), parse_time(match.group(2))
+        limit = int(match.group(3)) if match.group(3) else None
+        return [{'uuid': meter['uuid'],
+                 'Readings': store.readings(meter, start_time, end_time, limit)}
+                for meter in meters]
+
+    def handle_republish(self, query):
+        """
+        Streams one document per meter every second until the client disconnects
+        """
+        store = self.server.store
+        meters = store.meters_for(flat_pattern.findall(query))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+
+        try:
+            last_time = int(time.time()) - 1
+            while not self.server.stopped.is_set():
+                now = int(time.time())
+                for timestamp in range(last_time + 1, now + 1):
+                    for meter in meters:
+                        readings = store.readings(meter, timestamp, timestamp)
+                        if len(readings) == 0:
+                            continue
+                        doc = {meter['path']: {'uuid': meter['uuid'], 'Readings': readings}}
+                        self.wfile.write(json.dumps(doc) + "\n")
+                        self.server.stats['published'] += 1
+                self.wfile.flush()
+                last_time = now
+                time.sleep(self.server.publish_interval)
+        except IOError:
+            logger.debug("sMAP stand-in: Republish client disconnected")
+
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, meters, publish_interval=1.):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandinHandler)
+        for meter in meters:
+            meter.setdefault('path', "/%s/%s" % (meter['apt_no'], meter['type'].lower()))
+        self.store = MeterStore(meters)
+        self.publish_interval = publish_interval
+        self.stopped = threading.Event()
+        self.stats = {'requests': 0, 'published': 0}
+
+    def stop(self):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+
+def start_server(meters, host='127.0.0.1', port=9306):
+    """
+    Starts the stand-in archiver in a background thread
+
+    Returns: server (call stop() to shut it down)
+    """
+    server = StandinServer((host, port), meters)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    logger.debug("sMAP stand-in listening on %s:%d", host, server.server_address[1])
+    return server
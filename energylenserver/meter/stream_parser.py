@@ -0,0 +1,156 @@
+"""
+Incremental parser for the sMAP republish stream
+
+The stream is a sequence of compact JSON documents
+    {<path>: {"uuid": <uuid>, "Readings": [[<time in ms>, <power>], ...]}, ...}
+separated by whitespace (usually a newline). A chunk received from the
+connection may end in the middle of a document or hold several documents;
+the incomplete tail is kept until the rest of it arrives.
+
+The readings are decoded into preallocated arrays per meter, taken out
+by the consumer after each chunk
+"""
+
+import re
+import json
+import time
+
+import numpy as np
+
+from constants import *
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_meterdata')
+
+whitespace = re.compile(r'[ \t\n\r]*')
+
+
+class StreamParser:
+
+    """
+    Splits the stream into documents and collects the readings of each meter
+    """
+
+    def __init__(self, capacity=stream_parser_capacity, max_buffer=stream_max_buffer):
+        self.capacity = capacity
+        self.max_buffer = max_buffer
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+
+        # uuid -> readings received since the last take()
+        self.times = {}
+        self.power = {}
+        self.count = {}
+
+        self.start_time = time.time()
+        self.counters = {'bytes': 0, 'chunks': 0, 'documents': 0, 'readings': 0,
+                         'partial': 0, 'dropped_documents': 0, 'dropped_readings': 0,
+                         'dropped_bytes': 0}
+
+    def add_meter(self, uuid):
+        self.times[uuid] = np.empty(self.capacity, dtype='float64')
+        self.power[uuid] = np.empty(self.capacity, dtype='float64')
+        self.count[uuid] = 0
+
+    def append(self, uuid, timestamp, power):
+        if uuid not in self.count:
+            self.add_meter(uuid)
+        n = self.count[uuid]
+        if n == len(self.times[uuid]):
+            # Grow the arrays of the meter
+            self.times[uuid] = np.resize(self.times[uuid], 2 * n)
+            self.power[uuid] = np.resize(self.power[uuid], 2 * n)
+        self.times[uuid][n] = timestamp
+        self.power[uuid][n] = power
+        self.count[uuid] = n + 1
+
+    def feed(self, data):
+        """
+        Parses the complete documents in the data received so far
+
+        Returns: number of documents parsed
+        """
+        self.counters['bytes'] += len(data)
+        self.counters['chunks'] += 1
+        buf = self.buffer + data
+        pos = whitespace.match(buf).end()
+        n_docs = 0
+
+        while pos < len(buf):
+            try:
+                doc, end = self.decoder.raw_decode(buf, pos)
+            except ValueError:
+                newline = buf.find('\n', pos)
+                if newline == -1:
+                    # Incomplete document
+                    self.counters['partial'] += 1
+                    break
+                # Malformed document
+                logger.debug("Invalid JSON string passed. Ignoring data: %s", buf[pos:newline])
+                self.drop_document(newline - pos)
+                pos = whitespace.match(buf, newline).end()
+                continue
+
+            self.add_document(doc)
+            n_docs += 1
+            pos = whitespace.match(buf, end).end()
+
+        self.buffer = buf[pos:]
+        if len(self.buffer) > self.max_buffer:
+            logger.debug("Stream buffer overflow. Ignoring %d bytes", len(self.buffer))
+            self.drop_document(len(self.buffer))
+            self.buffer = ''
+        return n_docs
+
+    def drop_document(self, size):
+        self.counters['dropped_documents'] += 1
+        self.counters['dropped_bytes'] += size
+
+    def add_document(self, doc):
+        self.counters['documents'] += 1
+        if not isinstance(doc, dict):
+            self.counters['dropped_documents'] += 1
+            return
+
+        for record in doc.itervalues():
+            try:
+                uuid = record['uuid']
+                readings = record.get('Readings', [])
+            except (TypeError, KeyError, AttributeError):
+                self.counters['dropped_documents'] += 1
+                continue
+
+            for reading in readings:
+                try:
+                    timestamp, power = float(reading[0]), float(reading[1])
+                except (TypeError, ValueError, IndexError):
+                    self.counters['dropped_readings'] += 1
+                    continue
+                self.append(uuid, timestamp, power)
+                self.counters['readings'] += 1
+
+    def take(self):
+        """
+        Returns the readings received since the last call
+
+        Returns: dict of uuid -> (times in ms, power) arrays
+        """
+        readings = {}
+        for uuid, n in self.count.iteritems():
+            if n == 0:
+                continue
+            readings[uuid] = (self.times[uuid][:n].copy(), self.power[uuid][:n].copy())
+            self.count[uuid] = 0
+        return readings
+
+    def stats(self):
+        """
+        Returns the counters with the throughput since the parser started
+        """
+        stats = dict(self.counters)
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        stats['readings_per_sec'] = stats['readings'] / elapsed
+        stats['bytes_per_sec'] = stats['bytes'] / elapsed
+        stats['buffered_bytes'] = len(self.buffer)
+        return stats
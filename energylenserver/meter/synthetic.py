@@ -0,0 +1,153 @@
+"""
+Synthetic meter traces with known edges
+
+Generates 1 Hz power traces made of a base load, appliance ON/OFF steps,
+fridge cycles, spikes, noise and missing samples, along with the list of
+the edges injected in the trace (ground truth)
+"""
+
+import numpy as np
+import pandas as pd
+
+from constants import *
+
+# Trace parameters
+trace_params = {
+    'base_load': 80,
+    'noise_std': 2.,
+    'missing_rate': 0.005,
+    # Appliance ON/OFF events per hour and their power and duration (seconds)
+    'appliance_rate': 6,
+    'appliance_power': [40, 60, 100, 250, 500, 1000, 1500, 2000],
+    'appliance_duration': (60, 1800),
+    # Fridge compressor power and ON/OFF durations (seconds)
+    'fridge_power': (110, 150),
+    'fridge_on': (600, 1200),
+    'fridge_off': (1200, 2400),
+    # Spikes (lasting one sample) per hour
+    'spike_rate': 10,
+    'spike_power': (100, 1000),
+}
+
+# Minimum gap between two edges of a trace, so that their windows do not overlap
+min_edge_gap = 2 * winmax + winmin
+
+
+def truth_frame(edges):
+    return pd.DataFrame(edges, columns=['time', 'magnitude', 'type', 'source'])
+
+
+def generate_trace(start_time, duration, seed=None, fridge=True, **params):
+    """
+    Generates a power trace of <duration> seconds starting at <start_time>
+
+    Returns: trace (time, power) and ground truth edges (time, magnitude, type, source)
+    The time of an edge is the time of the last sample before the step
+    """
+    p = dict(trace_params)
+    p.update(params)
+    rng = np.random.RandomState(seed)
+
+    power = np.zeros(duration) + p['base_load']
+    taken = np.zeros(duration, dtype=bool)
+    edges = []
+
+    def is_free(pos):
+        # Checks if an edge at <pos> is far enough from the other edges
+        low, high = max(pos - min_edge_gap, 0), min(pos + min_edge_gap, duration)
+        return (min_edge_gap <= pos < duration - min_edge_gap and
+                not taken[low:high].any())
+
+    def reserve(start, end):
+        # Reserves the ON and OFF edges of an event
+        if end - start < min_edge_gap or not is_free(start) or not is_free(end):
+            return False
+        taken[start] = taken[end] = True
+        return True
+
+    def add_step(pos, magnitude, source):
+        power[pos:] += magnitude
+        edge_type = "rising" if magnitude > 0 else "falling"
+        edges.append((start_time + pos - 1, magnitude, edge_type, source))
+
+    # Fridge cycles
+    if fridge:
+        fridge_power = rng.randint(*p['fridge_power'])
+        pos = rng.randint(0, p['fridge_off'][1])
+        while pos < duration:
+            on_time = rng.randint(*p['fridge_on'])
+            if reserve(pos, pos + on_time):
+                add_step(pos, fridge_power, 'fridge')
+                add_step(pos + on_time, -fridge_power, 'fridge')
+            pos += on_time + rng.randint(*p['fridge_off'])
+
+    # Appliance usage
+    n_events = rng.poisson(p['appliance_rate'] * duration / 3600.)
+    for i in range(n_events):
+        pos = rng.randint(0, duration)
+        end = pos + rng.randint(*p['appliance_duration'])
+        if not reserve(pos, end):
+            continue
+        magnitude = rng.choice(p['appliance_power'])
+        add_step(pos, magnitude, 'appliance')
+        add_step(end, -magnitude, 'appliance')
+
+    # Spikes are not edges
+    n_spikes = rng.poisson(p['spike_rate'] * duration / 3600.)
+    for pos in rng.randint(0, duration, n_spikes):
+        power[pos] += rng.randint(*p['spike_power'])
+
+    power += rng.randn(duration) * p['noise_std']
+    time = start_time + np.arange(duration, dtype='float64')
+
+    # Missing samples, except the ones defining an edge
+    missing = rng.rand(duration) < p['missing_rate']
+    for edge_time in [e[0] for e in edges]:
+        pos = int(edge_time - start_time)
+        missing[max(pos - 1, 0):pos + 3] = False
+    keep = ~missing
+
+    trace_df = pd.DataFrame({'time': time[keep], 'power': power[keep]},
+                            columns=['time', 'power'])
+    truth_df = truth_frame(sorted(edges))
+    return trace_df, truth_df
+
+
+def generate_meters(n_meters, start_time, duration, seed=0, **params):
+    """
+    Generates traces for multiple meters, the first one with a fridge
+
+    Returns: list of (uuid, trace, ground truth edges)
+    """
+    meters = []
+    for i in range(n_meters):
+        uuid = "synthetic-%d" % i
+        trace_df, truth_df = generate_trace(start_time, duration, seed=seed + i,
+                                            fridge=(i == 0), **params)
+        meters.append((uuid, trace_df, truth_df))
+    return meters
+
+
+def match_edges(edges_df, truth_df, tolerance=3):
+    """
+    Matches detected edges with the ground truth edges of the same type
+    within <tolerance> seconds. Each edge is matched at most once
+
+    Returns: no. of matched edges, precision and recall
+    """
+    matched = 0
+    for edge_type in ["rising", "falling"]:
+        detected = np.sort(edges_df[edges_df.type == edge_type]['time'].values)
+        used = np.zeros(len(detected), dtype=bool)
+        for edge_time in truth_df[truth_df.type == edge_type]['time'].values:
+            start = np.searchsorted(detected, edge_time - tolerance, side='left')
+            end = np.searchsorted(detected, edge_time + tolerance, side='right')
+            candidates = [i for i in range(start, end) if not used[i]]
+            if len(candidates) > 0:
+                best = min(candidates, key=lambda i: abs(detected[i] - edge_time))
+                used[best] = True
+                matched += 1
+
+    precision = float(matched) / len(edges_df) if len(edges_df) > 0 else 0.
+    recall = float(matched) / len(truth_df) if len(truth_df) > 0 else 0.
+    return matched, precision, recall
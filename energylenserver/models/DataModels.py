@@ -119,13 +119,18 @@ class WiFiTestData(WiFiData):
 
 
 class RawAudioData(SensorData):
-    value = models.TextField()
+    # Samples as comma separated values (encoding 0, records stored before
+    # the binary samples) or as int16 (see preprocessing/audio.py)
+    value = models.TextField(blank=True)
+    samples = models.BinaryField(null=True)
+    encoding = models.SmallIntegerField(default=0)
     label = models.CharField(max_length=200)
     location = models.CharField(max_length=200)
 
     def insert_records(self, user, filename, model):
         """
         Inserts csv into the database directly
+        The samples are encoded on upload and written in hex
         """
         try:
             cursor = connection.cursor()
@@ -133,8 +138,10 @@ class RawAudioData(SensorData):
             records_inserted = cursor.execute("LOAD DATA LOCAL INFILE %s INTO TABLE " + model +
                                               " FIELDS TERMINATED BY ','"
                                               " OPTIONALLY ENCLOSED BY '`' IGNORE 1 LINES"
-                                              " (@timestamp, value, label, location) "
+                                              " (@timestamp, encoding, @samples, value,"
+                                              " label, location) "
                                               "SET timestamp = @timestamp/1000.0, "
+                                              "samples = UNHEX(NULLIF(@samples, '')), "
                                               "dev_id_id = " + str(user.dev_id), [filename])
             # logger.debug("Number of records inserted: %d", records_inserted)
             os.remove(filename)
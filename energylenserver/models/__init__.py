@@ -31,3 +31,6 @@ from models import EventLog
 from models import EnergyWastageNotif
 from models import UsageLogScreens
 from models import UsageLogNotifs
+
+# Invalidates the apartment configuration snapshots when the models change
+import snapshot
@@ -2,9 +2,13 @@ import time
 import json
 import datetime as dt
 
+from django.db import transaction, IntegrityError
+
 from models import *
 from DataModels import *
+from snapshot import bump_version
 from energylenserver.constants import DISAGG_ENERGY_API
+from energylenserver.constants import upload_dedup_ttl, upload_claim_timeout
 
 # Enable Logging
 import logging
@@ -302,6 +306,68 @@ def get_labeled_data(sensor_name, start_time, end_time, label, dev_id_list):
 
     return data
 
+"""
+Upload Registry Model methods
+"""
+
+
+def claim_upload(filename):
+    """
+    Claims the processing of an uploaded file
+    Only one worker gets the claim of a file; the file is not processed
+    again once done, until it expires (upload_dedup_ttl)
+
+    Returns: True if the caller should process the file
+    """
+    now = time.time()
+    try:
+        with transaction.atomic():
+            UploadedFile(filename=filename, status='claimed', updated_at=now).save()
+        return True
+    except IntegrityError:
+        pass
+
+    # Take over a stale claim of a worker that did not finish the file
+    # or a processed entry that has expired
+    stale = UploadedFile.objects.filter(filename=filename, status='claimed',
+                                        updated_at__lt=now - upload_claim_timeout)
+    if stale.update(updated_at=now) == 1:
+        return True
+    expired = UploadedFile.objects.filter(filename=filename, status='done',
+                                          updated_at__lt=now - upload_dedup_ttl)
+    return expired.update(status='claimed', updated_at=now) == 1
+
+
+def finish_upload(filename):
+    """
+    Marks the uploaded file as processed
+    """
+    UploadedFile.objects.filter(filename=filename).update(status='done', updated_at=time.time())
+
+
+def release_upload(filename):
+    """
+    Releases the claim on an uploaded file that could not be processed,
+    so that it can be uploaded again
+    """
+    try:
+        UploadedFile.objects.filter(filename=filename, status='claimed').delete()
+    except Exception, e:
+        logger.error("[ReleaseUploadException]:: %s", e)
+
+
+def purge_uploads():
+    """
+    Deletes the expired entries of the upload registry
+
+    Returns: number of entries deleted
+    """
+    expired = UploadedFile.objects.filter(status='done',
+                                          updated_at__lt=time.time() - upload_dedup_ttl)
+    n_expired = expired.count()
+    expired.delete()
+    return n_expired
+
 """
 Metadata Management Model methods
 """
@@ -358,6 +424,59 @@ def retrieve_metadata_for_appliance(apt_no, appliance):
 
     return records
 
+def store_training_metadata(apt_no, location, appliance, presence_based, audio_based, power):
+    """
+    Stores the computed power of the appliance in Metadata
+    Updates the entry if one exists for the appliance-location combination
+    """
+    app_arr = appliance.split('-')
+    if len(app_arr) > 1:
+        appliance = app_arr[0]
+        how_many = int(app_arr[1])
+    else:
+        how_many = 1
+
+    # See if entry exists for appliance-location combination
+    # Update power value if it exists
+    records = Metadata.objects.filter(apt_no__exact=apt_no,
+                                      location__exact=location,
+                                      appliance__exact=appliance,
+                                      presence_based=presence_based,
+                                      audio_based=audio_based)
+    if records.count() == 1:
+        if how_many > records[0].how_many:
+            records.update(how_many=how_many)
+        else:
+            records.update(power=power)
+        # QuerySet updates don't send post_save
+        bump_version(apt_no)
+        logger.debug("Metadata with entry:%d %s %s exists", apt_no, appliance, location)
+        logger.debug("Metadata record updated")
+    else:
+        # Store metadata
+        metadata = Metadata(apt_no=apt_no,
+                            presence_based=presence_based, audio_based=audio_based,
+                            appliance=appliance, location=location, power=power,
+                            how_many=how_many)
+        metadata.save()
+        logger.debug("Metadata creation successful!")
+
+
+def get_training_job(dev_id, job_id):
+    """
+    Retrieve the training job of the user
+    """
+    try:
+        job = TrainingJob.objects.get(id=job_id, dev_id=dev_id)
+    except TrainingJob.DoesNotExist:
+        logger.error("[TrainingJobDoesNotExistException]:: %s %s", dev_id, job_id)
+        return False
+    except Exception, e:
+        logger.error("[GetTrainingJobException]:: %s", e)
+        return False
+
+    return job
+
 """
 Inference Management Model methods
 """
@@ -95,6 +95,57 @@ class MeterInfo(models.Model):
         app_label = app_label_str
 
 
+class ConfigVersion(models.Model):
+
+    """
+    Version of the configuration (metadata, access points, meters and
+    occupants) of each apartment, incremented on every change
+    """
+    apt_no = models.IntegerField(unique=True)
+    version = models.IntegerField(default=1)
+
+    class Meta:
+        db_table = 'configversion'
+        app_label = app_label_str
+
+
+class UploadedFile(models.Model):
+
+    """
+    Registry of the phone data files being processed or processed,
+    to prevent data duplication
+    """
+    filename = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=10, default='claimed')  # claimed/done
+    updated_at = models.DecimalField(unique=False, max_digits=14, decimal_places=3)
+
+    class Meta:
+        db_table = 'uploadedfile'
+        app_label = app_label_str
+
+
+class TrainingJob(models.Model):
+
+    """
+    Stores the training data labels whose power is computed asynchronously
+    """
+    dev_id = models.ForeignKey(RegisteredUsers)
+    apt_no = models.IntegerField()
+    start_time = models.BigIntegerField()  # in ms, as sent by the phone
+    end_time = models.BigIntegerField()
+    location = models.CharField(max_length=50)
+    appliance = models.CharField(max_length=50)
+    presence_based = models.BooleanField(default=True)
+    audio_based = models.BooleanField(default=True)
+    status = models.CharField(max_length=10, default='queued')  # queued/waiting/done/failed
+    power = models.FloatField(null=True)
+    created_at = models.DecimalField(unique=False, max_digits=14, decimal_places=3)
+
+    class Meta:
+        db_table = 'trainingjob'
+        app_label = app_label_str
+
+
 class Edges(models.Model):
 
     """
@@ -0,0 +1,167 @@
+"""
+Snapshots of the configuration of the apartments
+
+The metadata, access points, meters and occupants of an apartment change
+rarely but are read several times for every edge. A process builds a
+snapshot of them once and reuses it until the version of the apartment
+configuration changes. The version (ConfigVersion) is incremented by the
+post_save/post_delete signals of the models, so changes made in any
+process are seen by the others within config_check_interval seconds
+"""
+
+import time
+
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django_pandas.io import read_frame
+
+from models import *
+from energylenserver.constants import config_check_interval
+from energylenserver.core.metadata_index import MetadataIndex
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_django')
+
+
+class ApartmentSnapshot:
+
+    """
+    Configuration of an apartment at a version
+    Accessors return copies, so that the snapshot is not modified by the callers
+    """
+
+    def __init__(self, apt_no, version):
+        self.apt_no = apt_no
+        self.version = version
+
+        # Metadata with and without the appliance state suffix (e.g. AC_1 -> AC)
+        self._metadata = read_frame(Metadata.objects.filter(apt_no=apt_no), verbose=False)
+        self._appl_metadata = self._metadata.copy()
+        if len(self._metadata) > 0:
+            self._appl_metadata['appliance'] = self._metadata.appliance.str.split('_').str[0]
+        # Power interval index of the metadata, built on first use
+        self._metadata_index = None
+
+        self._access_points = read_frame(AccessPoints.objects.filter(apt_no=apt_no),
+                                         verbose=False)
+        home_ap = [ap.macid for ap in AccessPoints.objects.filter(apt_no=apt_no, home_ap=True)]
+        self.home_ap = home_ap[0] if len(home_ap) == 1 else False
+
+        self._meters = [{'uuid': meter.meter_uuid, 'type': meter.meter_type}
+                        for meter in MeterInfo.objects.filter(apt_no=apt_no)]
+
+        users = RegisteredUsers.objects.filter(apt_no=apt_no, is_active=True)
+        self._occupants = read_frame(users, verbose=False)
+        self._users = dict((user.dev_id, user) for user in users)
+
+    def metadata(self, strip_state=False):
+        """
+        Returns the metadata of the apartment as a dataframe, as
+        read_frame(retrieve_metadata(apt_no))
+        """
+        if strip_state:
+            return self._appl_metadata.copy()
+        return self._metadata.copy()
+
+    def metadata_index(self):
+        """
+        Returns the power interval index of the metadata (see core/metadata_index.py)
+        """
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex(self._metadata)
+        return self._metadata_index
+
+    def access_points(self):
+        return self._access_points.copy()
+
+    def meters(self):
+        """
+        Returns the meters of the apartment, as retrieve_meter_info(apt_no)
+        """
+        return [dict(meter) for meter in self._meters]
+
+    def occupants(self):
+        """
+        Returns the active users of the apartment as a dataframe
+        """
+        return self._occupants.copy()
+
+    def dev_ids(self):
+        return self._occupants.dev_id.tolist()
+
+    def user(self, dev_id):
+        """
+        Returns the user with the dev_id, as get_user(dev_id)
+        """
+        user = self._users.get(long(dev_id))
+        if user is not None:
+            return user
+        # Not an active occupant of the apartment
+        try:
+            return RegisteredUsers.objects.get(dev_id=dev_id)
+        except RegisteredUsers.DoesNotExist, e:
+            logger.error("[UserDoesNotExistException Occurred] No registration found! :: %s",
+                         str(e))
+            return False
+
+
+# Snapshots built by the process and when their version was last checked
+snapshots = {}
+last_checked = {}
+
+
+def config_version(apt_no):
+    try:
+        return ConfigVersion.objects.get(apt_no=apt_no).version
+    except ConfigVersion.DoesNotExist:
+        return 0
+
+
+def get_snapshot(apt_no):
+    """
+    Returns the configuration snapshot of the apartment
+    If the configuration can't be read, the previous snapshot is returned
+    (the error is raised if there is none)
+    """
+    key = str(apt_no)
+    snapshot = snapshots.get(key)
+    now = time.time()
+    if snapshot is not None and now - last_checked[key] < config_check_interval:
+        return snapshot
+
+    try:
+        version = config_version(apt_no)
+        if snapshot is None or snapshot.version != version:
+            snapshot = ApartmentSnapshot(apt_no, version)
+            snapshots[key] = snapshot
+        last_checked[key] = now
+    except Exception, e:
+        if snapshot is None:
+            raise
+        logger.error("[ApartmentSnapshotException] Using the previous snapshot:: %s", e)
+
+    return snapshot
+
+
+def bump_version(apt_no):
+    """
+    Marks a change in the configuration of the apartment
+    """
+    updated = ConfigVersion.objects.filter(apt_no=apt_no).update(version=F('version') + 1)
+    if updated == 0:
+        ConfigVersion.objects.get_or_create(apt_no=apt_no)
+    # Rebuilt on the next access in this process
+    snapshots.pop(str(apt_no), None)
+
+
+@receiver([post_save, post_delete], sender=Metadata)
+@receiver([post_save, post_delete], sender=AccessPoints)
+@receiver([post_save, post_delete], sender=MeterInfo)
+@receiver([post_save, post_delete], sender=RegisteredUsers)
+def config_changed(sender, instance, **kwargs):
+    try:
+        bump_version(instance.apt_no)
+    except Exception, e:
+        logger.exception("[ConfigVersionException]:: %s", e)
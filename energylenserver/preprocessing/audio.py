@@ -7,12 +7,112 @@ Author: Manaswi Saha
 import logging
 logger = logging.getLogger('energylensplus_django')
 
+import zlib
+
+import numpy as np
 import pandas as pd
 
+from energylenserver.constants import rawaudio_compress
+
+# Encodings of the raw audio samples of a record (RawAudioData.encoding)
+text_encoding = 0  # comma separated values in RawAudioData.value
+int16_encoding = 1  # little-endian int16 in RawAudioData.samples
+zlib_encoding = 2  # zlib compressed little-endian int16 in RawAudioData.samples
+
+sample_dtype = np.dtype('<i2')
+
+
+def encode_samples(values, compress=rawaudio_compress):
+    """
+    Encodes the samples of a record (comma separated values or array)
+
+    Returns: encoding and encoded samples; the samples are kept as text
+    if they don't fit in int16
+    """
+    if isinstance(values, basestring):
+        values = np.array(values.split(','), dtype='int64')
+    else:
+        values = np.asarray(values, dtype='int64')
+
+    if len(values) > 0 and (values.min() < -32768 or values.max() > 32767):
+        return text_encoding, ','.join(map(str, values.tolist()))
+
+    samples = values.astype(sample_dtype).tostring()
+    if compress:
+        return zlib_encoding, zlib.compress(samples)
+    return int16_encoding, samples
+
+
+def decode_samples(encoding, samples, value=None):
+    """
+    Decodes the samples of a record
+
+    Returns: int16 (int64 for text) array of the samples
+    """
+    if encoding == int16_encoding:
+        return np.frombuffer(samples, dtype=sample_dtype)
+    if encoding == zlib_encoding:
+        return np.frombuffer(zlib.decompress(samples), dtype=sample_dtype)
+    return np.array(value.split(','), dtype='int64')
+
+
+def record_samples(record):
+    """
+    Returns the samples of a raw audio record (a row of read_frame(RawAudioData))
+    """
+    if 'encoding' not in record:
+        return decode_samples(text_encoding, None, record['value'])
+    return decode_samples(int(record['encoding']), record['samples'], record['value'])
+
 
 def format_data_for_classification(df):
     """
     Formats raw audio data: Separate out individual records
+
+    Array version of format_data_for_classification_iterative. The samples
+    of a record are spread evenly up to the timestamp of the next record
+    (the last record uses the spacing of the one before); the timestamps are
+    accumulated sample by sample, as in the iterative version
+    """
+
+    columns = ['time', 'value', 'label', 'location']
+
+    if 'encoding' in df.columns:
+        samples = [decode_samples(int(encoding), s, value) for encoding, s, value in
+                   zip(df['encoding'], df['samples'], df['value'])]
+    else:
+        samples = [decode_samples(text_encoding, None, value) for value in df['value']]
+    lengths = np.array([len(values) for values in samples], dtype='int64')
+    if len(samples) == 0 or lengths.sum() == 0:
+        return pd.DataFrame(columns=columns)
+
+    timestamps = df['timestamp'].astype('float64').values
+
+    # Time between the samples of each record
+    fracs = np.zeros(len(timestamps))
+    fracs[:-1] = (timestamps[1:] - timestamps[:-1]) / lengths[:-1]
+    if len(fracs) > 1:
+        fracs[-1] = fracs[-2]
+
+    # Timestamp of the first sample of the record followed by the spacings
+    time_arr = np.repeat(fracs, lengths)
+    starts = np.cumsum(lengths) - lengths
+    time_arr[starts[lengths > 0]] = timestamps[lengths > 0]
+    for start, end in zip(starts, starts + lengths):
+        np.add.accumulate(time_arr[start:end], out=time_arr[start:end])
+
+    df = pd.DataFrame(
+        {'time': time_arr, 'value': np.concatenate(samples),
+         'label': np.repeat(df['label'].values, lengths),
+         'location': np.repeat(df['location'].values, lengths)}, columns=columns)
+    df['value'] = df['value'].astype('int')
+
+    return df
+
+
+def format_data_for_classification_iterative(df):
+    """
+    Formats raw audio data: Separate out individual records
     """
 
     columns = ['time', 'value', 'label', 'location']
@@ -29,8 +129,7 @@ def format_data_for_classification(df):
 
         label = df.ix[idx]['label']
         location = df.ix[idx]['location']
-        values = df.ix[idx]['value']
-        values = values.split(',')
+        values = record_samples(df.ix[idx])
         len_values = len(values)
         # logger.debug("Length: %s", len_values)
 
@@ -52,8 +151,7 @@ def format_data_for_classification(df):
     curr_time = float(df.ix[idx]['timestamp'])
     label = df.ix[idx]['label']
     location = df.ix[idx]['location']
-    values = df.ix[idx]['value']
-    values = values.split(',')
+    values = record_samples(df.ix[idx])
     len_values = len(values)
     # logger.debug("Length: %s", len_values)
     # logger.debug("Fraction: %s", frac)
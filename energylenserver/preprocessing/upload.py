@@ -0,0 +1,221 @@
+"""
+Single pass preparation of the uploaded sensor data files
+
+The uploaded file is read once and its records are validated, preprocessed
+for their sensor and written to the file loaded into the database
+(LOAD DATA) by phoneDataHandler:
+    wifi: scans averaged per second (wifi.format_data), in chunks of
+          upload_chunk_size rows
+    rawaudio: samples of each record encoded as int16 (audio.encode_samples)
+              and written in hex
+    others: records with a missing or non-numeric timestamp (and MFCCs
+            with -Infinity) dropped line by line, the other records
+            written as received
+"""
+
+import csv
+import math
+import binascii
+
+import pandas as pd
+
+from energylenserver.constants import upload_chunk_size
+from energylenserver.preprocessing import wifi
+from energylenserver.preprocessing import audio
+
+# Enable Logging
+import logging
+logger = logging.getLogger('energylensplus_django')
+
+
+def is_timestamp(value):
+    """
+    Checks if the value is a finite number
+    (missing values such as NaN, NULL or N/A are not)
+    """
+    try:
+        timestamp = float(value)
+    except ValueError:
+        return False
+    return not (math.isnan(timestamp) or math.isinf(timestamp))
+
+
+class UploadFormatError(Exception):
+
+    """
+    Uploaded file not in the expected format
+    accepted: whether the upload is acknowledged to the phone
+    """
+
+    def __init__(self, message, accepted=False):
+        Exception.__init__(self, message)
+        self.accepted = accepted
+
+
+def prepare_file(sensor_name, src, filepath, chunk_size=upload_chunk_size):
+    """
+    Reads the uploaded file and writes the preprocessed records to filepath
+
+    :param src: uploaded file (file-like)
+    Returns: dict with the number of records written and their first and
+    last timestamp
+    """
+    summary = {'rows': 0, 'start_time': None, 'end_time': None}
+    with open(filepath, "w") as dst:
+        if sensor_name == 'wifi':
+            prepare_wifi(src, dst, summary, chunk_size)
+        elif sensor_name == 'rawaudio':
+            encode_rawaudio(src, dst, summary, chunk_size)
+        else:
+            filter_records(sensor_name, src, dst, summary, chunk_size)
+    return summary
+
+
+def filter_records(sensor_name, src, dst, summary, chunk_size):
+    """
+    Copies the records of the file, dropping the ones which can't be stored
+    """
+    lines = iter(src)
+    header = next(lines, '').rstrip('\r\n')
+    columns = header.split(',')
+    if "label" not in columns:
+        raise UploadFormatError("Header missing!")
+    n_columns = len(columns)
+    dst.write(header + '\n')
+
+    # Remove rows with 'Infinity' in MFCCs created
+    mfcc_idx = None
+    if sensor_name == 'audio' and 'mfcc1' in columns:
+        mfcc_idx = columns.index('mfcc1')
+
+    rows = []
+    for line in lines:
+        fields = line.rstrip('\r\n').split(',')
+        if len(fields) > n_columns or fields == ['']:
+            # Bad or blank line
+            continue
+        # Remove missing or non-numeric timestamps
+        if not is_timestamp(fields[0]):
+            continue
+        if mfcc_idx is not None and mfcc_idx < len(fields) and fields[mfcc_idx] == '-Infinity':
+            continue
+
+        if len(fields) < n_columns:
+            fields.extend([''] * (n_columns - len(fields)))
+        rows.append(fields)
+        if len(rows) == chunk_size:
+            write_rows(dst, rows, summary)
+            rows = []
+    write_rows(dst, rows, summary)
+
+
+def write_rows(dst, rows, summary):
+    if len(rows) == 0:
+        return
+    dst.write('\n'.join([','.join(fields) for fields in rows]) + '\n')
+    if summary['start_time'] is None:
+        summary['start_time'] = float(rows[0][0])
+    summary['end_time'] = float(rows[-1][0])
+    summary['rows'] += len(rows)
+
+
+def encode_rawaudio(src, dst, summary, chunk_size):
+    """
+    Writes the records with their samples encoded
+    Format: <timestamp, encoding, samples (hex), value, label, location>
+    """
+    reader = csv.reader(src, quotechar='`')
+    next(reader, None)
+    dst.write("timestamp,encoding,samples,value,label,location\n")
+
+    rows = []
+    for fields in reader:
+        if len(fields) != 4 or not is_timestamp(fields[0]) or fields[1] == '':
+            # Bad record
+            continue
+        timestamp, values, label, location = fields
+
+        try:
+            encoding, samples = audio.encode_samples(values)
+        except ValueError:
+            encoding, samples = audio.text_encoding, values
+        if encoding == audio.text_encoding:
+            row = [timestamp, str(encoding), '', '`' + samples + '`', label, location]
+        else:
+            row = [timestamp, str(encoding), binascii.hexlify(samples), '', label, location]
+
+        rows.append(row)
+        if len(rows) == chunk_size:
+            write_rows(dst, rows, summary)
+            rows = []
+    write_rows(dst, rows, summary)
+
+
+def prepare_wifi(src, dst, summary, chunk_size):
+    """
+    Writes the scans of the file averaged per second
+    """
+    reader = pd.read_csv(src, error_bad_lines=False, chunksize=chunk_size)
+    carry = None
+    carry_second = None
+    for i, chunk in enumerate(reader):
+        if i == 0 and "label" not in chunk.columns:
+            raise UploadFormatError("Header missing!")
+
+        seconds = pd.to_numeric(chunk.time, errors='coerce') // 1000
+        if carry is not None and seconds.min() < carry_second:
+            # Scans not in time order: a second may be spread over chunks
+            # already written, so the whole file is averaged at once
+            logger.debug("WiFi scans not in time order, averaging the whole file")
+            prepare_wifi_file(src, dst, summary)
+            return
+
+        # The scans of the last second are averaged with the next chunk
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+            seconds = pd.to_numeric(chunk.time, errors='coerce') // 1000
+        last_second = seconds.max()
+        if not pd.isnull(last_second):
+            carry = chunk[seconds == last_second]
+            carry_second = last_second
+            chunk = chunk[seconds != last_second]
+        else:
+            carry = None
+
+        write_scans(dst, chunk, summary)
+    write_scans(dst, carry, summary)
+
+    if summary['rows'] == 0:
+        raise UploadFormatError("Empty wifi file sent. Upload not successful!", accepted=True)
+
+
+def prepare_wifi_file(src, dst, summary):
+    """
+    Writes the scans of the whole file averaged per second, replacing
+    the records written before
+    """
+    src.seek(0)
+    dst.seek(0)
+    dst.truncate()
+    summary.update({'rows': 0, 'start_time': None, 'end_time': None})
+
+    write_scans(dst, pd.read_csv(src, error_bad_lines=False), summary)
+
+    if summary['rows'] == 0:
+        raise UploadFormatError("Empty wifi file sent. Upload not successful!", accepted=True)
+
+
+def write_scans(dst, df, summary):
+    if df is None or len(df) == 0:
+        return
+    df = wifi.format_data(df.copy())
+    if df is False:
+        raise UploadFormatError("Incorrect wifi file sent. Upload not successful!")
+    if len(df) == 0:
+        return
+
+    df.to_csv(dst, index=False, header=summary['rows'] == 0)
+    if summary['start_time'] is None:
+        summary['start_time'] = df.time.iloc[0]
+    summary['end_time'] = df.time.iloc[-1]
+    summary['rows'] += len(df)
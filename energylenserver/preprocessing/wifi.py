@@ -12,19 +12,57 @@ import logging
 logger = logging.getLogger('energylensplus_django')
 
 
+def clean_data(ip_df):
+    """
+    Coerces the time and rssi to numbers, drops the incomplete scans and
+    converts timestamps from millisec to seconds
+    """
+    ip_df.time = pd.to_numeric(ip_df.time, errors='coerce')
+    ip_df.rssi = pd.to_numeric(ip_df.rssi, errors='coerce')
+    ip_df.dropna(inplace=True)
+
+    ip_df[ip_df.columns[0]] = (ip_df[ip_df.columns[0]] / 1000).astype('int')
+    return ip_df
+
+
 def format_data(ip_df):
     """
     Summarizes data by taking an average over a minute
+
+    Grouped version of format_data_iterative
     """
 
     try:
         # Clean up data
-        ip_df.time = ip_df.time.convert_objects(convert_numeric=True)
-        ip_df.rssi = ip_df.rssi.convert_objects(convert_numeric=True)
-        ip_df.dropna(inplace=True)
+        ip_df = clean_data(ip_df)
+
+        # Take the mean of the rssi values based on mac and time
+        mean_rssi = ip_df.groupby(['label', 'mac', 'time'])['rssi'].mean()
+    except Exception, e:
+        logger.exception("[WifiFormatException]::%s", str(e))
+        logger.debug("WifiDF::\n%s", str(ip_df.head()))
+        return False
 
-        # Convert timestamps from millisec to seconds
-        ip_df[ip_df.columns[0]] = (ip_df[ip_df.columns[0]] / 1000).astype('int')
+    # SSID of each mac (first seen)
+    mac_ssid_map = ip_df.groupby('mac')['ssid'].first()
+
+    # Output frame
+    op_df = mean_rssi.reset_index()
+    op_df.rename(columns={'mac': 'mac_id'}, inplace=True)
+    op_df['ssid'] = op_df.mac_id.map(mac_ssid_map)
+    op_df = op_df[['time', 'mac_id', 'ssid', 'rssi', 'label']].sort(['time'])
+
+    return op_df
+
+
+def format_data_iterative(ip_df):
+    """
+    Summarizes data by taking an average over a minute
+    """
+
+    try:
+        # Clean up data
+        ip_df = clean_data(ip_df)
 
         # Take the mean of the rssi values based on mac and time
         mean_rssi = ip_df.groupby(['label', 'mac', 'time'])['rssi'].mean()
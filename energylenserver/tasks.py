@@ -12,7 +12,6 @@ from __future__ import absolute_import
 from energylenserver.setup_django_envt import *
 
 import os
-import csv
 import time
 import math
 import random
@@ -35,12 +34,14 @@ Imports from EnergyLens+
 from energylenserver.models.models import *
 from energylenserver.models.DataModels import *
 from energylenserver.models import functions as mod_func
+from energylenserver.models.snapshot import get_snapshot
 
 # Core Algo imports
 from energylenserver.core import classifier
 from energylenserver.core.constants import wastage_threshold, upload_interval, no_test_data
 from energylenserver.core import functions as core_f
 from energylenserver.meter import edge_detection
+from energylenserver.meter import functions as meter_f
 from energylenserver.core import user_attribution as attrib
 from energylenserver.core import apportionment as apprt
 from energylenserver.meter import edge_matching as e_match
@@ -107,102 +108,45 @@ except Exception, e:
     elogger.error("[InternalGCMClientConnectionException] %s", e)
 '''
 
-"""
-Helper functions
-"""
-
-
-def create_file(filename):
-
-    if not os.path.isfile(filename):
-        with open(filename, "w+") as myfile:
-            writer = csv.writer(myfile)
-            writer.writerow(["timestamp", "filename"])
-
-
-def write_to_file(filename, data):
-
-    with open(filename, "a+") as myfile:
-        writer = csv.writer(myfile)
-        writer.writerow(data)
 """
 Data Handlers
 """
 
 
 @shared_task
-def phoneDataHandler(filename, sensor_name, filepath, training_status, user):
+def phoneDataHandler(filename, sensor_name, filepath, training_status, user,
+                     start_time=None, end_time=None):
     """
     Consumes sensor data streams from the phone
-    Performs some preprocessing and inserts records
+    Inserts the records, preprocessed on upload (see preprocessing/upload.py),
     into the database
 
     :param filename:
     :param sensor_name:
-    :param df_csv:
+    :param filepath:
     :param training_status:
     :param user:
+    :param start_time: first timestamp of the records
+    :param end_time: last timestamp of the records
     :return upload status:
     """
 
+    # Claim on the file released if it could not be inserted
+    claimed = False
     try:
-        filepath_full = os.path.join(dst_folder, "data_tracker.csv")
-        now_time = time.time()
-
-        # Check existence of data file tracker and act accordingly
-        if os.path.isfile(filepath_full):
-            ftracker_df = pd.read_csv(filepath_full)
-
-            if len(ftracker_df) > 0:
-
-                flag = False
-                # Don't go ahead if file already been dealt with
-                if filename in ftracker_df.filename.tolist():
-                    flag = True
-                    logger.debug("File %s already inserted in the database!", filename)
-
-                # Create new file if entries older than 5 days
-                start_timestamp = ftracker_df.ix[0]['timestamp']
-                if now_time - start_timestamp >= 5 * 24 * 3600:
-                    # new_file = os.path.join(dst_folder,
-                    #                         "prev_data_tracker_" + str(int(now_time)) + "_.csv")
-                    # Delete the tracker file
-                    try:
-                        os.unlink(filepath_full)
-                    except Exception, e:
-                        logger.error("Deletion of tracker file failed ::%s", e)
-                    # Create new file
-                    create_file(filepath_full)
-                if flag:
-                    os.remove(filepath)
-                    return
-
-        else:
-            create_file(filepath_full)
-
-        # Create a dataframe for preprocessing
-        if sensor_name != 'rawaudio':
-            try:
-                df_csv = pd.read_csv(filepath)
-            except Exception, e:
-                logger.error("[InsertDataException]::%s", str(e))
-                os.remove(filepath)
-                return
-
-        # Remove rows with 'Infinity' in MFCCs created
-        if sensor_name == 'audio':
-            if str(df_csv.mfcc1.dtype) != 'float64':
-                df_csv = df_csv[df_csv.mfcc1 != '-Infinity']
-
-        if sensor_name != 'rawaudio':
-            # logger.debug("Total number of records to insert: %d", len(df_csv))
-
-            # Remove NAN timestamps
-            df_csv.dropna(subset=[0], inplace=True)
-
-            # Create temp csv file
+        # Don't go ahead if file already been dealt with (or is being dealt with)
+        claimed = mod_func.claim_upload(filename)
+        if not claimed:
+            logger.debug("File %s already inserted in the database!", filename)
             os.remove(filepath)
-            df_csv.to_csv(filepath, index=False)
+            return
+
+        classify = sensor_name == 'wifi' and training_status is False
+        if classify and start_time is None:
+            # Time range not given with the file
+            times = pd.read_csv(filepath, usecols=['time']).time
+            if len(times) > 0:
+                start_time, end_time = times.iloc[0], times.iloc[-1]
 
         # --Initialize Model--
         if training_status is True:
@@ -213,40 +157,40 @@ def phoneDataHandler(filename, sensor_name, filepath, training_status, user):
         # --Store data in the model--
         model[0]().insert_records(user, filepath, model[1])
 
-        # Add an entry to the db -- to prevent data duplication
-        record = [now_time, filename]
-        write_to_file(filepath_full, record)
+        # Mark the file as inserted -- to prevent data duplication
+        mod_func.finish_upload(filename)
+        claimed = False
 
         logger.debug("FILE:: %s", filename)
-        '''
-        if sensor_name != 'rawaudio':
-            logger.debug("FILE:: %s", filename)
-            if len(df_csv) > 0:
-                logger.debug("%s[%s] -- [%s]", sensor_name,
-                             time.ctime(df_csv.ix[df_csv.index[0]]['time'] / 1000),
-                             time.ctime(df_csv.ix[df_csv.index[-1]]['time'] / 1000))
-            else:
-                logger.debug("%s empty!!", filename)
-        else:
-            logger.debug("FILE:: %s", filename)
-        '''
+
         # Classify location
-        if sensor_name == 'wifi' and training_status is False:
+        if classify and start_time is not None:
             logger.debug("Classifying new data for: %s with filename: %s", sensor_name, filename)
-            start_time = df_csv.ix[df_csv.index[0]]['time']
-            end_time = df_csv.ix[df_csv.index[-1]]['time']
-
             location = classifier.localize_new_data(user.apt_no, start_time, end_time, user)
             logger.debug("%s is in %s", user.name, location)
 
         upload_logger.debug("Successful Upload! File: %s", filename)
     except Exception, e:
+        if claimed:
+            mod_func.release_upload(filename)
         if "No such file or directory" in str(e):
             logger.error("[PhoneDataHandlerException]:: %s", e)
         else:
             logger.exception("[PhoneDataHandlerException]:: %s", e)
 
 
+@shared_task(name='tasks.purge_upload_registry')
+def purge_upload_registry():
+    """
+    Deletes the expired entries of the uploaded files registry
+    """
+    try:
+        n_expired = mod_func.purge_uploads()
+        logger.debug("Upload registry: %d expired entries deleted", n_expired)
+    except Exception, e:
+        logger.exception("[PurgeUploadRegistryException]:: %s", e)
+
+
 @shared_task
 def meterDataHandler(df, file_path):
     """
@@ -256,33 +200,103 @@ def meterDataHandler(df, file_path):
     meter_uuid_folder = os.path.dirname(file_path)
     uuid = meter_uuid_folder.split('/')[-1]
 
+    meter = get_active_meter(uuid)
+    if meter is None:
+        return
+
+    meter_logger.debug("Detecting Edges for Apt:: %s UUID:: %s", meter.apt_no, uuid)
+    try:
+        # -- Detect Edge --
+        edges_df = edge_detection.detect_and_filter_edges(df)
+    except Exception, e:
+        meter_logger.exception("[OuterDetectEdgeException]:: %s", str(e))
+        return
+
+    store_edges(meter, edges_df)
+
+
+@shared_task
+def meterEdgesHandler(edges_df, uuid):
+    """
+    Consumes the edges detected over the streaming meter data
+    """
+    meter = get_active_meter(uuid)
+    if meter is None:
+        return
+
+    try:
+        edges_df = edge_detection.filter_detected_edges(edges_df)
+    except Exception, e:
+        meter_logger.exception("[FilterEdgesException]:: %s", str(e))
+        return
+
+    store_edges(meter, edges_df)
+
+
+def get_active_meter(uuid):
+    """
+    Returns the meter if participants of its apartment are registered
+    """
+
     # Start the process only if participants are registered
     try:
         meter = MeterInfo.objects.get(meter_uuid=uuid)
     except MeterInfo.DoesNotExist, e:
         meter_logger.debug("No registered users for this apartment")
-        return
+        return None
 
-    apt_no = meter.apt_no
-    meter_logger.debug("Detecting Edges for Apt:: %s UUID:: %s", apt_no, uuid)
-    apt_users = mod_func.retrieve_users(apt_no)
-    if apt_users.count() == 0:
+    if len(get_snapshot(meter.apt_no).dev_ids()) == 0:
         meter_logger.debug("No active users for this apartment")
-        return
+        return None
 
-    try:
-        # -- Detect Edge --
-        edges_df = edge_detection.detect_and_filter_edges(df)
-    except Exception, e:
-        meter_logger.exception("[OuterDetectEdgeException]:: %s", str(e))
+    return meter
+
+
+def store_edges(meter, edges_df, classify=True):
+    """
+    Stores the detected edges of the meter and
+    calls the classification pipeline for each of them (if classify is set)
+
+    The metadata, the last stored edge and the stored timestamps are
+    loaded once for the batch and the edges are inserted together
+    Edges already stored are skipped, so a batch can be stored again
+
+    Returns: number of edges stored
+    """
+    apt_no = meter.apt_no
+    uuid = meter.meter_uuid
 
     # -- Store edges into db --
 
     if len(edges_df) == 0:
         meter_logger.debug("No edges detected")
-        return
+        return 0
+
+    try:
+        # Metadata of the apartment
+        snapshot = get_snapshot(apt_no)
+        metadata_df = snapshot.metadata()
+        md_index = snapshot.metadata_index()
+
+        # Last edge of the meter stored before the batch
+        edge_times = edges_df.time.astype('int')
+        try:
+            obj = Edges.objects.filter(meter=meter,
+                                       timestamp__lt=edge_times.min()).latest('timestamp')
+            last_edge = (int(obj.timestamp), math.fabs(obj.magnitude))
+        except Edges.DoesNotExist:
+            last_edge = None
+
+        # Timestamps of the edges already stored in the time range of the batch
+        stored_times = Edges.objects.filter(meter=meter,
+                                            timestamp__gte=edge_times.min(),
+                                            timestamp__lte=edge_times.max())
+        stored_times = set(int(t) for t in stored_times.values_list('timestamp', flat=True))
+    except Exception, e:
+        meter_logger.exception("[EdgeLoadException]:: %s", str(e))
+        return 0
 
-    # For the detected edge, store edge and call classification pipeline task
+    new_edges = []
     for idx in edges_df.index:
         edge = edges_df.ix[idx]
         edge_time = edge.time
@@ -291,44 +305,64 @@ def meterDataHandler(df, file_path):
         try:
 
             # Edge Filter: Forward edge only it exists in the metadata
-            data = mod_func.retrieve_metadata(apt_no)
-            metadata_df = read_frame(data, verbose=False)
             in_metadata, matched_md = exists_in_metadata(apt_no, "all", "all",
                                                          math.fabs(magnitude),
                                                          metadata_df,
-                                                         meter_logger, "dummy_user")
+                                                         meter_logger, "dummy_user",
+                                                         index=md_index)
             if not in_metadata:
                 meter_logger.debug("Detected edge of magnitude %d ignored", magnitude)
                 continue
 
-            # Check if the edge exists in the database
-            try:
+            if last_edge is not None:
                 # Edge Filter: filter periodic edges of similar mag
                 # Cause: fridge or washing machine
-                obj = Edges.objects.filter(meter=meter).latest('timestamp')
-                prev_time = int(obj.timestamp)
-                prev_mag = math.fabs(obj.magnitude)
+                prev_time, prev_mag = last_edge
                 diff = prev_mag / math.fabs(magnitude)
                 if (diff > 0.8 and diff <= 1) and (edge_time - prev_time < 60 and
                                                    math.fabs(magnitude) < 600):
                     continue
-                record = Edges.objects.get(meter=meter, timestamp=edge_time)
-            except Edges.DoesNotExist, e:
 
-                # --Store edge--
-                edge_r = Edges(timestamp=int(edge_time), time=dt.datetime.fromtimestamp(edge_time),
-                               magnitude=magnitude, type=edge.type,
-                               curr_power=edge.curr_power, meter=meter)
-                edge_r.save()
+            # Check if the edge exists in the database
+            if int(edge_time) in stored_times:
+                continue
 
-                meter_logger.debug("Edge for UUID: %s at [%s] of mag %d", uuid, time.ctime(
-                    edge['time']), edge['magnitude'])
+            # --Store edge--
+            edge_r = Edges(timestamp=int(edge_time), time=dt.datetime.fromtimestamp(edge_time),
+                           magnitude=magnitude, type=edge.type,
+                           curr_power=edge.curr_power, meter=meter)
+            new_edges.append(edge_r)
+            stored_times.add(int(edge_time))
+            last_edge = (int(edge_time), math.fabs(magnitude))
 
-                # Initiate classification pipeline
-                edgeHandler(edge_r)
         except Exception, e:
             meter_logger.error("[EdgeSaveException]:: %s", str(e))
 
+    if len(new_edges) == 0:
+        return 0
+
+    try:
+        Edges.objects.bulk_create(new_edges)
+        if not classify:
+            return len(new_edges)
+
+        # Retrieve the stored edges for their ids
+        saved_edges = Edges.objects.filter(meter=meter,
+                                           timestamp__in=[e.timestamp for e in new_edges])
+        saved_edges = saved_edges.order_by('timestamp')
+    except Exception, e:
+        meter_logger.error("[EdgeSaveException]:: %s", str(e))
+        return 0
+
+    for edge_r in saved_edges:
+        meter_logger.debug("Edge for UUID: %s at [%s] of mag %d", uuid, time.ctime(
+            edge_r.timestamp), edge_r.magnitude)
+
+        # Initiate classification pipeline
+        edgeHandler(edge_r)
+
+    return len(new_edges)
+
 
 @shared_task
 def edgeHandler(edge):
@@ -358,6 +392,67 @@ def edgeHandler(edge):
     logger.debug("Classification Pipeline ended for edge: [%s] :: %d",
                  time.ctime(edge.timestamp), edge.magnitude)
 
+@shared_task
+def trainingPowerHandler(job_id):
+    """
+    Computes the power of a training job once the meter data of its
+    interval has arrived, stores it in Metadata and informs the user
+
+    Instead of waiting, the job is re-queued for the time the missing
+    meter data is expected
+    """
+    try:
+        job = TrainingJob.objects.get(id=job_id)
+        if job.status in ['done', 'failed']:
+            return
+
+        apt_no = job.apt_no
+        required_time = meter_f.training_data_end_time(apt_no, job.end_time)
+        latest_time = meter_f.latest_meter_data_time(apt_no)
+        now = time.time()
+
+        if ((latest_time is None or latest_time < required_time) and
+                now < required_time + training_job_max_wait):
+            if latest_time is None:
+                countdown = max(required_time - now, 1)
+            else:
+                countdown = max(required_time - latest_time, 1)
+            # Checked again by the end of the wait at the latest
+            countdown = min(countdown, max(required_time + training_job_max_wait - now, 1))
+            logger.debug("Training job %s: waiting %s seconds for meter data", job_id, countdown)
+            if job.status != 'waiting':
+                job.status = 'waiting'
+                job.save()
+            trainingPowerHandler.apply_async(args=[job_id], countdown=countdown)
+            return
+
+        power = meter_f.training_compute_power(apt_no, job.start_time, job.end_time, wait=False)
+        logger.debug("Training job %s: Computed Power:: %f", job_id, power)
+
+        if power >= thresmin:
+            mod_func.store_training_metadata(apt_no, job.location, job.appliance,
+                                             job.presence_based, job.audio_based, power)
+        job.power = power
+        job.status = 'done'
+        job.save()
+
+    except Exception, e:
+        logger.exception("[TrainingPowerHandlerException]:: %s", e)
+        try:
+            job = TrainingJob.objects.get(id=job_id)
+            job.status = 'failed'
+            job.save()
+        except Exception:
+            return
+
+    # Send the result to the phone
+    message_to_send = {}
+    message_to_send['msg_type'] = 'response'
+    message_to_send['api'] = TRAINING_API
+    message_to_send['options'] = {'job_id': job.id, 'status': job.status, 'power': job.power}
+    send_notification(job.dev_id.reg_id, message_to_send)
+
+
 """
 Invokes the EnergyLens+ core algorithm
 """
@@ -636,7 +731,7 @@ def classify_edge(edge):
             if isinstance(who, list):
                 user_records = []
                 for u in who:
-                    user_records.append(mod_func.get_user(u))
+                    user_records.append(get_snapshot(apt_no).user(u))
                 who = user_records
 
         if n_users_at_home == 1:
@@ -657,9 +752,7 @@ def classify_edge(edge):
         if where != "Unknown" and what != "Unknown":
 
             # Get count of inferred appliance in the inferred location
-            data = mod_func.retrieve_metadata(apt_no)
-            metadata_df = read_frame(data, verbose=False)
-            metadata_df['appliance'] = metadata_df.appliance.apply(lambda s: s.split('_')[0])
+            metadata_df = get_snapshot(apt_no).metadata(strip_state=True)
 
             # Determine if presence based
             md_df = metadata_df.ix[:, ['appliance', 'presence_based']].drop_duplicates()
@@ -1002,7 +1095,7 @@ def apportion_energy(result_labels):
             usage /= n_users_at_home
             stayed_for = end_time - start_time
             for devid in user_list:
-                user = mod_func.get_user(devid)
+                user = get_snapshot(apt_no).user(devid)
                 '''
                 Commented for offline processing
 
@@ -1050,9 +1143,7 @@ def apportion_energy(result_labels):
                 return
 
         # Determine appliance type
-        md_records = mod_func.retrieve_metadata(apt_no)
-        metadata_df = read_frame(md_records, verbose=False)
-        metadata_df['appliance'] = metadata_df.appliance.apply(lambda s: s.split('_')[0])
+        metadata_df = get_snapshot(apt_no).metadata(strip_state=True)
         metadata_df = metadata_df[metadata_df.appliance == act_appl]
         metadata_df = metadata_df.ix[:, ['appliance', 'presence_based']].drop_duplicates()
         metadata_df.reset_index(drop=True, inplace=True)
@@ -1124,7 +1215,8 @@ def apportion_energy(result_labels):
         # Offline processing - evaluation - END
 
         presence_df = pd.DataFrame(columns=['start_time', 'end_time'])
-        users_list = [mod_func.get_user(u) for u in user_list]
+        snapshot = get_snapshot(apt_no)
+        users_list = [snapshot.user(u) for u in user_list]
         for user in users_list:
 
             user_id = user.dev_id
@@ -1218,9 +1310,7 @@ def determine_wastage(apt_no):
                 continue
 
             # Go ahead only if it is a presence based appliance
-            md_records = mod_func.retrieve_metadata(apt_no)
-            metadata_df = read_frame(md_records, verbose=False)
-            metadata_df['appliance'] = metadata_df.appliance.apply(lambda s: s.split('_')[0])
+            metadata_df = get_snapshot(apt_no).metadata(strip_state=True)
             metadata_df = metadata_df[metadata_df.appliance == what]
             metadata_df = metadata_df.ix[:, ['appliance', 'presence_based']].drop_duplicates()
             metadata_df.reset_index(drop=True, inplace=True)
@@ -5,6 +5,7 @@ urlpatterns = patterns('energylenserver.views',
                        url(r'^' + UPLOAD_DATA_API, 'upload_data'),
                        url(r'^' + UPLOAD_STATS_API, 'upload_stats'),
                        url(r'^' + REGISTRATION_API, 'register_device'),
+                       url(r'^' + TRAINING_STATUS_API, 'training_status'),
                        url(r'^' + TRAINING_API, 'training_data'),
                        url(r'^' + REAL_TIME_POWER_PAST_API, 'real_time_past_data'),
                        url(r'^' + REAL_TIME_POWER_API, 'real_time_data_access'),
@@ -10,10 +10,12 @@ from energylenserver.models.models import *
 from energylenserver.models.DataModels import *
 from energylenserver.meter.functions import *
 from energylenserver.meter.smap import *
+from energylenserver.meter.latest_power import get_latest_power
+from energylenserver.meter import rollups
 from energylenserver.functions import *
-from energylenserver.preprocessing import wifi
+from energylenserver.preprocessing import upload
 from energylenserver.api.reassign import *
-from energylenserver.tasks import phoneDataHandler
+from energylenserver.tasks import phoneDataHandler, trainingPowerHandler
 from energylenserver.models import functions as mod_func
 from energylenserver.constants import appliance_dict
 
@@ -21,6 +23,7 @@ import os
 import sys
 import json
 import time
+import numpy as np
 import pandas as pd
 import datetime as dt
 
@@ -29,6 +32,9 @@ import datetime as dt
 logger = logging.getLogger('energylensplus_django')
 upload_logger = logging.getLogger('energylensplus_upload')
 
+# Power rollups maintained by the meter data client (getmeterdata)
+rollup_folder = os.path.join(settings.BASE_DIR, 'energylenserver/data/rollups/')
+
 """
 Registration API
 """
@@ -186,6 +192,7 @@ def training_data(request):
     """
     Receives the training data labels, computes power consumption,
     and stores them as Metadata
+    With 'async' set in the request, queues a training job and returns its id
     """
 
     try:
@@ -215,51 +222,30 @@ def training_data(request):
                 apt_no = user.apt_no
                 logger.debug("Apartment Number: %d", apt_no)
 
+            # Asynchronous mode: the power is computed by a worker once the meter
+            # data of the interval has arrived; the phone polls for the result
+            if payload.get('async', False):
+                job = TrainingJob(dev_id=user, apt_no=apt_no, start_time=int(start_time),
+                                  end_time=int(end_time), location=location,
+                                  appliance=appliance, presence_based=presence_based,
+                                  audio_based=audio_based, created_at=time.time())
+                job.save()
+                trainingPowerHandler.delay(job.id)
+                logger.debug("Training job %d queued", job.id)
+
+                payload = {}
+                payload['job_id'] = job.id
+                payload['status'] = job.status
+                return HttpResponse(json.dumps(payload),
+                                    content_type="application/json")
+
             # Compute Power
             power = training_compute_power(apt_no, start_time, end_time)
             logger.debug("Computed Power:: %f", power)
 
-            # See if entry exists for appliance-location combination
-            # Update power value if it exists
             if power >= thresmin:
-                app_arr = appliance.split('-')
-                if len(app_arr) > 1:
-                    appliance = app_arr[0]
-                    how_many = int(app_arr[1])
-                else:
-                    how_many = 1
-                try:
-                    # Update power
-                    records = Metadata.objects.filter(apt_no__exact=apt_no,
-                                                      location__exact=location,
-                                                      appliance__exact=appliance,
-                                                      presence_based=presence_based,
-                                                      audio_based=audio_based)
-                    if records.count() == 1:
-                        if how_many > records[0].how_many:
-                            records.update(how_many=how_many)
-                        else:
-                            records.update(power=power)
-                        logger.debug(
-                            "Metadata with entry:%d %s %s exists", apt_no, appliance, location)
-                        logger.debug("Metadata record updated")
-                    else:
-                        # Store metadata
-                        metadata = Metadata(apt_no=apt_no,
-                                            presence_based=presence_based, audio_based=audio_based,
-                                            appliance=appliance, location=location, power=power,
-                                            how_many=how_many)
-                        metadata.save()
-                        logger.debug("Metadata creation successful!")
-                except Metadata.DoesNotExist, e:
-
-                    # Store metadata
-                    metadata = Metadata(apt_no=apt_no,
-                                        presence_based=presence_based, audio_based=audio_based,
-                                        appliance=appliance, location=location, power=power,
-                                        how_many=how_many)
-                    metadata.save()
-                    logger.debug("Metadata creation successful")
+                mod_func.store_training_metadata(apt_no, location, appliance,
+                                                 presence_based, audio_based, power)
 
             payload = {}
             payload['power'] = power
@@ -276,6 +262,41 @@ def training_data(request):
                             content_type="application/json")
 
 
+@csrf_exempt
+def training_status(request):
+    """
+    Receives the status request of a training job
+    """
+
+    try:
+        if request.method == 'GET':
+            return HttpResponse(json.dumps(ERROR_INVALID_REQUEST), content_type="application/json")
+
+        if request.method == 'POST':
+            logger.info("[POST Request Received] - %s", sys._getframe().f_code.co_name)
+            payload = json.loads(request.body)
+
+            dev_id = payload['dev_id']
+            job_id = payload['job_id']
+
+            job = mod_func.get_training_job(dev_id, job_id)
+            if isinstance(job, bool):
+                return HttpResponse(json.dumps(TRAINING_UNSUCCESSFUL),
+                                    content_type="application/json")
+
+            payload = {}
+            payload['job_id'] = job.id
+            payload['status'] = job.status
+            payload['power'] = job.power
+            return HttpResponse(json.dumps(payload),
+                                content_type="application/json")
+
+    except Exception, e:
+        logger.exception("[TrainingStatusException Occurred]::%s", e)
+        return HttpResponse(json.dumps(TRAINING_UNSUCCESSFUL),
+                            content_type="application/json")
+
+
 """
 Upload API
 """
@@ -320,56 +341,36 @@ def import_from_file(filename, csvfile):
     new_filename = ('data_file_' + sensor_name + '_' + str(
         user.dev_id) + '_' + filename_l[-2] + "_" + filename_l[-1] +
         "_" + str(int(time.time())) + '.csv')
-    path = default_storage.save(new_filename, ContentFile(csvfile.read()))
+
+    path = default_storage.get_available_name(new_filename)
     filepath = os.path.join(settings.MEDIA_ROOT, path)
 
-    # Create a dataframe for preprocessing
-    if sensor_name != 'rawaudio':
-        try:
-            df_csv = pd.read_csv(filepath, error_bad_lines=False)
+    # --Preprocess records before storing--
+    try:
+        summary = upload.prepare_file(sensor_name, csvfile, filepath)
 
-            if "label" not in df_csv.columns:
-                upload_logger.exception("[DataFileFormatIncorrect] Header missing!")
-                os.remove(filepath)
-                return False
+    except upload.UploadFormatError, e:
+        upload_logger.exception("[DataFileFormatIncorrect] %s", e)
+        os.remove(filepath)
+        return e.accepted
 
-            # --Preprocess records before storing--
-            if sensor_name == 'wifi':
-                if len(df_csv) == 0:
-                    os.remove(filepath)
-                    upload_logger.exception("[DataFileFormatIncorrect] "
-                                            "Empty wifi file sent. Upload not successful!")
-                    return True
-
-                df_csv = wifi.format_data(df_csv)
-
-                if df_csv is False:
-                    os.remove(filepath)
-                    upload_logger.exception("[DataFileFormatIncorrect] "
-                                            "Incorrect wifi file sent. Upload not successful!")
-                    return False
-
-                # Create temp wifi csv file
-                os.remove(filepath)
-                df_csv.to_csv(filepath, index=False)
-        except pd.parser.CParserError, e:
-            upload_logger.exception("[DataFileFormatIncorrect] Upload unsuccessful! :: %s", e)
-            os.remove(filepath)  # Commented for debugging
-            return True
-
-        except Exception, e:
-            if str(e) == "Passed header=0 but only 0 lines in file":
-                upload_logger.exception(
-                    "[Exception]:: Creation of dataframe failed! No lines found in the file!")
-                os.remove(filepath)
-                return False
-            else:
-                upload_logger.exception("[DataFileFormatIncorrect]:: %s", e)
-                os.remove(filepath)
-                return False
+    except pd.parser.CParserError, e:
+        upload_logger.exception("[DataFileFormatIncorrect] Upload unsuccessful! :: %s", e)
+        os.remove(filepath)  # Commented for debugging
+        return True
+
+    except Exception, e:
+        if str(e) == "Passed header=0 but only 0 lines in file":
+            upload_logger.exception(
+                "[Exception]:: Creation of dataframe failed! No lines found in the file!")
+        else:
+            upload_logger.exception("[DataFileFormatIncorrect]:: %s", e)
+        os.remove(filepath)
+        return False
 
     # Call new celery task for importing records
-    phoneDataHandler.delay(filename, sensor_name, filepath, training_status, user)
+    phoneDataHandler.delay(filename, sensor_name, filepath, training_status, user,
+                           summary['start_time'], summary['end_time'])
 
     return True
 
@@ -498,8 +499,13 @@ def real_time_data_access(request):
                 apt_no = is_user.apt_no
                 upload_logger.debug("Apartment Number:%d", apt_no)
 
-            # Get power data
-            timestamp, total_power = get_latest_power_data(apt_no)
+            # Get power data from the readings received by the meter data client,
+            # querying sMAP only if the client is not running
+            latest = get_latest_power(smap_apt_no(apt_no))
+            if latest is None:
+                timestamp, total_power = get_latest_power_data(apt_no)
+            else:
+                timestamp, total_power = latest
 
             payload = {}
             payload[timestamp] = total_power
@@ -515,6 +521,26 @@ def real_time_data_access(request):
                             content_type="application/json")
 
 
+def get_power_data(apt_no, start_time, end_time):
+    """
+    Retrieves the power of the apartment between start and end time
+    (in seconds) from the meter data
+
+    Returns: Dataframe with <time, power> or None if there is no data
+    """
+    s_time = timestamp_to_str(start_time, date_format)
+    e_time = timestamp_to_str(end_time, date_format)
+    data_df_list = get_meter_data_for_time_slice(apt_no, s_time, e_time)
+
+    if len(data_df_list) == 0:
+        return None
+
+    if len(data_df_list) > 1:
+        # Combine the power and light streams
+        return combine_streams(data_df_list)
+    return data_df_list[0].copy()
+
+
 @csrf_exempt
 def real_time_past_data(request):
     """
@@ -547,30 +573,49 @@ def real_time_past_data(request):
             # Get power data
             end_time = time.time()
             start_time = end_time - 60 * minutes
+            max_points = int(payload.get('max_points', rollup_max_points))
+
+            # Buckets of the finest resolution within the point budget
+            resolution = rollups.choose_resolution(start_time, end_time, max_points)
+            records = rollups.read_rollup(rollup_folder, smap_apt_no(apt_no), resolution,
+                                          start_time, end_time)
+            # Rollups not covering the start of the range (meter data client
+            # started or restarted since) are not used
+            if len(records) > 0 and records['time'][0] <= start_time + resolution:
+                # Buckets after the last one written (still open in the
+                # meter data client) from the raw meter data
+                tail_start = int(records['time'][-1]) + resolution
+                if tail_start < end_time:
+                    df = get_power_data(apt_no, tail_start, end_time)
+                    if df is not None:
+                        tail = rollups.summarise_readings(df['time'].values,
+                                                          df['power'].values, resolution)
+                        records = np.concatenate([records, tail[tail['time'] >= tail_start]])
+
+                upload_logger.debug("Resolution: %ds", resolution)
+                if payload.get('detail', False):
+                    # <time, min, max, mean power, energy (Wh)> of each bucket
+                    payload_body = {'resolution': resolution,
+                                    'data': zip(records['time'].tolist(),
+                                                records['min'].tolist(),
+                                                records['max'].tolist(),
+                                                records['mean'].tolist(),
+                                                records['energy'].tolist())}
+                else:
+                    payload_body = dict(zip(records['time'].astype('float').tolist(),
+                                            records['mean'].tolist()))
 
-            s_time = timestamp_to_str(start_time, date_format)
-            e_time = timestamp_to_str(end_time, date_format)
-            data_df_list = get_meter_data_for_time_slice(apt_no, s_time, e_time)
+                upload_logger.debug("Payload Size:%s", len(records))
+                return HttpResponse(json.dumps(payload_body), content_type="application/json")
 
-            if len(data_df_list) == 0:
+            # No rollups (meter data client not running): raw meter data
+            df = get_power_data(apt_no, start_time, end_time)
+            if df is None:
                 upload_logger.debug("No data to send")
                 return HttpResponse(json.dumps({}), content_type="application/json")
 
-            # Creation of the payload
-            payload = {}
-            if len(data_df_list) > 1:
-                # Combine the power and light streams
-                df = combine_streams(data_df_list)
-            else:
-                df = data_df_list[0].copy()
-
-            for idx in df.index:
-                payload[df.ix[idx]['time']] = df.ix[idx]['power']
-
-            payload_body = {}
-            # Sorting payload
-            for key in sorted(payload.iterkeys()):
-                payload_body[key] = payload[key]
+            payload_body = dict(zip(df['time'].astype('float').tolist(),
+                                    df['power'].tolist()))
 
             upload_logger.debug("Payload Size:%s", len(payload_body))
             # logger.debug("Payload", json.dumps(payload_body, indent=4)
@@ -99,6 +99,10 @@ CELERYBEAT_SCHEDULE = {
         'task': 'tasks.realtime_wastage_notif',
         'schedule': timedelta(seconds=wastage_threshold),
     },
+    'purge-upload-registry': {
+        'task': 'tasks.purge_upload_registry',
+        'schedule': timedelta(days=1),
+    },
 }
 
 # Logger Settings